@@ -1,9 +1,23 @@
-"""Awards time-based trophies."""
+"""Awards time-based trophies.
+
+Usage: python3 award_show.py [--days N]
+
+Meant to run daily. Each "years_active" rule in `Trophy.RULES` is checked with one
+query for the crabs whose anniversary fell within the last N days (just today by
+default, raise it to catch up on missed runs). Crabs that already own a trophy are
+skipped, so it's safe to re-run.
+"""
+import argparse
 from crabber import app
-from datetime import datetime
-from extensions import db
+import datetime
 import logging
-from models import Crab
+from models import Crab, Trophy
+
+parser = argparse.ArgumentParser(description="Award time-based trophies.")
+parser.add_argument(
+    "--days", type=int, default=1, help="Days of anniversaries to check (default: 1)"
+)
+args = parser.parse_args()
 
 # Prepare database connection
 app.app_context().push()
@@ -16,24 +30,40 @@ file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 logger.setLevel(logging.DEBUG)
 
+
+def years_before(day: datetime.date, years: int) -> datetime.date:
+    """Returns the date `years` before `day`, treating Feb 29 as Feb 28."""
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+def midnight(day: datetime.date) -> datetime.datetime:
+    """Returns the start of `day`."""
+    return datetime.datetime.combine(day, datetime.time())
+
+
 # Get "constant" variables
-today = datetime.utcnow().date()
+today = datetime.datetime.utcnow().date()
+one_day = datetime.timedelta(days=1)
 
 logger.info("Beginning award show.")
-# Iterate through users
-for crab in Crab.query_all():
-    logger.info(f"Checking trophies for @{crab.username}")
-    # Get per-crab variables here
-    signup_date = crab.register_time.date()
-    year_difference = today.year - signup_date.year
-    is_anniversary = today.month == signup_date.month and today.day == signup_date.day
-
-    # Trophy checks go here ###################################################
-
-    # Anniversary trophies
-    if is_anniversary:
-        if year_difference == 1:
-            logger.info(f'Awarding "One Year" to @{crab.username}')
-            crab.award(title="One Year")
-
-db.session.commit()
+for rule in Trophy.RULES:
+    if rule.counter != "years_active":
+        continue
+
+    # Crabs registered up to `rule.value` years before today. Exact rules only want
+    # those whose anniversary came in the last `args.days` days, which puts leap day
+    # signups' anniversaries on Mar 1 in other years.
+    last_day = years_before(today, rule.value)
+    criteria = [Crab.register_time < midnight(last_day + one_day)]
+    if rule.exact:
+        first_day = years_before(today - args.days * one_day, rule.value) + one_day
+        criteria.append(Crab.register_time >= midnight(first_day))
+
+    trophy = Trophy.query.get(Trophy.find(rule.title)[0])
+    awarded = trophy.award_all(*criteria)
+    logger.info(f'Awarded "{trophy.title}" to {awarded} crab(s)')
+
+logger.info("Award show finished.")
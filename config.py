@@ -47,6 +47,36 @@ MOLTS_PER_PAGE: int = 20
 NOTIFS_PER_PAGE: int = 20
 MINUTES_EDITABLE: int = 5
 MUTED_WORDS_CHAR_LIMIT: int = 2048
+# Home timelines are materialized on write unless a crab follows more than this
+TIMELINE_MAX_FOLLOWING: int = int(os.getenv("TIMELINE_MAX_FOLLOWING") or "2000")
+# Molts copied into a timeline when it's rebuilt or when following someone new
+TIMELINE_BACKFILL_LIMIT: int = 1000
+# Bump whenever rendered molt content changes (templates, patterns, rendering rules)
+# and run scripts/render_molts.py to re-render stored copies
+RENDER_VERSION: int = 1
+# How long and for how many usernames rendering remembers whether mentions exist
+MENTION_CACHE_SECONDS: int = 60
+MENTION_CACHE_SIZE: int = 10000
+# Most rendered fast-molt fragments kept per process
+FRAGMENT_CACHE_SIZE: int = 5000
+# Most new molts counted by the home timeline's "new molts" poll
+NEW_MOLTS_COUNT_LIMIT: int = 99
+# Server-Sent Events (/live/): per-stream queue length, seconds between keepalive
+# comments and seconds browsers wait before reconnecting
+LIVE_EVENTS_QUEUE_SIZE: int = 100
+LIVE_EVENTS_KEEPALIVE: int = 25
+LIVE_EVENTS_RETRY: int = 10
+# Where notifications wait to be delivered: "local" delivers them from a background
+# thread in each process, "database" keeps them in the notification_event table for
+# scripts/deliver_notifications.py
+NOTIFICATION_QUEUE: str = os.getenv("NOTIFICATION_QUEUE") or "local"
+# Most notifications delivered at once, and seconds between polls of an empty queue
+NOTIFICATION_BATCH_SIZE: int = 500
+NOTIFICATION_POLL_INTERVAL: float = 1.0
+# Times an event is delivered on its own after its batch fails before it's dropped
+NOTIFICATION_MAX_ATTEMPTS: int = 3
+# Block lists longer than this are filtered with subqueries instead of bound IDs
+BLOCK_LIST_BIND_LIMIT: int = 500
 UPLOAD_FOLDER: str = os.path.join(BASE_PATH, "static/img/user_uploads")
 ALLOWED_EXTENSIONS: Set[str] = {"png", "jpg", "jpeg"}
 # Users suggested on post-signup page
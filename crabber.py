@@ -8,6 +8,7 @@ from flask import (
     Flask,
     jsonify,
     render_template,
+    Response,
     request,
     redirect,
     send_from_directory,
@@ -16,8 +17,11 @@ from flask import (
 from flask_hcaptcha import hCaptcha
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import fragments
+import live_events
 import models
 import os
+import pagination
 import patterns
 from typing import Iterable, Tuple, Union
 import utils
@@ -138,6 +142,7 @@ def index():
     # Display page
     if current_user is not None:
         page_n = request.args.get("p", 1, type=int)
+        cursor = request.args.get("c", "")
 
         if request.args.get("ajax_json"):
             blocks = {}
@@ -146,25 +151,27 @@ def index():
                     f"timeline-ajax-{block}.html",
                     current_page="home",
                     page_n=page_n,
+                    cursor=cursor,
                 )
             return jsonify(blocks)
         else:
             if request.args.get("ajax_content"):
-                molts = current_user.query_timeline().paginate(
-                    page_n, config.MOLTS_PER_PAGE, False
-                )
+                molts = current_user.get_timeline(page_n, cursor)
+                utils.prefetch_fast_molts(molts.items)
 
                 return render_template(
                     "timeline-content.html",
                     current_page="home",
                     page_n=page_n,
                     molts=molts,
+                    timeline_watermark=current_user.timeline_watermark,
                 )
             else:
                 return render_template(
                     "timeline.html",
                     current_page="home",
                     page_n=page_n,
+                    cursor=cursor,
                 )
     else:
         featured_molt = models.Molt.query.filter_by(id=config.FEATURED_MOLT_ID).first()
@@ -192,6 +199,7 @@ def wild_west():
     # Display page
     if current_user is not None:
         page_n = request.args.get("p", 1, type=int)
+        cursor = request.args.get("c", "")
         # Ajax page switching
         if request.args.get("ajax_json"):
             blocks = dict()
@@ -200,13 +208,21 @@ def wild_west():
                     f"wild-west-ajax-{block}.html",
                     current_page="wild-west",
                     page_n=page_n,
+                    cursor=cursor,
                 )
             return jsonify(blocks)
         else:
             # Ajax content loading
             if request.args.get("ajax_content"):
                 molts = current_user.query_wild()
-                molts = molts.paginate(page_n, config.MOLTS_PER_PAGE, False)
+                molts = pagination.paginate(
+                    molts,
+                    (models.Molt.timestamp, models.Molt.id),
+                    cursor,
+                    page_n,
+                    post_filter=current_user.filter_muted_molts,
+                )
+                utils.prefetch_fast_molts(molts.items)
                 return render_template(
                     "wild-west-content.html",
                     current_page="wild-west",
@@ -219,6 +235,7 @@ def wild_west():
                     "wild-west.html",
                     current_page="wild-west",
                     page_n=page_n,
+                    cursor=cursor,
                 )
     else:
         return redirect("/login")
@@ -233,8 +250,9 @@ def notifications():
     # Display page
     elif session.get("current_user") is not None:
         page_n = request.args.get("p", 1, type=int)
+        cursor = request.args.get("c", "")
         notifications = utils.get_current_user().get_notifications(
-            paginated=True, page=page_n
+            paginated=True, page=page_n, cursor=cursor
         )
         if request.args.get("ajax_json"):
             blocks = dict()
@@ -557,7 +575,7 @@ def user(username):
         # Check if blocked (if logged in)
         current_user_is_blocked = False
         if current_user and this_user:
-            current_user_is_blocked = this_user.is_blocking(current_user)
+            current_user_is_blocked = current_user.is_blocked_by(this_user)
 
         if this_user is None or current_user_is_blocked:
             return render_template("not-found.html", noun="user")
@@ -566,6 +584,9 @@ def user(username):
             m_page_n = request.args.get("molts-p", 1, type=int)
             r_page_n = request.args.get("replies-p", 1, type=int)
             l_page_n = request.args.get("likes-p", 1, type=int)
+            m_cursor = request.args.get("molts-c", "")
+            r_cursor = request.args.get("replies-c", "")
+            l_cursor = request.args.get("likes-c", "")
 
             if request.args.get("ajax_json"):
                 blocks = dict()
@@ -584,23 +605,43 @@ def user(username):
                 hex_ID = request.args.get("hex_ID")
 
                 molts = replies = likes = None
+                muted_filter = current_user.filter_muted_molts if current_user else None
 
                 if section == "molts":
                     # TODO: Expand threads automatically
                     molts = this_user.query_profile_molts(current_user)
-                    if current_user:
-                        molts = current_user.filter_molt_query(molts)
-                    molts = molts.paginate(m_page_n, config.MOLTS_PER_PAGE, False)
+                    molts = pagination.paginate(
+                        molts,
+                        (models.Molt.timestamp, models.Molt.id),
+                        m_cursor,
+                        m_page_n,
+                        post_filter=muted_filter,
+                    )
+                    utils.prefetch_fast_molts(molts.items)
                 elif section == "replies":
                     replies = this_user.query_profile_replies(current_user)
-                    if current_user:
-                        replies = current_user.filter_molt_query(replies)
-                    replies = replies.paginate(r_page_n, config.MOLTS_PER_PAGE, False)
+                    replies = pagination.paginate(
+                        replies,
+                        (models.Molt.timestamp, models.Molt.id),
+                        r_cursor,
+                        r_page_n,
+                        post_filter=muted_filter,
+                    )
+                    utils.prefetch_fast_molts(replies.items)
                 elif section == "likes":
                     likes = this_user.query_likes()
                     if current_user:
-                        likes = current_user.filter_molt_query(likes)
-                    likes = likes.paginate(l_page_n, config.MOLTS_PER_PAGE)
+                        likes = current_user.filter_molt_query(likes, muted_words=False)
+                    likes = pagination.paginate(
+                        likes,
+                        (models.Molt.timestamp, models.Molt.id),
+                        l_cursor,
+                        l_page_n,
+                        key=lambda like: (like.molt.timestamp, like.molt.id),
+                        post_filter=muted_filter,
+                    )
+                    utils.get_viewer_state().load(like.molt for like in likes.items)
+                    utils.prefetch_alt_text(like.molt.image for like in likes.items)
                 return render_template(
                     f"profile-ajax-tab-{section}.html",
                     current_page=("own-profile" if this_user == current_user else ""),
@@ -620,6 +661,9 @@ def user(username):
                     m_page_n=m_page_n,
                     r_page_n=r_page_n,
                     l_page_n=l_page_n,
+                    m_cursor=m_cursor,
+                    r_cursor=r_cursor,
+                    l_cursor=l_cursor,
                     social_title=social_title,
                 )
 
@@ -676,9 +720,9 @@ def molt_page(username, molt_id):
         # Check if blocked (if logged in)
         is_blocked = False
         if current_user and primary_molt:
-            is_blocked = primary_molt.author.is_blocking(
-                current_user
-            ) or primary_molt.author.is_blocked_by(current_user)
+            is_blocked = current_user.is_blocked_by(
+                primary_molt.author
+            ) or current_user.is_blocking(primary_molt.author)
 
         if (
             primary_molt is None
@@ -734,6 +778,7 @@ def crabtags(crabtag):
     # Display page
     elif session.get("current_user") is not None:
         page_n = request.args.get("p", 1, type=int)
+        cursor = request.args.get("c", "")
         if request.args.get("ajax_json"):
             blocks = dict()
             for block in ("title", "heading", "body"):
@@ -742,12 +787,21 @@ def crabtags(crabtag):
                     current_page="crabtag",
                     crabtag=crabtag,
                     page_n=page_n,
+                    cursor=cursor,
                 )
             return jsonify(blocks)
         else:
             molts = models.Molt.query_fast_with_tag(crabtag)
-            molts = utils.get_current_user().filter_molt_query(molts)
-            molts = molts.paginate(page_n, config.MOLTS_PER_PAGE, False)
+            current_user = utils.get_current_user()
+            molts = current_user.filter_molt_query(molts, muted_words=False)
+            molts = pagination.paginate(
+                molts,
+                (models.Molt.timestamp, models.Molt.id),
+                cursor,
+                page_n,
+                post_filter=current_user.filter_muted_molts,
+            )
+            utils.prefetch_fast_molts(molts.items)
             return render_template(
                 (
                     "crabtag-content.html"
@@ -756,6 +810,7 @@ def crabtags(crabtag):
                 ),
                 current_page="crabtag",
                 page_n=page_n,
+                cursor=cursor,
                 molts=molts,
                 crabtag=crabtag,
             )
@@ -773,9 +828,7 @@ def bookmarks():
     elif session.get("current_user") is not None:
         current_user = utils.get_current_user()
         page_n = request.args.get("p", 1, type=int)
-        bookmarks = current_user.query_bookmarks()
-        bookmarks = utils.get_current_user().filter_molt_query(bookmarks)
-        bookmarks = bookmarks.paginate(page_n, config.MOLTS_PER_PAGE, False)
+        cursor = request.args.get("c", "")
         if request.args.get("ajax_json"):
             blocks = dict()
             for block in ("title", "heading", "body"):
@@ -783,18 +836,38 @@ def bookmarks():
                     f"bookmarks-ajax-{block}.html",
                     current_page="bookmarks",
                     page_n=page_n,
-                    bookmarks=bookmarks,
+                    cursor=cursor,
                 )
             return jsonify(blocks)
-        else:
+        elif request.args.get("ajax_content"):
+            bookmarks = current_user.query_bookmarks()
+            bookmarks = current_user.filter_molt_query(bookmarks, muted_words=False)
+            bookmarks = pagination.paginate(
+                bookmarks,
+                (models.Bookmark.timestamp, models.Bookmark.id),
+                cursor,
+                page_n,
+                post_filter=current_user.filter_muted_molts,
+            )
+            utils.get_viewer_state().load(
+                bookmark.molt for bookmark in bookmarks.items
+            )
+            utils.prefetch_alt_text(
+                bookmark.molt.image for bookmark in bookmarks.items
+            )
             return render_template(
-                "bookmarks-content.html"
-                if request.args.get("ajax_content")
-                else "bookmarks.html",
+                "bookmarks-content.html",
                 current_page="bookmarks",
                 page_n=page_n,
                 bookmarks=bookmarks,
             )
+        else:
+            return render_template(
+                "bookmarks.html",
+                current_page="bookmarks",
+                page_n=page_n,
+                cursor=cursor,
+            )
     else:
         return redirect("/login")
 
@@ -809,6 +882,7 @@ def search():
     elif session.get("current_user") is not None:
         query = request.args.get("q")
         page_n = request.args.get("p", 1, type=int)
+        cursor = request.args.get("c", "")
         ajax_content = request.args.get("ajax_content")
 
         if request.args.get("ajax_json"):
@@ -819,6 +893,7 @@ def search():
                     current_page="search",
                     query=query,
                     page_n=page_n,
+                    cursor=cursor,
                 )
             return jsonify(blocks)
         else:
@@ -830,10 +905,19 @@ def search():
                     )
                 )
                 molt_results = models.Molt.search(query)
-                molt_results = utils.get_current_user().filter_molt_query(molt_results)
-                molt_results = molt_results.paginate(
-                    page_n, config.MOLTS_PER_PAGE, False
+                current_user = utils.get_current_user()
+                molt_results = current_user.filter_molt_query(
+                    molt_results, muted_words=False
+                )
+                molt_results = pagination.paginate(
+                    molt_results,
+                    (models.Molt.timestamp, models.Molt.id),
+                    cursor,
+                    page_n,
+                    post_filter=current_user.filter_muted_molts,
                 )
+                utils.get_viewer_state().load(molt_results.items)
+                utils.prefetch_alt_text(molt.image for molt in molt_results.items)
             else:
                 molt_results = tuple()
                 crab_results = tuple()
@@ -843,6 +927,7 @@ def search():
                 current_page="search",
                 query=query,
                 page_n=page_n,
+                cursor=cursor,
                 molt_results=molt_results,
                 crab_results=crab_results,
             )
@@ -1067,21 +1152,34 @@ def ajax_request(request_type):
                 return str(crab.unread_notifications)
         return "Crab not found. Did you specify 'crab_id'?"
     if request_type == "molts_since":
-        if request.args.get("timestamp"):
+        if request.args.get("since"):
             if request.args.get("crab_id"):
-                timestamp = datetime.datetime.utcfromtimestamp(
-                    int(request.args.get("timestamp"))
-                )
                 crab = models.Crab.get_by_ID(id=request.args.get("crab_id"))
-                new_molts = crab.query_timeline().filter(
-                    models.Molt.timestamp > timestamp
-                )
-                return str(new_molts.count())
+                if crab:
+                    since = request.args.get("since", 0, type=int)
+                    return str(crab.count_new_timeline_molts(since))
 
-            else:
-                return "Crab not found. Did you specify 'crab_id'?"
+            return "Crab not found. Did you specify 'crab_id'?"
 
-        return "Did not specify 'timestamp'"
+        return "Did not specify 'since'"
+
+
+@app.route("/live/")
+def live():
+    """Streams unread notification counts and new timeline molts as they happen."""
+    current_user = utils.get_current_user()
+    if current_user is None:
+        abort(401)
+    subscription = live_events.broker.subscribe(
+        current_user.id,
+        (following_id for following_id, in current_user.query_following_ids()),
+    )
+    # The stream never touches the database, so the session is released as usual
+    return Response(
+        live_events.stream(subscription),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/api/v0/<action>/", methods=("GET", "POST"))
@@ -1105,11 +1203,14 @@ def inject_global_vars():
     location = request.path
     now = datetime.datetime.utcnow()
     return dict(
-        get_fast_molt=models.Molt.get_fast_molt,
+        fast_molts=utils.get_fast_molt_cache(),
+        fast_molt_fragment=fragments.render_fast_molt,
         current_user=current_user,
+        viewer=utils.get_viewer_state(),
         patterns=patterns,
         user_agent=utils.parse_user_agent() if config.is_debug_server else None,
         sprite_url=config.SPRITE_URL,
+        live_events_shared=live_events.bridge.shared,
         limits=config.LIMITS,
         MOLT_CHAR_LIMIT=config.MOLT_CHAR_LIMIT,
         BASE_URL=config.BASE_URL,
@@ -1151,6 +1252,12 @@ def rich_content(value: str, **kwargs):
     return utils.parse_rich_content(value, **kwargs)
 
 
+@app.template_filter()
+def stored_rich_content(molt) -> str:
+    """Returns a molt's rich content as rendered when it was written."""
+    return utils.stored_rich_content(molt)
+
+
 @app.template_filter()
 def social_link(value: str, key: str) -> str:
     """Formats string as social link if possible (Returns safe HTML)."""
@@ -1166,7 +1273,7 @@ def commafy(value):
 @app.template_filter()
 def alt_text(url, fallback_text=None):
     """Attempts to get the alt text for a given image url."""
-    text = models.ImageDescription.get_alt(url)
+    text = utils.get_alt_text(url)
     text = text or (
         fallback_text if fallback_text is not None else "No description provided."
     )
@@ -41,7 +41,12 @@ def get_crabtag(tagname):
 def get_timeline(username):
     crab = api_utils.get_crab_by_username(username)
     if crab:
-        molts = crab.query_timeline().limit(config.RSS_MOLT_LIMIT)
+        molts = (
+            # Unpaginated, so muted words are filtered in SQL
+            crab.filter_molt_query_by_muted_words(crab.query_timeline())
+            .with_entities(models.Molt)
+            .limit(config.RSS_MOLT_LIMIT)
+        )
         xml = render_template("rss_user_timeline.xml", crab=crab, molts=molts)
         return Response(xml, mimetype="text/xml")
     else:
@@ -89,7 +89,8 @@ def parse_metadata(html: str) -> Tuple[str, str, str]:
 
 with Lock("fetch-cards") as lock:
     if lock:
-        app.app_context().push()
+        # Re-rendering molts uses templates, which need a request context
+        app.test_request_context().push()
 
         for card in Card.query_unready():
             try:
@@ -112,6 +113,7 @@ with Lock("fetch-cards") as lock:
                         ):
                             card.ready = True
                             print(f"Fetched {card.url}")
+                            card.rerender_molts()
             except (URLUnreachable, URLNotFound, RequestException, KeyError):
                 pass
             if not card.ready:
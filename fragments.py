@@ -0,0 +1,191 @@
+"""Process-wide cache of rendered fast-molt HTML.
+
+Most of a fast-molt renders the same for everyone who sees it. Fragments are cached
+by the versions of the molts they show and by a small viewer class (anonymous,
+regular or moderator, and whether the viewer wrote what they're looking at). A
+molt's version is every column `Molt.query_fast_molts` selects, so edits, cards,
+counters and author profiles all lead to a new key even when another worker made
+the change.
+
+Fragments are rendered with a `FragmentViewer` in place of the request's
+`ViewerState`. It leaves numbered slots where the like/remolt/bookmark highlights
+and the localized age go, and those are filled in for each viewer.
+"""
+import config
+import datetime
+from flask import current_app, escape, Markup
+from jinja2 import pass_context
+import re
+import secrets
+from typing import Any, Dict, FrozenSet, Hashable, NamedTuple, Optional, Set, Tuple
+import utils
+
+# Slot markers carry a per-process nonce so molt content can't forge them
+SLOT_NONCE = secrets.token_hex(8)
+SLOT = re.compile(f"\x00{SLOT_NONCE}:(\\d+)\x00")
+
+# Include variables that change how a fast-molt is laid out
+LAYOUT_VARIABLES = (
+    "hide_border",
+    "hide_buttons",
+    "is_in_quote",
+    "is_parent",
+    "is_pin",
+    "show_replies",
+    "static",
+    "thread",
+)
+
+
+class MoltRef(NamedTuple):
+    """What filling in a molt's slots needs to know about it."""
+
+    id: int
+    timestamp: datetime.datetime
+
+
+class Fragment(NamedTuple):
+    """Rendered fast-molt HTML with slots for per-viewer bits."""
+
+    html: str
+    # (ViewerState method, arguments) by slot number
+    slots: Tuple[Tuple[str, tuple], ...]
+    molt_ids: FrozenSet[int]
+    author_ids: FrozenSet[int]
+
+    def fill(self, viewer) -> Markup:
+        """Returns the fragment's HTML as seen by `viewer` (a `ViewerState`)."""
+
+        def fill_slot(match):
+            method, args = self.slots[int(match.group(1))]
+            return str(escape(getattr(viewer, method)(*args)))
+
+        return Markup(SLOT.sub(fill_slot, self.html))
+
+
+class FragmentViewer:
+    """Stands in for `ViewerState` while a fragment is rendered for the cache."""
+
+    def __init__(self):
+        self.slots = list()
+
+    def slot(self, method: str, *args) -> str:
+        """Returns a marker that `Fragment.fill` replaces with `method(*args)`."""
+        self.slots.append((method, args))
+        return f"\x00{SLOT_NONCE}:{len(self.slots) - 1}\x00"
+
+    def choose(self, state: str, molt, if_true: Any, if_false: Any = "") -> str:
+        """Leaves a slot for `ViewerState.choose`."""
+        return self.slot(
+            "choose", state, MoltRef(molt.id, molt.timestamp), if_true, if_false
+        )
+
+    def age(self, molt) -> str:
+        """Leaves a slot for `ViewerState.age`."""
+        return self.slot("age", MoltRef(molt.id, molt.timestamp))
+
+
+cache: Dict[Hashable, Fragment] = dict()
+# Molt and author IDs -> keys of the cached fragments that show them
+keys_by_molt: Dict[int, Set[Hashable]] = dict()
+keys_by_author: Dict[int, Set[Hashable]] = dict()
+
+
+def version(molt) -> Optional[tuple]:
+    """Returns everything a fast-molt row can render, or None for a missing molt."""
+    return tuple(molt) if molt is not None else None
+
+
+def viewer_class(context, remolt_shell, molt, original_molt) -> Optional[tuple]:
+    """Returns what about the current user changes how a fast-molt renders."""
+    current_user = context.get("current_user")
+    if current_user is None:
+        return None
+    is_owner = molt is not None and molt.author.id == current_user.id
+    return (
+        current_user.is_moderator,
+        is_owner,
+        remolt_shell is not None and remolt_shell.author.id == current_user.id,
+        original_molt is not None and original_molt.author.id == current_user.id,
+        # Only the owner gets pin controls, and only on their own profile
+        is_owner
+        and context.get("current_page") == "own-profile"
+        and current_user.pinned == molt,
+    )
+
+
+def store(key: Hashable, fragment: Fragment):
+    """Caches a fragment, making room first if the cache is full."""
+    if len(cache) >= config.FRAGMENT_CACHE_SIZE:
+        cache.clear()
+        keys_by_molt.clear()
+        keys_by_author.clear()
+    cache[key] = fragment
+    for molt_id in fragment.molt_ids:
+        keys_by_molt.setdefault(molt_id, set()).add(key)
+    for author_id in fragment.author_ids:
+        keys_by_author.setdefault(author_id, set()).add(key)
+
+
+def discard(key: Hashable):
+    """Drops a fragment from the cache."""
+    fragment = cache.pop(key, None)
+    if fragment:
+        for molt_id in fragment.molt_ids:
+            keys_by_molt.get(molt_id, set()).discard(key)
+        for author_id in fragment.author_ids:
+            keys_by_author.get(author_id, set()).discard(key)
+
+
+def forget_molts(*molt_ids: Optional[int]):
+    """Drops the cached fragments that show any of `molt_ids`."""
+    for molt_id in molt_ids:
+        for key in list(keys_by_molt.pop(molt_id, ())):
+            discard(key)
+
+
+def forget_authors(*crab_ids: int):
+    """Drops the cached fragments that show molts by any of `crab_ids`."""
+    for crab_id in crab_ids:
+        for key in list(keys_by_author.pop(crab_id, ())):
+            discard(key)
+
+
+@pass_context
+def render_fast_molt(context, molt) -> Markup:
+    """Renders `fast-molt-body.html` for a fast-molt row, from the cache if possible.
+
+    The Molts it remolts, replies to or quotes are resolved the same way the
+    template resolves them, since they're part of the fragment.
+    """
+    fast_molts = context["fast_molts"]
+    remolt_shell = original_molt = quoted_molt = None
+    shown = molt
+    if shown is not None and shown.is_remolt:
+        remolt_shell, shown = shown, fast_molts.get(shown.original_molt_id)
+    if shown is not None and shown.is_reply:
+        original_molt = fast_molts.get(shown.original_molt_id)
+    if shown is not None and shown.is_quote:
+        quoted_molt = fast_molts.get(shown.original_molt_id)
+    molts = [m for m in (molt, shown, original_molt, quoted_molt) if m is not None]
+
+    key = (
+        tuple(version(m) for m in (molt, shown, original_molt, quoted_molt)),
+        tuple(bool(context.get(name)) for name in LAYOUT_VARIABLES),
+        viewer_class(context, remolt_shell, shown, original_molt),
+        tuple(utils.get_alt_text(m.image) if m.image else None for m in molts),
+    )
+    fragment = cache.get(key)
+    if fragment is None:
+        fragment_viewer = FragmentViewer()
+        html = current_app.jinja_env.get_template("fast-molt-body.html").render(
+            dict(context.get_all(), molt=molt, viewer=fragment_viewer)
+        )
+        fragment = Fragment(
+            html,
+            tuple(fragment_viewer.slots),
+            frozenset(m.id for m in molts),
+            frozenset(m.author.id for m in molts),
+        )
+        store(key, fragment)
+    return fragment.fill(context["viewer"])
@@ -0,0 +1,154 @@
+"""In-process pub/sub behind the `/live/` Server-Sent Events stream.
+
+Every open stream subscribes a queue for its Crab and blocks on it, which is cheap
+under gevent workers. Events are published through a bridge so that streams held
+by other worker processes hear about them too. `LocalBridge` only reaches the
+current process; a shared bridge (e.g. Redis pub/sub) only has to implement
+`publish`, hand the messages it receives to `broker.deliver` and set `shared` so
+that browsers stop polling alongside the stream.
+"""
+import config
+import json
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+Message = Dict[str, Any]
+
+
+class Subscription:
+    """One open stream's queue of (event, data) pairs."""
+
+    def __init__(self, crab_id: int, following_ids: Iterable[int]):
+        self.crab_id = crab_id
+        # Authors whose new molts this stream is told about
+        self.following_ids: Set[int] = set(following_ids)
+        self.queue: "queue.Queue[Tuple[str, Any]]" = queue.Queue(
+            maxsize=config.LIVE_EVENTS_QUEUE_SIZE
+        )
+
+    def put(self, event: str, data: Any):
+        """Queues an event, dropping it if the client has stopped reading."""
+        try:
+            self.queue.put_nowait((event, data))
+        except queue.Full:
+            pass
+
+
+class Broker:
+    """Routes published messages to this process's subscriptions."""
+
+    def __init__(self):
+        self._subscriptions: Dict[int, Set[Subscription]] = dict()
+        self._lock = threading.Lock()
+
+    def subscribe(self, crab_id: int, following_ids: Iterable[int]) -> Subscription:
+        """Opens a subscription for `crab_id`."""
+        subscription = Subscription(crab_id, following_ids)
+        with self._lock:
+            self._subscriptions.setdefault(crab_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Closes a subscription opened by `subscribe`."""
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.crab_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.crab_id, None)
+
+    def deliver(self, message: Message):
+        """Hands a bridge message to the subscriptions it concerns.
+
+        Messages either address one Crab (`crab_id`), announce a new molt to
+        everyone following its author (`author_id`) or tell a Crab's streams that
+        it (un)followed someone (`follower_id`).
+        """
+        with self._lock:
+            if "follower_id" in message:
+                for subscription in self._subscriptions.get(message["follower_id"], ()):
+                    if message["following"]:
+                        subscription.following_ids.add(message["author_id"])
+                    else:
+                        subscription.following_ids.discard(message["author_id"])
+                return
+            if "crab_id" in message:
+                subscriptions = list(self._subscriptions.get(message["crab_id"], ()))
+            else:
+                subscriptions = [
+                    subscription
+                    for crab_subscriptions in self._subscriptions.values()
+                    for subscription in crab_subscriptions
+                    if message["author_id"] in subscription.following_ids
+                ]
+        for subscription in subscriptions:
+            subscription.put(message["event"], message["data"])
+
+
+class LocalBridge:
+    """Bridge that delivers messages within the current process only."""
+
+    # Whether published messages reach every worker process
+    shared = False
+
+    def __init__(self, deliver: Callable[[Message], None]):
+        self.deliver = deliver
+
+    def publish(self, message: Message):
+        """Delivers a message to this process's subscriptions."""
+        self.deliver(message)
+
+
+broker = Broker()
+bridge = LocalBridge(broker.deliver)
+
+
+def set_bridge(new_bridge):
+    """Replaces the bridge used to publish events across workers."""
+    global bridge
+    bridge = new_bridge
+
+
+def publish_to_crab(crab_id: int, event: str, data: Any):
+    """Sends an event to every open stream of one Crab."""
+    bridge.publish(dict(crab_id=crab_id, event=event, data=data))
+
+
+def publish_molt(author_id: int, molt_id: int):
+    """Tells the followers of `author_id` that it sent a new molt."""
+    bridge.publish(dict(author_id=author_id, event="new_molt", data=molt_id))
+
+
+def publish_follow(follower_id: int, author_id: int, following: bool):
+    """Tells `follower_id`'s open streams whether to hear about `author_id`'s molts."""
+    bridge.publish(
+        dict(follower_id=follower_id, author_id=author_id, following=following)
+    )
+
+
+def format_event(event: str, data: Any) -> str:
+    """Serializes an event in the `text/event-stream` format."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(
+    subscription: Subscription, keepalive: Optional[int] = None
+) -> Iterator[str]:
+    """Yields a subscription's events until the client disconnects.
+
+    :param keepalive: Seconds of silence before sending a comment so proxies keep
+     the connection open
+    """
+    keepalive = keepalive or config.LIVE_EVENTS_KEEPALIVE
+    try:
+        # Ask browsers to wait a while before reconnecting after a drop
+        yield f"retry: {config.LIVE_EVENTS_RETRY * 1000}\n\n"
+        while True:
+            try:
+                event, data = subscription.queue.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+            else:
+                yield format_event(event, data)
+    finally:
+        broker.unsubscribe(subscription)
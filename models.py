@@ -1,18 +1,25 @@
+import collections
 import config
 import datetime
 import email.utils
 import extensions
+import fragments
+import hashlib
 from flask import render_template, url_for
 from flask_sqlalchemy import BaseQuery
 import json
+import live_events
+import notification_queue
+import pagination
 from passlib.hash import sha256_crypt
 import patterns
 import secrets
-from sqlalchemy import case, desc, func, or_
+from sqlalchemy import and_, case, desc, event, func, or_, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import aliased, Bundle
 from sqlalchemy.sql import expression
 from sqlalchemy.sql.expression import false, true, null
-from typing import Any, Iterable, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
 import utils
 
 db = extensions.db
@@ -23,6 +30,8 @@ crabtag_table = db.Table(
     db.Column("id", db.Integer, primary_key=True),
     db.Column("molt_id", db.Integer, db.ForeignKey("molt.id")),
     db.Column("tag_id", db.Integer, db.ForeignKey("crabtag.id")),
+    db.Index("ix_crabtag_links_tag_molt", "tag_id", "molt_id"),
+    db.Index("ix_crabtag_links_molt", "molt_id"),
 )
 
 # This stores unidirectional follower-followee relationships
@@ -31,6 +40,8 @@ following_table = db.Table(
     db.Column("id", db.Integer, primary_key=True),
     db.Column("follower_id", db.Integer, db.ForeignKey("crab.id")),
     db.Column("following_id", db.Integer, db.ForeignKey("crab.id")),
+    db.Index("ix_following_follower_following", "follower_id", "following_id"),
+    db.Index("ix_following_following_follower", "following_id", "follower_id"),
 )
 
 blocking_table = db.Table(
@@ -38,6 +49,22 @@ blocking_table = db.Table(
     db.Column("id", db.Integer, primary_key=True),
     db.Column("blocker_id", db.Integer, db.ForeignKey("crab.id")),
     db.Column("blocked_id", db.Integer, db.ForeignKey("crab.id")),
+    db.Index("ix_blocking_blocker_blocked", "blocker_id", "blocked_id"),
+    db.Index("ix_blocking_blocked_blocker", "blocked_id", "blocker_id"),
+)
+
+# This stores each Crab's materialized home timeline (fanned out when molts are sent)
+timeline_table = db.Table(
+    "timeline",
+    db.Column("id", db.Integer, primary_key=True),
+    db.Column("crab_id", db.Integer, db.ForeignKey("crab.id"), nullable=False),
+    db.Column("molt_id", db.Integer, db.ForeignKey("molt.id"), nullable=False),
+    db.Column("author_id", db.Integer, db.ForeignKey("crab.id"), nullable=False),
+    db.Column("timestamp", db.DateTime, nullable=False),
+    db.UniqueConstraint("crab_id", "molt_id"),
+    db.Index("ix_timeline_crab_timestamp", "crab_id", "timestamp", "molt_id"),
+    db.Index("ix_timeline_crab_author", "crab_id", "author_id"),
+    db.Index("ix_timeline_molt", "molt_id"),
 )
 
 
@@ -125,6 +152,24 @@ class Crab(db.Model):
         "preferences", db.String(4096), nullable=False, default="{}"
     )
 
+    # (blocked IDs, blocker IDs) loaded by `Crab.block_sets`, cleared on (un)block
+    _block_sets: Optional[Tuple[Set[int], Set[int]]] = None
+    # IDs of the trophies this Crab owns, loaded by `Crab.trophy_ids`
+    _trophy_ids: Optional[Set[int]] = None
+
+    # Whether `timeline_table` currently holds this Crab's home timeline
+    timeline_built = db.Column(
+        db.Boolean, nullable=False, default=False, server_default=false()
+    )
+    # ID of the newest molt added to this Crab's home timeline by someone else
+    timeline_watermark = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    # Unread notifications from active senders, maintained on write
+    unread_notification_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
     # Used for efficient queries in templates
     column_dict = dict(
         id=id,
@@ -167,7 +212,7 @@ class Crab(db.Model):
     @property
     def timedelta(self):
         """Returns time offset for user's timezone."""
-        return datetime.timedelta(hours=float(self.timezone))
+        return utils.timezone_offset(self.timezone)
 
     @property
     def is_admin(self) -> bool:
@@ -179,6 +224,11 @@ class Crab(db.Model):
         """Returns whether the user is a website moderator."""
         return self.username.lower() in [*config.MODERATORS, *config.ADMINS]
 
+    @property
+    def is_active(self) -> bool:
+        """Returns whether the user is neither banned nor deleted."""
+        return not (self.banned or self.deleted)
+
     @property
     def muted_words(self) -> List[str]:
         """Returns a list of the words this user has muted."""
@@ -189,6 +239,11 @@ class Crab(db.Model):
         """Returns a comma-separated list of the words this user has muted."""
         return ", ".join(self.muted_words)
 
+    @property
+    def muted_words_pattern(self):
+        """Returns a compiled regex matching any muted word, or None."""
+        return utils.compile_muted_words(self._muted_words)
+
     @property
     def bookmarks(self):
         """Returns all bookmarks the user has where the molt is still available."""
@@ -254,6 +309,15 @@ class Crab(db.Model):
         """Returns this Crab's following count without deleted/banned users."""
         return self.query_following().count()
 
+    @property
+    def raw_following_count(self):
+        """Returns this Crab's following count including deleted/banned users."""
+        return (
+            db.session.query(func.count(following_table.c.id))
+            .filter(following_table.c.follower_id == self.id)
+            .scalar()
+        )
+
     @property
     def follower_count(self):
         """Returns this Crab's follower count without deleted/banned users."""
@@ -272,7 +336,7 @@ class Crab(db.Model):
     @property
     def unread_notifications(self):
         """Get the amount of unread notifications for this Crab."""
-        return Notification.query_all().filter_by(recipient=self, read=False).count()
+        return self.unread_notification_count
 
     @property
     def pinned(self) -> Optional["Molt"]:
@@ -350,14 +414,23 @@ class Crab(db.Model):
         mutuals = crab_followers.filter(Crab.id.in_(self_following))
         return mutuals
 
+    @property
+    def preferences(self) -> dict:
+        """Returns user's preferences, decoding them only when they've changed."""
+        raw_preferences = self._preferences
+        cached = getattr(self, "_decoded_preferences", None)
+        if cached is None or cached[0] != raw_preferences:
+            cached = (raw_preferences, json.loads(raw_preferences))
+            self._decoded_preferences = cached
+        return cached[1]
+
     def get_preference(self, key: str, default: Optional[Any] = None):
         """Gets key from user's preferences."""
-        preferences_dict = json.loads(self._preferences)
-        return preferences_dict.get(key, default)
+        return self.preferences.get(key, default)
 
     def set_preference(self, key: str, value: Any):
         """Sets a value in user's preferences."""
-        preferences_dict = json.loads(self._preferences)
+        preferences_dict = dict(self.preferences)
         preferences_dict[key] = value
         self._preferences = json.dumps(preferences_dict)
         db.session.commit()
@@ -439,7 +512,9 @@ class Crab(db.Model):
         new_username = f"crab{utils.hexID(8)}"
         while not utils.validate_username(new_username):
             new_username = f"crab{utils.hexID(8)}"
+        old_username = self.username
         self.username = new_username
+        Molt.forget_rendered_mentions(old_username, new_username)
         db.session.commit()
 
     def clear_display_name(self):
@@ -465,8 +540,15 @@ class Crab(db.Model):
     def ban(self, reason=None):
         """Banish this user from the site."""
         if not self.banned:
+            was_active = self.is_active
             self.banned = True
+            if was_active:
+                self.recount_engagement()
+            Molt.forget_rendered_mentions(self.username)
             db.session.commit()
+            if was_active:
+                self.refresh_notified_crabs()
+            fragments.forget_authors(self.id)
 
             if config.MAIL_ENABLED:
                 # Send ban notification email
@@ -484,7 +566,13 @@ class Crab(db.Model):
         """Restore a banned user's access to the site."""
         if self.banned:
             self.banned = False
+            if self.is_active:
+                self.recount_engagement()
+            Molt.forget_rendered_mentions(self.username)
             db.session.commit()
+            if self.is_active:
+                self.refresh_notified_crabs()
+            fragments.forget_authors(self.id)
 
             if config.MAIL_ENABLED:
                 # Send ban notification email
@@ -506,58 +594,33 @@ class Crab(db.Model):
         self.pinned_molt_id = None
         db.session.commit()
 
-    def get_notifications(self, paginated=False, page=1):
-        """Return all valid notifications for user."""
-        blocker_ids = db.session.query(blocking_table.c.blocker_id).filter(
-            blocking_table.c.blocked_id == self.id
-        )
-        blocked_ids = db.session.query(blocking_table.c.blocked_id).filter(
-            blocking_table.c.blocker_id == self.id
-        )
-
-        block_ids = blocked_ids.union(blocker_ids)
+    def get_notifications(self, paginated=False, page=1, cursor=None):
+        """Return this user's notifications page, newest first.
 
+        Items are (latest notification, count, timestamp) rows, one per
+        `NotificationGroup`.
+        """
         notifs = (
-            Notification.query_all()
-            .filter(
-                db.or_(
-                    Notification.sender_id == null(),
-                    Notification.sender_id.notin_(block_ids),
-                )
-            )
-            .filter_by(recipient=self)
-        )
-        likes = (
-            notifs.with_entities(
-                Notification,
-                func.count(Notification.id),
-                func.max(Notification.timestamp),
-            )
-            .filter_by(type="like")
-            .group_by(Notification.molt_id)
-        )
-        remolts = (
-            notifs.with_entities(
-                Notification,
-                func.count(Notification.id),
-                func.max(Notification.timestamp),
+            db.session.query(
+                Notification, NotificationGroup.count, NotificationGroup.timestamp
             )
-            .filter_by(type="remolt")
-            .join(Molt, Molt.id == Notification.molt_id)
-            .group_by(Molt.original_molt_id)
-        )
-        other = notifs.with_entities(
-            Notification,
-            expression.literal(1),
-            Notification.timestamp.label("timestamp"),
-        ).filter(
-            Notification.type.in_(
-                ("other", "warning", "trophy", "mention", "quote", "reply", "follow")
+            .select_from(NotificationGroup)
+            .join(Notification, Notification.id == NotificationGroup.notification_id)
+            .filter(NotificationGroup.recipient_id == self.id)
+            .order_by(
+                NotificationGroup.timestamp.desc(),
+                NotificationGroup.notification_id.desc(),
             )
         )
-        notifs = other.union(likes, remolts).order_by(Notification.timestamp.desc())
         if paginated:
-            return notifs.paginate(page, config.NOTIFS_PER_PAGE, False)
+            return pagination.paginate(
+                notifs,
+                (NotificationGroup.timestamp, NotificationGroup.notification_id),
+                cursor,
+                page,
+                per_page=config.NOTIFS_PER_PAGE,
+                key=lambda row: (row[2], row[0].id),
+            )
         else:
             return notifs
 
@@ -567,7 +630,32 @@ class Crab(db.Model):
             Notification.query_all().filter_by(recipient=self).filter_by(read=False)
         )
         notifs.update({"read": True}, synchronize_session=False)
+        self.unread_notification_count = 0
         db.session.commit()
+        live_events.publish_to_crab(self.id, "unread_notif", 0)
+
+    def adjust_unread_notifications(self, delta: int):
+        """Adds `delta` to this Crab's unread notification count in the database."""
+        db.session.query(Crab).filter(Crab.id == self.id).update(
+            {Crab.unread_notification_count: Crab.unread_notification_count + delta},
+            synchronize_session=False,
+        )
+        db.session.expire(self, ["unread_notification_count"])
+
+    @property
+    def trophy_ids(self) -> Set[int]:
+        """Returns the IDs of the trophies this Crab owns.
+
+        Loaded in one query and kept on this instance. `Crab.award` adds to it.
+        """
+        if self._trophy_ids is None:
+            self._trophy_ids = {
+                trophy_id
+                for trophy_id, in db.session.query(TrophyCase.trophy_id).filter(
+                    TrophyCase.owner_id == self.id
+                )
+            }
+        return self._trophy_ids
 
     def award(self, title=None, trophy=None):
         """Award user trophy by object or by title."""
@@ -576,23 +664,28 @@ class Crab(db.Model):
                 "You must specify one of either trophy object or trophy title."
             )
 
-        # Query trophy by title
+        # Look trophy up by title
         if trophy is None:
-            trophy_query = Trophy.query.filter(Trophy.title.ilike(title))
-            if trophy_query.count() == 0:
-                raise NotFoundInDatabase(f"Trophy with title: '{title}' not found.")
-            trophy = trophy_query.first()
+            trophy_id, title = Trophy.find(title)
+        else:
+            trophy_id, title = trophy.id, trophy.title
 
         # Check trophy hasn't already been awarded to user
-        if not TrophyCase.query.filter_by(owner=self, trophy=trophy).count():
-            new_trophy = TrophyCase(owner=self, trophy=trophy)
+        if trophy_id not in self.trophy_ids:
+            new_trophy = TrophyCase(owner=self, trophy_id=trophy_id)
             db.session.add(new_trophy)
+            self.trophy_ids.add(trophy_id)
 
             # Notify of new award
-            self.notify(type="trophy", content=trophy.title)
+            self.notify(type="trophy", content=title)
             db.session.commit()
             return new_trophy
 
+    def check_trophies(self, counter: str, value):
+        """Awards the trophies whose `Trophy.RULES` match a counter's new value."""
+        for title in Trophy.earned(counter, value):
+            self.award(title=title)
+
     def block(self, crab):
         """Add `crab` to this Crab's block users."""
         if crab not in self._blocked and crab is not self:
@@ -600,34 +693,178 @@ class Crab(db.Model):
             crab.unfollow(self)
             self._blocked.append(crab)
             db.session.commit()
+            self.clear_block_sets()
+            crab.clear_block_sets()
+            NotificationGroup.rebuild((self.id, crab.id))
 
     def unblock(self, crab):
         """Removes `crab` from this Crab's block users."""
         if crab in self._blocked and crab is not self:
             self._blocked.remove(crab)
             db.session.commit()
+            self.clear_block_sets()
+            crab.clear_block_sets()
+            NotificationGroup.rebuild((self.id, crab.id))
 
     def follow(self, crab):
         """Adds user to `crab`'s following."""
         if crab not in self._following and crab is not self:
             self._following.append(crab)
+            if (
+                self.timeline_built
+                and self.raw_following_count > config.TIMELINE_MAX_FOLLOWING
+            ):
+                # Materializing timelines this large isn't worth the writes
+                self.clear_timeline()
+            else:
+                self.add_timeline_author(crab)
+            self.raise_timeline_watermark(
+                db.session.query(func.max(Molt.id))
+                .filter_by(author_id=crab.id, is_reply=False, deleted=False)
+                .scalar()
+            )
 
             # Create follow notification
             crab.notify(sender=self, type="follow")
 
-            # Award applicable trophies
-            self.check_follower_count_trophies()
+            # Award applicable trophies. Only `crab` gained a follower: following
+            # someone can't earn this Crab anything.
             crab.check_follower_count_trophies()
             if self.verified:
                 crab.award(title="I Captivated the Guy")
 
             db.session.commit()
+            live_events.publish_follow(self.id, crab.id, following=True)
 
     def unfollow(self, crab):
         """Removes user from `crab`'s following."""
         if crab in self._following and crab is not self:
             self._following.remove(crab)
+            # Unbuilt timelines are read live until scripts/rebuild_timelines.py
+            if self.timeline_built:
+                self.remove_timeline_author(crab)
             db.session.commit()
+            live_events.publish_follow(self.id, crab.id, following=False)
+
+    def add_timeline_author(self, crab):
+        """Copies `crab`'s recent molts into this Crab's materialized timeline.
+
+        Molts older than `Crab.timeline_horizon` are left out, since the molts of
+        other crabs that old aren't materialized either.
+        """
+        if self.timeline_built:
+            already_present = db.session.query(timeline_table.c.molt_id).filter(
+                timeline_table.c.crab_id == self.id
+            )
+            horizon = self.timeline_horizon()
+            molts = (
+                select(
+                    expression.literal(self.id),
+                    Molt.id,
+                    Molt.author_id,
+                    Molt.timestamp,
+                )
+                .where(
+                    Molt.author_id == crab.id,
+                    Molt.is_reply == false(),
+                    Molt.deleted == false(),
+                    Molt.id.notin_(already_present),
+                )
+                .order_by(Molt.timestamp.desc())
+                .limit(config.TIMELINE_BACKFILL_LIMIT)
+            )
+            if horizon:
+                molts = molts.where(
+                    pagination.beyond((Molt.timestamp, Molt.id), "prev", horizon)
+                )
+            db.session.execute(
+                timeline_table.insert().from_select(
+                    ["crab_id", "molt_id", "author_id", "timestamp"], molts
+                )
+            )
+
+    def raise_timeline_watermark(self, molt_id: Optional[int]):
+        """Moves `timeline_watermark` up to `molt_id` if it's newer."""
+        if molt_id and molt_id > self.timeline_watermark:
+            self.timeline_watermark = molt_id
+
+    def count_new_timeline_molts(self, since: int) -> int:
+        """Counts molts by others added to this Crab's timeline after molt `since`.
+
+        Skips the timeline query entirely unless `timeline_watermark` has moved past
+        `since`, and stops counting at `config.NEW_MOLTS_COUNT_LIMIT`.
+        """
+        if self.timeline_watermark <= since:
+            return 0
+        new_molts = (
+            self.filter_molt_query_by_muted_words(self.query_timeline())
+            .filter(Molt.id > since, Molt.author_id != self.id)
+            .order_by(None)
+            .limit(config.NEW_MOLTS_COUNT_LIMIT)
+        )
+        return new_molts.count()
+
+    def remove_timeline_author(self, crab):
+        """Removes `crab`'s molts from this Crab's materialized timeline."""
+        db.session.execute(
+            timeline_table.delete().where(
+                timeline_table.c.crab_id == self.id,
+                timeline_table.c.author_id == crab.id,
+            )
+        )
+
+    def clear_timeline(self):
+        """Drops this Crab's materialized timeline."""
+        db.session.execute(
+            timeline_table.delete().where(timeline_table.c.crab_id == self.id)
+        )
+        self.timeline_built = False
+        db.session.commit()
+
+    def timeline_horizon(self) -> Optional[pagination.Key]:
+        """Returns the sort key of the oldest molt in the materialized timeline.
+
+        The timeline holds every molt from there on, older ones are only found by
+        `Crab.query_live_timeline`. None if the timeline is empty.
+        """
+        oldest = (
+            db.session.query(timeline_table.c.timestamp, timeline_table.c.molt_id)
+            .filter(timeline_table.c.crab_id == self.id)
+            .order_by(timeline_table.c.timestamp, timeline_table.c.molt_id)
+            .first()
+        )
+        return tuple(oldest) if oldest else None
+
+    def rebuild_timeline(self):
+        """Rebuilds this Crab's materialized timeline from who they follow."""
+        db.session.execute(
+            timeline_table.delete().where(timeline_table.c.crab_id == self.id)
+        )
+        following_ids = select(following_table.c.following_id).where(
+            following_table.c.follower_id == self.id
+        )
+        molts = (
+            select(
+                expression.literal(self.id),
+                Molt.id,
+                Molt.author_id,
+                Molt.timestamp,
+            )
+            .where(
+                or_(Molt.author_id == self.id, Molt.author_id.in_(following_ids)),
+                Molt.is_reply == false(),
+                Molt.deleted == false(),
+            )
+            .order_by(Molt.timestamp.desc())
+            .limit(config.TIMELINE_BACKFILL_LIMIT)
+        )
+        db.session.execute(
+            timeline_table.insert().from_select(
+                ["crab_id", "molt_id", "author_id", "timestamp"], molts
+            )
+        )
+        self.timeline_built = True
+        db.session.commit()
 
     def verify_password(self, password):
         """Returns true if `password` matches user's password."""
@@ -640,47 +877,170 @@ class Crab(db.Model):
         new_molt = Molt.create(author=self, content=content, **kwargs)
 
         # Award molt count trophies
-        molt_count = self.molt_count
-        if molt_count >= 10_000:
-            self.award(title="Please Stop")
-        if molt_count >= 1_000:
-            self.award(title="Loudmouth")
-        if molt_count == 1:
-            self.award(title="Baby Crab")
+        self.check_trophies("molt_count", self.molt_count)
 
         return new_molt
 
     def delete(self):
         """Delete user. (Can be undone)."""
+        was_active = self.is_active
         self.deleted = True
+        if was_active:
+            self.recount_engagement()
+        Molt.forget_rendered_mentions(self.username)
         db.session.commit()
+        if was_active:
+            self.refresh_notified_crabs()
+        fragments.forget_authors(self.id)
 
     def restore(self):
         """Restore deleted user."""
+        was_deleted = self.deleted
         self.deleted = False
+        if was_deleted and self.is_active:
+            self.recount_engagement()
+        Molt.forget_rendered_mentions(self.username)
         db.session.commit()
+        if was_deleted and self.is_active:
+            self.refresh_notified_crabs()
+        fragments.forget_authors(self.id)
 
-    def is_blocking(self, crab):
-        """Returns True if user has blocked `crab`."""
-        return (
-            db.session.query(blocking_table)
-            .filter(
-                (blocking_table.c.blocker_id == self.id)
-                & (blocking_table.c.blocked_id == crab.id)
-            )
-            .count()
+    def recount_engagement(self):
+        """Recounts the Molts this user has liked, remolted, replied to or quoted.
+
+        This should be called whenever the user is banned, deleted or restored.
+        """
+        db.session.flush()
+        liked = db.session.query(Like.molt_id).filter(Like.crab_id == self.id)
+        responded_to = db.session.query(Molt.original_molt_id).filter(
+            Molt.author_id == self.id, Molt.original_molt_id != null()
         )
+        molt_ids = {row[0] for row in liked.union(responded_to)}
+        Molt.recount(molt_ids)
 
-    def is_blocked_by(self, crab):
-        """Returns True if user has been blocked by `crab`."""
-        return (
-            db.session.query(blocking_table)
-            .filter(
-                (blocking_table.c.blocked_id == self.id)
-                & (blocking_table.c.blocker_id == crab.id)
+    def refresh_notified_crabs(self):
+        """Rebuilds the notification groups and unread counts of everyone notified.
+
+        This should be called whenever the user is banned, deleted or restored.
+        """
+        recipient_ids = [
+            row[0]
+            for row in db.session.query(Notification.recipient_id)
+            .filter(Notification.sender_id == self.id)
+            .distinct()
+        ]
+        NotificationGroup.rebuild(recipient_ids)
+        Crab.recount_unread_notifications(recipient_ids)
+
+    @staticmethod
+    def recount_unread_notifications(
+        crab_ids: Optional[Iterable[int]] = None, batch_size: int = 1000
+    ) -> int:
+        """Recomputes stored unread notification counts from the notification table.
+
+        :param crab_ids: IDs of Crabs to recount, or all Crabs if None
+        :param batch_size: Number of Crabs recounted per query
+        :return: Number of Crabs whose counts were wrong
+        """
+        if crab_ids is None:
+            crab_ids = [row.id for row in db.session.query(Crab.id).order_by(Crab.id)]
+        else:
+            crab_ids = list(crab_ids)
+
+        sender = aliased(Crab)
+        fixed = 0
+        for start in range(0, len(crab_ids), batch_size):
+            batch = crab_ids[start:start + batch_size]
+            counts = {crab_id: 0 for crab_id in batch}
+            unread = (
+                db.session.query(Notification.recipient_id, func.count(Notification.id))
+                .outerjoin(sender, sender.id == Notification.sender_id)
+                .filter(Notification.recipient_id.in_(batch))
+                .filter(Notification.read == false())
+                .filter(
+                    or_(
+                        Notification.sender_id == null(),
+                        and_(sender.banned == false(), sender.deleted == false()),
+                    )
+                )
+                .group_by(Notification.recipient_id)
             )
-            .count()
+            for crab_id, count in unread:
+                counts[crab_id] = count
+
+            stored = db.session.query(Crab.id, Crab.unread_notification_count).filter(
+                Crab.id.in_(batch)
+            )
+            changed = [
+                dict(id=row.id, unread_notification_count=counts[row.id])
+                for row in stored
+                if counts[row.id] != row.unread_notification_count
+            ]
+            if changed:
+                db.session.bulk_update_mappings(Crab, changed)
+                fixed += len(changed)
+            db.session.commit()
+        return fixed
+
+    @property
+    def block_sets(self) -> Tuple[Set[int], Set[int]]:
+        """Returns the IDs this Crab has blocked and the IDs that have blocked it.
+
+        Both directions are loaded in one query and cached on this instance until
+        `Crab.block` or `Crab.unblock` clears them.
+        """
+        if self._block_sets is None:
+            blocked, blockers = set(), set()
+            rows = db.session.query(
+                blocking_table.c.blocker_id, blocking_table.c.blocked_id
+            ).filter(
+                db.or_(
+                    blocking_table.c.blocker_id == self.id,
+                    blocking_table.c.blocked_id == self.id,
+                )
+            )
+            for blocker_id, blocked_id in rows:
+                if blocker_id == self.id:
+                    blocked.add(blocked_id)
+                else:
+                    blockers.add(blocker_id)
+            self._block_sets = (blocked, blockers)
+        return self._block_sets
+
+    @property
+    def block_ids(self) -> Set[int]:
+        """Returns the IDs of Crabs that this Crab has blocked or been blocked by."""
+        blocked, blockers = self.block_sets
+        return blocked | blockers
+
+    def clear_block_sets(self):
+        """Clears the cached `Crab.block_sets`."""
+        self._block_sets = None
+
+    def block_filter_ids(self):
+        """Returns `Crab.block_ids` in a form suitable for `notin_` filters.
+
+        Small block lists are bound as literal IDs. Huge ones are left to the
+        database as a subquery rather than binding thousands of parameters.
+        """
+        block_ids = self.block_ids
+        if len(block_ids) <= config.BLOCK_LIST_BIND_LIMIT:
+            return list(block_ids)
+        blocked_ids = db.session.query(blocking_table.c.blocked_id).filter(
+            blocking_table.c.blocker_id == self.id
         )
+        blocker_ids = db.session.query(blocking_table.c.blocker_id).filter(
+            blocking_table.c.blocked_id == self.id
+        )
+        return blocked_ids.union(blocker_ids)
+
+    def is_blocking(self, crab) -> bool:
+        """Returns True if user has blocked `crab`."""
+        return crab.id in self.block_sets[0]
+
+    def is_blocked_by(self, crab) -> bool:
+        """Returns True if user has been blocked by `crab`."""
+        return crab.id in self.block_sets[1]
 
     def is_following(self, crab):
         """Returns True if user is following `crab`."""
@@ -708,50 +1068,26 @@ class Crab(db.Model):
         ).first()
         return molt
 
-    def notify(self, **kwargs):
-        """Create notification for user."""
-        is_duplicate = False
-        if kwargs.get("sender") is not self:
-            # Don't notify if either user is blocked
-            sender = kwargs.get("sender")
-            if sender is not None:
-                if self.is_blocked_by(sender) or self.is_blocking(sender):
-                    return None
-
-            # Check for molt duplicates
-            molt = kwargs.get("molt")
-            if molt:
-                duplicate_notification = db.session.query(Notification.id).filter_by(
-                    recipient=self,
-                    sender=kwargs.get("sender"),
-                    type=kwargs.get("type"),
-                    molt=molt,
-                )
-                if duplicate_notification.first():
-                    is_duplicate = True
-
-            # Check for notification spamming
-            if kwargs.get("type") in ("follow", "unfollow"):
-                now = datetime.datetime.utcnow()
-                yesterday = now - datetime.timedelta(days=1)
-                duplicate_notification = (
-                    Notification.query_all()
-                    .filter_by(
-                        recipient=self,
-                        sender=kwargs.get("sender"),
-                        type=kwargs.get("type"),
-                        molt=kwargs.get("molt"),
-                    )
-                    .filter(Notification.timestamp > yesterday)
-                )
-                if duplicate_notification.count():
-                    is_duplicate = True
+    def notify(self, sender=None, type=None, molt=None, content=None, link=None):
+        """Queue a notification for user.
 
-            if not is_duplicate:
-                new_notif = Notification(recipient=self, **kwargs)
-                db.session.add(new_notif)
-                db.session.commit()
-                return new_notif
+        Commits the session first so that the notification's molt exists by the
+        time it's delivered. Delivery (`Notification.deliver`) skips notifications
+        between crabs that block each other and duplicates.
+        """
+        if sender is not self:
+            db.session.flush()
+            event = notification_queue.Event(
+                recipient_id=self.id,
+                sender_id=sender.id if sender is not None else None,
+                type=type,
+                timestamp=datetime.datetime.utcnow(),
+                molt_id=molt.id if molt is not None else None,
+                content=content,
+                link=link,
+            )
+            db.session.commit()
+            notification_queue.put(event)
 
     # Query methods
 
@@ -795,6 +1131,12 @@ class Crab(db.Model):
         )
         return blocker_ids
 
+    def query_following_ids(self) -> BaseQuery:
+        """Returns the IDs of the Crabs this user follows."""
+        return db.session.query(following_table.c.following_id).filter(
+            following_table.c.follower_id == self.id
+        )
+
     def query_following(self) -> BaseQuery:
         """Returns this Crab's following without deleted/banned users."""
         following = (
@@ -868,16 +1210,72 @@ class Crab(db.Model):
         return query
 
     def query_timeline(self) -> BaseQuery:
-        """Retrieves the molts in this user's timeline."""
+        """Retrieves the molts in this user's timeline.
+
+        Reads the materialized timeline if it's built and queries live otherwise.
+        Timelines are built by `Crab.rebuild_timeline`, never while reading them.
+        """
+        if not self.timeline_built:
+            return self.query_live_timeline()
+        return self.query_materialized_timeline()
+
+    def query_materialized_timeline(self) -> BaseQuery:
+        """Retrieves the molts in this user's timeline from `timeline_table`."""
         query = (
             Molt.query_fast_molts(self)
-            .join(following_table, following_table.c.following_id == Molt.author_id)
-            .filter(Molt.is_reply == false())
-            .filter(
-                db.or_(
-                    following_table.c.follower_id == self.id, Molt.author_id == self.id
-                )
+            .join(timeline_table, timeline_table.c.molt_id == Molt.id)
+            .filter(timeline_table.c.crab_id == self.id)
+            .order_by(None)
+            .order_by(
+                timeline_table.c.timestamp.desc(), timeline_table.c.molt_id.desc()
+            )
+        )
+        return query
+
+    @property
+    def timeline_sort_columns(self) -> Tuple[Any, Any]:
+        """Returns the (timestamp, id) columns `Crab.query_timeline` is ordered by."""
+        if self.timeline_built:
+            return timeline_table.c.timestamp, timeline_table.c.molt_id
+        return Molt.timestamp, Molt.id
+
+    def get_timeline(self, page=1, cursor=None) -> pagination.KeysetPagination:
+        """Return one page of this user's home timeline, newest first.
+
+        Pages past `Crab.timeline_horizon` are read live, so a materialized timeline
+        doesn't end where its backfill stopped.
+        """
+        query, sort_columns = self.query_timeline(), self.timeline_sort_columns
+        horizon = self.timeline_horizon() if self.timeline_built else None
+        decoded = pagination.decode_cursor(cursor)
+        if horizon and decoded and decoded[1] <= horizon:
+            query, sort_columns = self.query_live_timeline(), (Molt.timestamp, Molt.id)
+            horizon = None
+        molts = pagination.paginate(
+            query, sort_columns, cursor, page, post_filter=self.filter_muted_molts
+        )
+        if horizon and not molts.has_next:
+            older = self.query_live_timeline().filter(
+                pagination.beyond((Molt.timestamp, Molt.id), "next", horizon)
             )
+            if older.with_entities(Molt.id).first():
+                molts = pagination.KeysetPagination(
+                    molts.items,
+                    molts.page,
+                    molts.has_prev,
+                    True,
+                    pagination.default_key,
+                )
+        return molts
+
+    def query_live_timeline(self) -> BaseQuery:
+        """Retrieves the molts in this user's timeline without `timeline_table`."""
+        following_ids = select(following_table.c.following_id).where(
+            following_table.c.follower_id == self.id
+        )
+        query = Molt.query_fast_molts(self).filter(
+            Molt.is_reply == false(),
+            or_(Molt.author_id == self.id, Molt.author_id.in_(following_ids)),
         )
         return query
 
@@ -895,14 +1293,54 @@ class Crab(db.Model):
         self.password = self.hash_pass(password)
         db.session.commit()
 
-    def filter_molt_query(self, query: BaseQuery) -> BaseQuery:
-        """Filters a Molt query for all user blocks and preferences."""
+    def filter_molt_query(self, query: BaseQuery, muted_words=True) -> BaseQuery:
+        """Filters a Molt query for all user blocks and preferences.
+
+        :param muted_words: Whether to filter muted words in SQL. Paginated feeds
+         pass False and remove muted molts with `Crab.filter_muted_molts` instead.
+        """
         query = self.filter_molt_query_by_not_blocked(query)
         if not self.show_nsfw:
             query = self.filter_molt_query_by_not_nsfw(query)
-        query = self.filter_molt_query_by_muted_words(query)
+        if muted_words:
+            query = self.filter_molt_query_by_muted_words(query)
         return query
 
+    def filter_muted_molts(self, items: List[Any]) -> List[Any]:
+        """Removes fetched Molts that contain (or remolt/quote) a muted word.
+
+        Unlike `Crab.filter_molt_query_by_muted_words`, the database query doesn't
+        grow with the number of muted words: all words are matched by one cached
+        regex, and original Molts' content is loaded in a single query.
+
+        :param items: Molts, fast-molt rows, or Likes/Bookmarks holding a Molt
+        """
+        pattern = self.muted_words_pattern
+        if pattern is None or not items:
+            return items
+
+        molts = [getattr(item, "molt", item) for item in items]
+        original_ids = {
+            molt.original_molt_id for molt in molts if molt.original_molt_id
+        }
+        original_content = dict()
+        if original_ids:
+            original_content = dict(
+                db.session.query(Molt.id, Molt.content).filter(
+                    Molt.id.in_(original_ids)
+                )
+            )
+
+        kept = list()
+        for item, molt in zip(items, molts):
+            author_id = getattr(molt, "author_id", None) or molt.author.id
+            if author_id != self.id and pattern.search(molt.content):
+                continue
+            if pattern.search(original_content.get(molt.original_molt_id, "")):
+                continue
+            kept.append(item)
+        return kept
+
     def filter_molt_query_by_muted_words(self, query: BaseQuery) -> BaseQuery:
         """Filters Molts containing muted words out of a query."""
         original_molt = aliased(Molt)
@@ -938,24 +1376,17 @@ class Crab(db.Model):
 
     def filter_molt_query_by_not_blocked(self, query: BaseQuery) -> BaseQuery:
         """Filters a Molt query by authors who are not blocked."""
-        blocked_ids = db.session.query(blocking_table.c.blocked_id).filter(
-            blocking_table.c.blocker_id == self.id
-        )
-        blocker_ids = db.session.query(blocking_table.c.blocker_id).filter(
-            blocking_table.c.blocked_id == self.id
-        )
+        if not self.block_ids:
+            return query
+        block_ids = self.block_filter_ids()
         original_molt = aliased(Molt)
         query = (
-            query.filter(Molt.author_id.notin_(blocker_ids))
-            .filter(Molt.author_id.notin_(blocked_ids))
+            query.filter(Molt.author_id.notin_(block_ids))
             .outerjoin(original_molt, original_molt.id == Molt.original_molt_id)
             .filter(
                 db.or_(
-                    Molt.original_molt == null(),
-                    db.and_(
-                        original_molt.author_id.notin_(blocked_ids),
-                        original_molt.author_id.notin_(blocker_ids),
-                    ),
+                    Molt.original_molt_id == null(),
+                    original_molt.author_id.notin_(block_ids),
                 )
             )
         )
@@ -975,30 +1406,20 @@ class Crab(db.Model):
 
     def check_follower_count_trophies(self):
         """Awards necessary follower/following trophies."""
-        following_count = self.following_count
         follower_count = self.follower_count
-        if follower_count == 1:
-            self.award(title="Social Newbie")
-        elif follower_count == 10:
-            self.award(title="Mingler")
-        elif follower_count == 100:
-            self.award(title="Life of the Party")
-        elif follower_count == 1_000:
-            self.award(title="Celebrity")
-
-        if following_count >= 20:
-            follower_ratio = follower_count / following_count
-            if follower_ratio >= 20:
-                self.award(title="20/20")
-            if follower_ratio >= 100:
-                self.award(title="The Golden Ratio")
+        self.check_trophies("follower_count", follower_count)
+
+        # Ratios only count when following at least 20 crabs and start at 20, so the
+        # following count isn't worth querying below 400 followers
+        if follower_count >= 400:
+            following_count = self.following_count
+            if following_count >= 20:
+                self.check_trophies("follower_ratio", follower_count / following_count)
 
     def filter_user_query_by_not_blocked(self, query: BaseQuery) -> BaseQuery:
         """Filters a Crab query by users who are not blocked."""
-        query = query.filter(
-            Crab.id.notin_(self.query_blocked_ids()),
-            Crab.id.notin_(self.query_blocker_ids()),
-        )
+        if self.block_ids:
+            query = query.filter(Crab.id.notin_(self.block_filter_ids()))
         return query
 
     @staticmethod
@@ -1127,14 +1548,54 @@ class Crab(db.Model):
         if "avatar" not in kwargs:
             crabatar_img = utils.make_crabatar(new_crab.username)
             new_crab.avatar = crabatar_img
+        # Nobody to follow yet, so the empty timeline is already complete
+        new_crab.timeline_built = True
         db.session.add(new_crab)
         db.session.commit()
         return new_crab
 
 
+# Mentions are resolved case-insensitively with `lower(username) IN (...)`
+db.Index("ix_crab_username_lower", func.lower(Crab.username))
+# Time-based trophies select crabs by when they registered
+db.Index("ix_crab_register_time", Crab.register_time)
+
+
+@event.listens_for(Crab.username, "set")
+def forget_renamed_mentions(crab, username, old_username, initiator):
+    """Forgets cached mention lookups for a renamed Crab's usernames."""
+    utils.forget_mentions(username, old_username)
+
+
+@event.listens_for(Crab.banned, "set")
+@event.listens_for(Crab.deleted, "set")
+def forget_deactivated_mentions(crab, value, old_value, initiator):
+    """Forgets cached mention lookups for a Crab that was (un)banned or (un)deleted."""
+    utils.forget_mentions(crab.username)
+
+
 class Molt(db.Model):
     """Molt object is the equivilant of a tweet. Create using `Crab.molt`."""
 
+    __table_args__ = (
+        # Wild west, search and crabtag feeds
+        db.Index("ix_molt_timestamp", "timestamp", "id"),
+        db.Index(
+            "ix_molt_wild",
+            "deleted",
+            "is_reply",
+            "is_remolt",
+            "is_quote",
+            "timestamp",
+        ),
+        # Profile molts/replies and live timelines
+        db.Index(
+            "ix_molt_author_reply_timestamp", "author_id", "is_reply", "timestamp"
+        ),
+        # Replies, remolts and quotes of a molt
+        db.Index("ix_molt_original_author", "original_molt_id", "author_id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
     # Static info
@@ -1177,6 +1638,19 @@ class Molt(db.Model):
     _likes = db.relationship("Like")
     edited = db.Column(db.Boolean, nullable=False, default=False)
 
+    # Engagement counters (only counting active crabs), maintained on write
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    reply_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    remolt_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    quote_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    # Rich content rendered on write, valid while `rendered_version` matches
+    # `config.RENDER_VERSION`
+    rendered_content = db.Column(db.Text, nullable=True)
+    rendered_version = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
     def __repr__(self):
         """__repr__."""
         return f"<Molt by '@{self.author.username}'>"
@@ -1206,41 +1680,21 @@ class Molt(db.Model):
         """Get all currently valid quotes of Molt."""
         return Molt.query_quotes(self)
 
-    @property
-    def quote_count(self):
-        """Get number of currently valid quotes of Molt."""
-        return Molt.query_quotes(self).count()
-
     @property
     def remolts(self):
         """Get all currently valid remolts of Molt."""
         return Molt.query_remolts(self)
 
-    @property
-    def remolt_count(self):
-        """Get number of currently valid remolts of Molt."""
-        return Molt.query_remolts(self).count()
-
     @property
     def replies(self):
         """List all currently valid Molts that reply to this Molt."""
         return self.query_replies()
 
-    @property
-    def reply_count(self):
-        """Get number of currently valid Molts that reply to this Molt."""
-        return self.query_replies().count()
-
     @property
     def likes(self):
         """List all currently valid likes of Molt."""
         return Molt.query_likes(self)
 
-    @property
-    def like_count(self):
-        """List number of currently valid likes of Molt."""
-        return Molt.query_likes(self).count()
-
     @property
     def RFC_2822(self):
         """Returns RFC 2822-compliant post date."""
@@ -1327,17 +1781,19 @@ class Molt(db.Model):
 
         # Award trophies where applicable:
 
-        lowercase_tags = [tag.lower() for tag in self.raw_tags.splitlines()]
-        if "420" in lowercase_tags:
-            self.author.award(title="Pineapple Express")
-        if "waaahhhh" in lowercase_tags:
-            self.author.award(title="Mega Freakoid")
-        if "lolcat" in lowercase_tags:
-            self.author.award(title="i can haz cheezburger?")
-        if "fffffffuuuuuuuuuuuu" in lowercase_tags:
-            self.author.award(title="f7u12")
-        if "1985" in lowercase_tags:
-            self.author.award(title="Back to the Future")
+        for tag in set(tag.lower() for tag in self.raw_tags.splitlines()):
+            for title in Trophy.earned("crabtag", tag):
+                self.author.award(title=title)
+
+        self.render_content()
+
+    def render_content(self):
+        """Stores this Molt's rich content rendered with the current rules."""
+        self.rendered_content = utils.parse_rich_content(
+            self.content, nsfw=self.nsfw, card=self.card
+        )
+        self.rendered_version = config.RENDER_VERSION
+        fragments.forget_molts(self.id)
 
     def approve(self):
         """Approve Molt so it doesn't show in reports page."""
@@ -1355,12 +1811,14 @@ class Molt(db.Model):
         """Mark molt as NSFW."""
         if not self.nsfw:
             self.nsfw = True
+            self.render_content()
             db.session.commit()
 
     def label_sfw(self):
         """Mark molt as SFW (not NOT safe for work)."""
         if self.nsfw:
             self.nsfw = False
+            self.render_content()
             db.session.commit()
 
     def semantic_content(self):
@@ -1380,6 +1838,8 @@ class Molt(db.Model):
         Returns Molt content (including embeds, tags, and mentions)
         rasterized as rich HTML.
         """
+        if not full_size_media:
+            return utils.stored_rich_content(self)
         return utils.parse_rich_content(
             self.content,
             full_size_media=full_size_media,
@@ -1494,15 +1954,13 @@ class Molt(db.Model):
         if not db.session.query(Like.id).filter_by(crab=crab, molt=self).first():
             new_like = Like(crab=crab, molt=self)
             db.session.add(new_like)
+            if crab.is_active:
+                self.adjust_counter(Molt.like_count, 1)
             self.author.notify(sender=crab, type="like", molt=self)
 
             # Check if awards are applicable:
-            if self.like_count == 10:
-                self.author.award(title="Dopamine Hit")
-            if self.like_count == 100:
-                self.author.award(title="Dopamine Addict")
-            if self.like_count == 1000:
-                self.author.award(title="Full on Junkie")
+            for title in Trophy.earned("like_count", self.like_count):
+                self.author.award(title=title)
             if (
                 "seth rogen" in self.content.lower()
                 or "sethrogen" in self.raw_tags.lower()
@@ -1514,18 +1972,81 @@ class Molt(db.Model):
 
     def unlike(self, crab):
         """Unlike Molt as `crab`."""
-        Like.query.filter_by(crab=crab, molt=self).delete()
+        removed = Like.query.filter_by(crab=crab, molt=self).delete()
+        if removed and crab.is_active:
+            self.adjust_counter(Molt.like_count, -removed)
         db.session.commit()
 
     def delete(self):
         """Delete molt."""
-        self.deleted = True
-        db.session.commit()
+        if not self.deleted:
+            self.deleted = True
+            self.remove_from_timelines()
+            self.adjust_original_counters(-1)
+            db.session.commit()
+            fragments.forget_molts(self.id)
 
     def restore(self):
         """Undelete/restore Molt."""
-        self.deleted = False
-        db.session.commit()
+        if self.deleted:
+            self.deleted = False
+            self.add_to_timelines()
+            self.adjust_original_counters(1)
+            db.session.commit()
+            fragments.forget_molts(self.id)
+
+    def add_to_timelines(self):
+        """Fans this Molt out to the materialized timelines of its author's followers."""
+        if not self.is_reply:
+            follower_ids = select(following_table.c.follower_id).where(
+                following_table.c.following_id == self.author_id
+            )
+            # Let followers' "new molts" polls know something arrived
+            db.session.query(Crab).filter(
+                Crab.id.in_(follower_ids), Crab.timeline_watermark < self.id
+            ).update({Crab.timeline_watermark: self.id}, synchronize_session=False)
+            recipients = select(
+                Crab.id,
+                expression.literal(self.id),
+                expression.literal(self.author_id),
+                expression.literal(self.timestamp, db.DateTime),
+            ).where(
+                Crab.timeline_built == true(),
+                or_(Crab.id == self.author_id, Crab.id.in_(follower_ids)),
+            )
+            db.session.execute(
+                timeline_table.insert().from_select(
+                    ["crab_id", "molt_id", "author_id", "timestamp"], recipients
+                )
+            )
+
+    def remove_from_timelines(self):
+        """Removes this Molt from every materialized timeline."""
+        db.session.execute(
+            timeline_table.delete().where(timeline_table.c.molt_id == self.id)
+        )
+
+    def adjust_counter(self, counter, delta: int):
+        """Adds `delta` to one of this Molt's engagement counters in the database.
+
+        :param counter: Counter column, e.g. `Molt.like_count`
+        """
+        db.session.query(Molt).filter(Molt.id == self.id).update(
+            {counter: counter + delta}, synchronize_session=False
+        )
+        db.session.expire(self, [counter.key])
+        fragments.forget_molts(self.id)
+
+    def adjust_original_counters(self, delta: int):
+        """Adds `delta` to the counters of the Molt this remolts/replies to/quotes."""
+        if self.original_molt_id is not None and self.author.is_active:
+            original = self.original_molt
+            if self.is_remolt:
+                original.adjust_counter(Molt.remolt_count, delta)
+            if self.is_reply:
+                original.adjust_counter(Molt.reply_count, delta)
+            if self.is_quote:
+                original.adjust_counter(Molt.quote_count, delta)
 
     # Query methods
 
@@ -1562,18 +2083,6 @@ class Molt(db.Model):
     def query_fast_molts(current_user=None) -> BaseQuery:
         """Queries fast-molts for this user."""
         editable_threshold = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
-        if current_user:
-            current_user_remolted = db.session.query(Molt.original_molt_id).filter_by(
-                author_id=current_user.id, is_remolt=True, deleted=False
-            )
-            current_user_liked = db.session.query(Like.molt_id).filter_by(
-                crab_id=current_user.id
-            )
-            current_user_bookmarked = db.session.query(Bookmark.molt_id).filter_by(
-                crab_id=current_user.id
-            )
-        else:
-            current_user_remolted = current_user_liked = current_user_bookmarked = []
         author = Bundle(
             "author",
             Crab.id,
@@ -1585,37 +2094,17 @@ class Molt(db.Model):
         card = Bundle(
             "card", Card.id, Card.title, Card.description, Card.url, Card.ready
         )
-        like_counts = (
-            db.session.query(
-                Like.molt_id.label("original_molt_id"),
-                func.count(Like.id).label("like_count"),
-            )
-            .group_by("original_molt_id")
-            .subquery("like_counts", reduce_columns=True)
-        )
-        original_molt = aliased(Molt)
-        reply_counts = (
-            db.session.query(
-                Molt.original_molt_id,
-                case(
-                    (Molt.author_id == original_molt.author_id, True),
-                    else_=False,
-                ).label("from_author"),
-                func.count(Molt.id).label("reply_count"),
-            )
-            .join(original_molt, original_molt.id == Molt.original_molt_id)
-            .filter(Molt.is_reply == true(), Molt.deleted == false())
-            .group_by(Molt.original_molt_id)
-            .subquery("reply_counts", reduce_columns=True)
-        )
-        remolt_counts = (
-            db.session.query(
-                Molt.original_molt_id.label("original_molt_id"),
-                func.count(Molt.id).label("remolt_count"),
+        # Threads are molts with a reply from their own author
+        thread_reply = aliased(Molt)
+        is_thread = (
+            db.session.query(thread_reply.id)
+            .filter(
+                thread_reply.original_molt_id == Molt.id,
+                thread_reply.author_id == Molt.author_id,
+                thread_reply.is_reply == true(),
+                thread_reply.deleted == false(),
             )
-            .filter_by(is_remolt=True, deleted=False)
-            .group_by("original_molt_id")
-            .subquery("remolt_counts", reduce_columns=True)
+            .exists()
         )
         molts = (
             db.session.query(
@@ -1629,34 +2118,23 @@ class Molt(db.Model):
                 Molt.original_molt_id,
                 Molt.nsfw,
                 Molt.timestamp,
-                case(
-                    (like_counts.c.like_count == null(), 0),
-                    else_=like_counts.c.like_count,
-                ).label("like_count"),
-                case(
-                    (reply_counts.c.reply_count == null(), 0),
-                    else_=reply_counts.c.reply_count,
-                ).label("reply_count"),
-                case(
-                    (remolt_counts.c.remolt_count == null(), 0),
-                    else_=remolt_counts.c.remolt_count,
-                ).label("remolt_count"),
+                Molt.rendered_content,
+                Molt.rendered_version,
+                Molt.like_count,
+                Molt.reply_count,
+                Molt.remolt_count,
                 case(
                     (Molt.timestamp > editable_threshold, True),
                     else_=False,
                 ).label("editable"),
-                Molt.id.in_(current_user_remolted).label("has_remolted"),
-                Molt.id.in_(current_user_liked).label("has_liked"),
-                Molt.id.in_(current_user_bookmarked).label("has_bookmarked"),
-                reply_counts.c.from_author.label("is_thread"),
+                case((Molt.reply_count > 0, is_thread), else_=False).label(
+                    "is_thread"
+                ),
                 author,
                 card,
             )
             .join(Molt.author)
             .outerjoin(Molt.card)
-            .outerjoin(like_counts)
-            .outerjoin(reply_counts)
-            .outerjoin(remolt_counts)
             .filter(Crab.banned == false(), Crab.deleted == false())
             .filter(Molt.deleted == false())
             .filter(
@@ -1665,15 +2143,164 @@ class Molt(db.Model):
                     Molt.original_molt.has(deleted=False),
                 )
             )
-            .group_by(Molt.id)
             .order_by(Molt.timestamp.desc())
         )
         if current_user:
-            molts = current_user.filter_molt_query(molts)
+            molts = current_user.filter_molt_query(molts, muted_words=False)
         else:
             Molt.filter_query_by_not_nsfw(molts)
         return molts
 
+    @staticmethod
+    def rerender(
+        molt_ids: Optional[Iterable[int]] = None,
+        stale_only: bool = True,
+        batch_size: int = 500,
+    ) -> int:
+        """Re-renders and stores the rich content of Molts.
+
+        Must be run in a request context since rendering uses templates.
+
+        :param molt_ids: IDs of Molts to re-render, or all Molts if None
+        :param stale_only: Whether to skip Molts rendered with the current rules
+        :param batch_size: Number of Molts committed at a time
+        :return: Number of Molts re-rendered
+        """
+        query = db.session.query(Molt.id).filter_by(deleted=False, is_remolt=False)
+        if molt_ids is not None:
+            query = query.filter(Molt.id.in_(list(molt_ids)))
+        if stale_only:
+            query = query.filter(
+                or_(
+                    Molt.rendered_version != config.RENDER_VERSION,
+                    Molt.rendered_content == null(),
+                )
+            )
+        ids = [row.id for row in query.order_by(Molt.id)]
+
+        for start in range(0, len(ids), batch_size):
+            batch = Molt.query.filter(
+                Molt.id.in_(ids[start:start + batch_size])
+            ).all()
+            utils.resolve_mentions(
+                username
+                for molt in batch
+                for username in patterns.mention.findall(molt.content)
+            )
+            for molt in batch:
+                molt.render_content()
+            db.session.commit()
+        return len(ids)
+
+    @staticmethod
+    def forget_rendered_mentions(*usernames: str) -> int:
+        """Marks the stored rich content of Molts mentioning `usernames` stale.
+
+        Mention links are only rendered for active users, so this is needed when one
+        is renamed, (un)banned or (un)deleted. Stale Molts render live until
+        `Molt.rerender` stores them again.
+
+        :return: Number of Molts marked stale
+        """
+        conditions = []
+        for username in {username.lower() for username in usernames}:
+            # `raw_mentions` holds one lowercase username per line
+            conditions.append(Molt.raw_mentions.like(f"{username}\n%"))
+            conditions.append(Molt.raw_mentions.like(f"%\n{username}\n%"))
+        if not conditions:
+            return 0
+        ids = [
+            row.id
+            for row in db.session.query(Molt.id).filter(
+                Molt.rendered_content != null(), or_(*conditions)
+            )
+        ]
+        if ids:
+            Molt.query.filter(Molt.id.in_(ids)).update(
+                {Molt.rendered_content: None}, synchronize_session=False
+            )
+            fragments.forget_molts(*ids)
+        return len(ids)
+
+    @staticmethod
+    def recount(
+        molt_ids: Optional[Iterable[int]] = None, batch_size: int = 1000
+    ) -> int:
+        """Recomputes stored engagement counters from the like and molt tables.
+
+        :param molt_ids: IDs of Molts to recount, or all Molts if None
+        :param batch_size: Number of Molts recounted per query
+        :return: Number of Molts whose counters were wrong
+        """
+        if molt_ids is None:
+            molt_ids = [
+                row.id for row in db.session.query(Molt.id).order_by(Molt.id)
+            ]
+        else:
+            molt_ids = list(molt_ids)
+
+        child = aliased(Molt)
+        child_author = aliased(Crab)
+        child_counts = {
+            "reply_count": child.is_reply,
+            "remolt_count": child.is_remolt,
+            "quote_count": child.is_quote,
+        }
+        fixed = 0
+        for start in range(0, len(molt_ids), batch_size):
+            batch = molt_ids[start:start + batch_size]
+            counts = {
+                molt_id: dict(
+                    id=molt_id,
+                    like_count=0,
+                    reply_count=0,
+                    remolt_count=0,
+                    quote_count=0,
+                )
+                for molt_id in batch
+            }
+
+            likes = (
+                db.session.query(Like.molt_id, func.count(Like.id))
+                .join(Crab, Crab.id == Like.crab_id)
+                .filter(Like.molt_id.in_(batch))
+                .filter(Crab.banned == false(), Crab.deleted == false())
+                .group_by(Like.molt_id)
+            )
+            for molt_id, count in likes:
+                counts[molt_id]["like_count"] = count
+
+            for counter, flag in child_counts.items():
+                children = (
+                    db.session.query(child.original_molt_id, func.count(child.id))
+                    .join(child_author, child_author.id == child.author_id)
+                    .filter(child.original_molt_id.in_(batch))
+                    .filter(flag == true(), child.deleted == false())
+                    .filter(child_author.banned == false())
+                    .filter(child_author.deleted == false())
+                    .group_by(child.original_molt_id)
+                )
+                for molt_id, count in children:
+                    counts[molt_id][counter] = count
+
+            stored = db.session.query(
+                Molt.id,
+                Molt.like_count,
+                Molt.reply_count,
+                Molt.remolt_count,
+                Molt.quote_count,
+            ).filter(Molt.id.in_(batch))
+            changed = [
+                counts[row.id]
+                for row in stored
+                if counts[row.id] != dict(row._mapping)
+            ]
+            if changed:
+                db.session.bulk_update_mappings(Molt, changed)
+                fixed += len(changed)
+            db.session.commit()
+        return fixed
+
     @staticmethod
     def get_fast_molt(molt_id, current_user=None):
         """Gets fast molt with `id` as user."""
@@ -1784,12 +2411,14 @@ class Molt(db.Model):
     @staticmethod
     def query_fast_with_tag(crabtag: Union["Crabtag", str]) -> BaseQuery:
         """Query molts containing a given crabtag."""
-        molts = Molt.query_fast_molts().join(Molt.tags)
-        if isinstance(crabtag, Crabtag):
-            molts = molts.filter(Crabtag.name == crabtag.name)
-        else:
-            molts = molts.filter(Crabtag.name == crabtag.lower())
-        return molts
+        name = crabtag.name if isinstance(crabtag, Crabtag) else crabtag.lower()
+        # A subquery rather than a join so molts repeating a tag appear once
+        tagged_ids = (
+            select(crabtag_table.c.molt_id)
+            .join(Crabtag, Crabtag.id == crabtag_table.c.tag_id)
+            .where(Crabtag.name == name)
+        )
+        return Molt.query_fast_molts().filter(Molt.id.in_(tagged_ids))
 
     @staticmethod
     def filter_query_by_not_nsfw(query: BaseQuery) -> BaseQuery:
@@ -1851,14 +2480,22 @@ class Molt(db.Model):
 
         new_molt.evaluate_contents()
         db.session.add(new_molt)
+        db.session.flush()
+        new_molt.add_to_timelines()
+        new_molt.adjust_original_counters(1)
         db.session.commit()
+        if not new_molt.is_reply:
+            live_events.publish_molt(new_molt.author_id, new_molt.id)
         return new_molt
 
 
 class Like(db.Model):
     """Represents one like given to a Molt by a Crab."""
 
-    __table_args__ = (db.UniqueConstraint("crab_id", "molt_id"),)
+    __table_args__ = (
+        db.UniqueConstraint("crab_id", "molt_id"),
+        db.Index("ix_like_molt_crab", "molt_id", "crab_id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     crab_id = db.Column(db.Integer, db.ForeignKey("crab.id"), nullable=False)
     crab = db.relationship("Crab", back_populates="_likes")
@@ -1888,6 +2525,16 @@ class Like(db.Model):
 class Notification(db.Model):
     """Represents a notificaiton given to a Crab."""
 
+    __table_args__ = (
+        db.Index(
+            "ix_notification_recipient_read_timestamp",
+            "recipient_id",
+            "read",
+            "timestamp",
+        ),
+        db.Index("ix_notification_recipient_timestamp", "recipient_id", "timestamp"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     # Crab receiving notif
     recipient_id = db.Column(db.Integer, db.ForeignKey("crab.id"), nullable=False)
@@ -1938,16 +2585,308 @@ class Notification(db.Model):
             )
         )
 
+    @staticmethod
+    def deliver(events: Iterable["notification_queue.Event"]) -> List["Notification"]:
+        """Creates the notifications for a batch of queued events.
+
+        Events between crabs that block each other are dropped, as are events
+        duplicating a notification about the same molt and follows/unfollows
+        repeated within a day. Each check is one query for the whole batch. The
+        rest are inserted together and added to their recipients' groups and
+        unread counts.
+
+        :return: The notifications created
+        """
+        events = [
+            queued for queued in events if queued.sender_id != queued.recipient_id
+        ]
+        pairs = {
+            (queued.recipient_id, queued.sender_id)
+            for queued in events
+            if queued.sender_id is not None
+        }
+        crab_ids = {crab_id for pair in pairs for crab_id in pair}
+        recipient_ids = {queued.recipient_id for queued in events}
+
+        blocked_pairs = set()
+        if pairs:
+            blocks = db.session.query(
+                blocking_table.c.blocker_id, blocking_table.c.blocked_id
+            ).filter(
+                blocking_table.c.blocker_id.in_(crab_ids),
+                blocking_table.c.blocked_id.in_(crab_ids),
+            )
+            for blocker_id, blocked_id in blocks:
+                blocked_pairs.update(
+                    ((blocker_id, blocked_id), (blocked_id, blocker_id))
+                )
+
+        # (recipient, sender, type, molt) of notifications that already exist
+        columns = (
+            Notification.recipient_id,
+            Notification.sender_id,
+            Notification.type,
+            Notification.molt_id,
+        )
+        existing = set()
+        molt_ids = {queued.molt_id for queued in events if queued.molt_id is not None}
+        if molt_ids:
+            existing.update(
+                tuple(row)
+                for row in db.session.query(*columns).filter(
+                    Notification.molt_id.in_(molt_ids),
+                    Notification.recipient_id.in_(recipient_ids),
+                )
+            )
+        spam_types = ("follow", "unfollow")
+        if any(queued.type in spam_types for queued in events):
+            yesterday = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+            existing.update(
+                tuple(row)
+                for row in Notification.query_all()
+                .with_entities(*columns)
+                .filter(
+                    Notification.type.in_(spam_types),
+                    Notification.recipient_id.in_(recipient_ids),
+                    Notification.timestamp > yesterday,
+                )
+            )
+
+        notifications = list()
+        for queued in events:
+            if (queued.recipient_id, queued.sender_id) in blocked_pairs:
+                continue
+            key = (queued.recipient_id, queued.sender_id, queued.type, queued.molt_id)
+            if queued.molt_id is not None or queued.type in spam_types:
+                if key in existing:
+                    continue
+                existing.add(key)
+            notifications.append(Notification(**queued._asdict()))
+        if not notifications:
+            db.session.commit()
+            return notifications
+
+        db.session.add_all(notifications)
+        db.session.flush()
+        NotificationGroup.add_all(notifications)
+        new_counts = collections.Counter(n.recipient_id for n in notifications)
+        db.session.query(Crab).filter(Crab.id.in_(new_counts)).update(
+            {
+                Crab.unread_notification_count: Crab.unread_notification_count
+                + case(new_counts, value=Crab.id, else_=0)
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+        unread_counts = db.session.query(Crab.id, Crab.unread_notification_count)
+        for crab_id, count in unread_counts.filter(Crab.id.in_(new_counts)):
+            live_events.publish_to_crab(crab_id, "unread_notif", count)
+        return notifications
+
     def mark_read(self, is_read=True):
         """Mark this notification as 'read' by the user."""
-        self.read = is_read
+        if self.read != is_read:
+            self.read = is_read
+            if self.sender is None or self.sender.is_active:
+                self.recipient.adjust_unread_notifications(-1 if is_read else 1)
+        db.session.commit()
+
+
+class NotificationGroup(db.Model):
+    """One row of a Crab's notifications page, maintained as notifications are sent.
+
+    Likes are grouped by liked molt and remolts by remolted molt. Every other
+    notification gets a group of its own. Rows are kept up to date by `Crab.notify`
+    and rebuilt with `NotificationGroup.rebuild` when senders are blocked, banned,
+    deleted or restored.
+    """
+
+    __tablename__ = "notification_group"
+    __table_args__ = (
+        db.UniqueConstraint("recipient_id", "type", "group_key"),
+        db.Index(
+            "ix_notification_group_recipient_timestamp",
+            "recipient_id",
+            "timestamp",
+            "notification_id",
+        ),
+    )
+
+    # Types grouped by molt. Others shown on the notifications page stand alone.
+    GROUPED_TYPES = ("like", "remolt")
+    TYPES = GROUPED_TYPES + (
+        "other",
+        "warning",
+        "trophy",
+        "mention",
+        "quote",
+        "reply",
+        "follow",
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient_id = db.Column(db.Integer, db.ForeignKey("crab.id"), nullable=False)
+    type = db.Column(db.String(32), nullable=False)
+    # Liked or remolted molt's ID for grouped types, the notification's otherwise
+    group_key = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=1)
+    # Latest notification in the group, shown on the notifications page
+    notification_id = db.Column(
+        db.Integer, db.ForeignKey("notification.id"), nullable=False
+    )
+    notification = db.relationship("Notification")
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<NotificationGroup | '{self.type}' | {self.count}>"
+
+    @staticmethod
+    def add_all(notifications: Iterable[Notification]):
+        """Counts new (flushed) notifications into their groups."""
+        notifications = list(notifications)
+        remolt_ids = [n.molt_id for n in notifications if n.type == "remolt"]
+        original_ids = dict()
+        if remolt_ids:
+            original_ids = dict(
+                db.session.query(Molt.id, Molt.original_molt_id).filter(
+                    Molt.id.in_(remolt_ids)
+                )
+            )
+
+        groups: Dict[Tuple[int, str, int], List[Notification]] = dict()
+        for notification in notifications:
+            if notification.type not in NotificationGroup.TYPES:
+                continue
+            if notification.type == "like":
+                group_key = notification.molt_id
+            elif notification.type == "remolt":
+                group_key = (
+                    original_ids.get(notification.molt_id) or notification.molt_id
+                )
+            else:
+                group_key = notification.id
+            key = (notification.recipient_id, notification.type, group_key)
+            groups.setdefault(key, list()).append(notification)
+
+        for (recipient_id, type, group_key), grouped in groups.items():
+            latest = max(grouped, key=lambda n: (n.timestamp, n.id))
+            group = NotificationGroup.query.filter_by(
+                recipient_id=recipient_id, type=type, group_key=group_key
+            )
+            values = {
+                NotificationGroup.count: NotificationGroup.count + len(grouped),
+                NotificationGroup.notification_id: latest.id,
+                NotificationGroup.timestamp: latest.timestamp,
+            }
+            if not group.update(values, synchronize_session=False):
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(
+                            NotificationGroup(
+                                recipient_id=recipient_id,
+                                type=type,
+                                group_key=group_key,
+                                count=len(grouped),
+                                notification_id=latest.id,
+                                timestamp=latest.timestamp,
+                            )
+                        )
+                except IntegrityError:
+                    # Another process started the group first
+                    group.update(values, synchronize_session=False)
+
+    @staticmethod
+    def rebuild(recipient_ids: Optional[Iterable[int]] = None) -> int:
+        """Rebuilds notification groups from the notifications table.
+
+        Notifications from inactive senders or from crabs blocking (or blocked by)
+        the recipient are left out.
+
+        :param recipient_ids: IDs of Crabs whose groups to rebuild, or all if None
+        :return: Number of groups built
+        """
+        delete = NotificationGroup.__table__.delete()
+        if recipient_ids is not None:
+            recipient_ids = list(recipient_ids)
+            delete = delete.where(NotificationGroup.recipient_id.in_(recipient_ids))
+        db.session.execute(delete)
+
+        molt = aliased(Molt)
+        group_key = case(
+            (Notification.type == "like", Notification.molt_id),
+            (
+                Notification.type == "remolt",
+                func.coalesce(molt.original_molt_id, Notification.molt_id),
+            ),
+            else_=Notification.id,
+        )
+        blocked = (
+            select(blocking_table.c.id)
+            .where(
+                or_(
+                    and_(
+                        blocking_table.c.blocker_id == Notification.recipient_id,
+                        blocking_table.c.blocked_id == Notification.sender_id,
+                    ),
+                    and_(
+                        blocking_table.c.blocker_id == Notification.sender_id,
+                        blocking_table.c.blocked_id == Notification.recipient_id,
+                    ),
+                )
+            )
+            .exists()
+        )
+        groups = (
+            select(
+                Notification.recipient_id,
+                Notification.type,
+                group_key,
+                func.count(Notification.id),
+                func.max(Notification.id),
+                func.max(Notification.timestamp),
+            )
+            .join_from(
+                Notification, molt, molt.id == Notification.molt_id, isouter=True
+            )
+            .where(
+                Notification.type.in_(NotificationGroup.TYPES),
+                or_(
+                    Notification.sender_id == null(),
+                    Notification.sender.has(deleted=False, banned=False),
+                ),
+                ~blocked,
+            )
+            .group_by(Notification.recipient_id, Notification.type, group_key)
+        )
+        if recipient_ids is not None:
+            groups = groups.where(Notification.recipient_id.in_(recipient_ids))
+        result = db.session.execute(
+            NotificationGroup.__table__.insert().from_select(
+                [
+                    "recipient_id",
+                    "type",
+                    "group_key",
+                    "count",
+                    "notification_id",
+                    "timestamp",
+                ],
+                groups,
+            )
+        )
         db.session.commit()
+        return result.rowcount
 
 
 # Stores what users have what trophies
 class TrophyCase(db.Model):
     """Represents the possession of a Trophy by a Crab."""
 
+    __table_args__ = (
+        # `Crab.trophy_ids` and awarding trophies in bulk
+        db.Index("ix_trophy_case_owner_trophy", "owner_id", "trophy_id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     # Crab who owns trophy
     owner_id = db.Column(db.Integer, db.ForeignKey("crab.id"), nullable=False)
@@ -1971,6 +2910,24 @@ class TrophyCase(db.Model):
         return db.session.query(func.count(TrophyCase.id)).first()[0]
 
 
+class TrophyRule(NamedTuple):
+    """Awards the trophy titled `title` when `counter` reaches `value`.
+
+    Counters are checked with `Trophy.earned` wherever their new value is already
+    known. Rules match values at or above `value`, or only `value` itself
+    when `exact` is set.
+    """
+
+    title: str
+    counter: str
+    value: Any
+    exact: bool = False
+
+    def matches(self, value) -> bool:
+        """Returns whether a counter's value earns this rule's trophy."""
+        return value == self.value if self.exact else value >= self.value
+
+
 # Stores each type of trophy
 class Trophy(db.Model):
     """Represents an available trophy.
@@ -1979,6 +2936,31 @@ class Trophy(db.Model):
     instead.
     """
 
+    RULES = (
+        TrophyRule("Baby Crab", "molt_count", 1, exact=True),
+        TrophyRule("Loudmouth", "molt_count", 1_000),
+        TrophyRule("Please Stop", "molt_count", 10_000),
+        TrophyRule("Social Newbie", "follower_count", 1, exact=True),
+        TrophyRule("Mingler", "follower_count", 10, exact=True),
+        TrophyRule("Life of the Party", "follower_count", 100, exact=True),
+        TrophyRule("Celebrity", "follower_count", 1_000, exact=True),
+        TrophyRule("20/20", "follower_ratio", 20),
+        TrophyRule("The Golden Ratio", "follower_ratio", 100),
+        TrophyRule("Dopamine Hit", "like_count", 10, exact=True),
+        TrophyRule("Dopamine Addict", "like_count", 100, exact=True),
+        TrophyRule("Full-On Junkie", "like_count", 1_000, exact=True),
+        TrophyRule("Pineapple Express", "crabtag", "420", exact=True),
+        TrophyRule("Mega Freakoid", "crabtag", "waaahhhh", exact=True),
+        TrophyRule("i can haz cheezburger?", "crabtag", "lolcat", exact=True),
+        TrophyRule("f7u12", "crabtag", "fffffffuuuuuuuuuuuu", exact=True),
+        TrophyRule("Back to the Future", "crabtag", "1985", exact=True),
+        # Checked daily by award_show.py
+        TrophyRule("One Year", "years_active", 1, exact=True),
+    )
+
+    # Lowercase title -> (ID, title), loaded by `Trophy.find`
+    _catalog: Dict[str, Tuple[int, str]] = dict()
+
     id = db.Column(db.Integer, primary_key=True)
     # Short display title
     title = db.Column(db.String(32), nullable=False)
@@ -1994,11 +2976,84 @@ class Trophy(db.Model):
     def __repr__(self):
         return f"<Trophy '{self.title}'>"
 
+    @classmethod
+    def earned(cls, counter: str, value) -> List[str]:
+        """Returns the titles of the `Trophy.RULES` that a counter's value matches."""
+        return [
+            rule.title
+            for rule in cls.RULES
+            if rule.counter == counter and rule.matches(value)
+        ]
+
+    @classmethod
+    def find(cls, title: str) -> Tuple[int, str]:
+        """Returns the ID and exact title of the trophy titled `title`.
+
+        Titles are matched case-insensitively against a catalog of every trophy,
+        which is only reloaded when a title is missing from it.
+        """
+        key = title.lower()
+        if key not in cls._catalog:
+            cls._catalog = {
+                trophy_title.lower(): (trophy_id, trophy_title)
+                for trophy_id, trophy_title in db.session.query(Trophy.id, Trophy.title)
+            }
+            if key not in cls._catalog:
+                raise NotFoundInDatabase(f"Trophy with title: '{title}' not found.")
+        return cls._catalog[key]
+
+    def award_all(self, *criteria, batch_size: int = 1000) -> int:
+        """Awards this trophy to every valid crab matching `criteria`.
+
+        Crabs that already own it are skipped, so repeating an award is harmless.
+        Trophy cases are inserted and their notifications queued in batches.
+        Returns how many crabs were awarded.
+
+        :param criteria: Filters on `Crab`
+        """
+        owned = (
+            db.session.query(TrophyCase.id)
+            .filter(TrophyCase.owner_id == Crab.id, TrophyCase.trophy_id == self.id)
+            .exists()
+        )
+        crab_ids = [
+            crab_id
+            for crab_id, in Crab.query_all()
+            .with_entities(Crab.id)
+            .filter(*criteria, ~owned)
+            .order_by(Crab.id)
+        ]
+        awarded_at = datetime.datetime.utcnow()
+        for start in range(0, len(crab_ids), batch_size):
+            batch = crab_ids[start:start + batch_size]
+            db.session.execute(
+                TrophyCase.__table__.insert(),
+                [
+                    dict(owner_id=crab_id, trophy_id=self.id, timestamp=awarded_at)
+                    for crab_id in batch
+                ],
+            )
+            db.session.commit()
+            notification_queue.put_all(
+                [
+                    notification_queue.Event(
+                        recipient_id=crab_id,
+                        sender_id=None,
+                        type="trophy",
+                        timestamp=awarded_at,
+                        content=self.title,
+                    )
+                    for crab_id in batch
+                ]
+            )
+        return len(crab_ids)
+
 
 class DeveloperKey(db.Model):
     """A key that grants API access to a developer under a given account."""
 
     __tablename__ = "developer_keys"
+    __table_args__ = (db.Index("ix_developer_keys_key", "key"),)
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(64), nullable=False)
     crab_id = db.Column(db.Integer, db.ForeignKey("crab.id"), nullable=False)
@@ -2035,6 +3090,7 @@ class AccessToken(db.Model):
     """A key that grants a developer to take action on behalf of a `Crab`."""
 
     __tablename__ = "access_tokens"
+    __table_args__ = (db.Index("ix_access_tokens_key", "key"),)
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(64), nullable=False)
     crab_id = db.Column(db.Integer, db.ForeignKey("crab.id"), nullable=False)
@@ -2071,6 +3127,7 @@ class Crabtag(db.Model):
     """Represents a specific crabtag used in at least one `Molt`."""
 
     __tablename__ = "crabtag"
+    __table_args__ = (db.Index("ix_crabtag_name", "name", mysql_length=255),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(512), nullable=False)
@@ -2127,6 +3184,7 @@ class Card(db.Model):
     """Represents a preview card for a URL."""
 
     __tablename__ = "card"
+    __table_args__ = (db.Index("ix_card_url", "url", mysql_length=255),)
 
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.String(1024))
@@ -2166,6 +3224,13 @@ class Card(db.Model):
         )
         return cards
 
+    def rerender_molts(self) -> int:
+        """Re-renders the stored rich content of Molts showing this Card."""
+        molt_ids = [
+            row.id for row in db.session.query(Molt.id).filter_by(card_id=self.id)
+        ]
+        return Molt.rerender(molt_ids, stale_only=False)
+
     @classmethod
     def get(cls, url: str) -> "Card":
         """Gets Card by URL."""
@@ -2182,7 +3247,10 @@ class Bookmark(db.Model):
     """Represents a `Crab`'s bookmark of a given `Molt`."""
 
     __tablename__ = "bookmark"
-    __table_args__ = (db.UniqueConstraint("crab_id", "molt_id"),)
+    __table_args__ = (
+        db.UniqueConstraint("crab_id", "molt_id"),
+        db.Index("ix_bookmark_crab_timestamp", "crab_id", "timestamp"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     crab_id = db.Column(db.Integer, db.ForeignKey("crab.id"), nullable=False)
@@ -2206,6 +3274,136 @@ class Bookmark(db.Model):
         return likes
 
 
+class FastMoltCache:
+    """Fast-molts by ID as seen by one Crab, loaded in batches.
+
+    Used to resolve the Molts that a page of fast-molts remolts, replies to or
+    quotes in one query per nesting level instead of one query per molt.
+    """
+
+    def __init__(self, crab: Optional[Crab]):
+        self.crab = crab
+        self.molts = dict()
+
+    def load(self, molt_ids: Iterable[int]) -> list:
+        """Loads fast-molts by ID, returning the ones that are visible."""
+        molt_ids = set(molt_ids) - self.molts.keys()
+        if molt_ids:
+            # Unavailable, blocked and muted molts are cached as None
+            self.molts.update(dict.fromkeys(molt_ids))
+            rows = Molt.query_fast_molts(self.crab).filter(Molt.id.in_(molt_ids)).all()
+            if self.crab:
+                rows = self.crab.filter_muted_molts(rows)
+            for row in rows:
+                self.molts[row.id] = row
+        return [self.molts[molt_id] for molt_id in molt_ids if self.molts[molt_id]]
+
+    def load_originals(self, molts: Iterable[Any], depth: int = 2) -> list:
+        """Loads the Molts that `molts` remolt, reply to or quote.
+
+        :param depth: How many levels of originals to follow (a remolted reply
+         needs two)
+        :return: All loaded originals
+        """
+        originals = list()
+        for _ in range(depth):
+            molts = self.load(
+                molt.original_molt_id for molt in molts if molt.original_molt_id
+            )
+            originals.extend(molts)
+        return originals
+
+    def get(self, molt_id: int):
+        """Returns a fast-molt by ID, or None if it isn't visible."""
+        if molt_id not in self.molts:
+            self.load((molt_id,))
+        return self.molts[molt_id]
+
+
+class ViewerState:
+    """Which Molts a Crab has liked, remolted and bookmarked.
+
+    Molt IDs are loaded in batches with `load` (three queries per batch), so pages
+    of molts can be rendered without querying once per molt. Molts that weren't
+    loaded in advance are loaded on first access.
+    """
+
+    def __init__(self, crab: Optional[Crab]):
+        self.crab = crab
+        # Parsed once instead of for every molt's age
+        self.timezone_offset = crab.timedelta if crab else None
+        self.loaded = set()
+        self.liked = set()
+        self.remolted = set()
+        self.bookmarked = set()
+
+    def load(self, molts: Iterable[Any]):
+        """Loads the state of `molts` and the Molts they remolt, reply to or quote.
+
+        :param molts: Molts, fast-molt rows or Molt IDs
+        """
+        molt_ids = set()
+        for molt in molts:
+            if isinstance(molt, int):
+                molt_ids.add(molt)
+            else:
+                molt_ids.add(molt.id)
+                if getattr(molt, "original_molt_id", None):
+                    molt_ids.add(molt.original_molt_id)
+        molt_ids -= self.loaded
+        if self.crab is None or not molt_ids:
+            return
+
+        self.liked.update(
+            row.molt_id
+            for row in db.session.query(Like.molt_id).filter(
+                Like.crab_id == self.crab.id, Like.molt_id.in_(molt_ids)
+            )
+        )
+        self.remolted.update(
+            row.original_molt_id
+            for row in db.session.query(Molt.original_molt_id).filter(
+                Molt.author_id == self.crab.id,
+                Molt.is_remolt == true(),
+                Molt.deleted == false(),
+                Molt.original_molt_id.in_(molt_ids),
+            )
+        )
+        self.bookmarked.update(
+            row.molt_id
+            for row in db.session.query(Bookmark.molt_id).filter(
+                Bookmark.crab_id == self.crab.id, Bookmark.molt_id.in_(molt_ids)
+            )
+        )
+        self.loaded.update(molt_ids)
+
+    def has_liked(self, molt) -> bool:
+        """Returns whether the Crab has liked `molt`."""
+        self.load((molt.id,))
+        return molt.id in self.liked
+
+    def has_remolted(self, molt) -> bool:
+        """Returns whether the Crab has remolted `molt`."""
+        self.load((molt.id,))
+        return molt.id in self.remolted
+
+    def has_bookmarked(self, molt) -> bool:
+        """Returns whether the Crab has bookmarked `molt`."""
+        self.load((molt.id,))
+        return molt.id in self.bookmarked
+
+    def choose(self, state: str, molt, if_true: Any, if_false: Any = "") -> Any:
+        """Returns `if_true` if the Crab has `state` `molt`, otherwise `if_false`.
+
+        :param state: "liked", "remolted" or "bookmarked"
+        """
+        return if_true if getattr(self, f"has_{state}")(molt) else if_false
+
+    def age(self, molt) -> str:
+        """Returns how long ago `molt` was posted, localized for the Crab."""
+        return utils.get_pretty_age(molt.timestamp, offset=self.timezone_offset)
+
+
 class ModLog(db.Model):
     """Represents the log of an action taken by a moderator."""
 
@@ -2326,33 +3524,64 @@ class ModLog(db.Model):
 
 
 class ImageDescription(db.Model):
-    """Represents a user-provided text description for a given image url."""
+    """Represents a user-provided text description for a given image url.
+
+    Descriptions are looked up by `src_hash`, a fixed-length digest of the URL,
+    because URLs are too long to index in full.
+    """
 
     __tablename__ = "image_description"
+    __table_args__ = (db.Index("ix_image_description_src_hash", "src_hash"),)
 
     id = db.Column(db.Integer, primary_key=True)
     src = db.Column(db.String(1024))
+    src_hash = db.Column(db.String(64))
     alt = db.Column(db.String(1024))
 
     def __repr__(self) -> str:
         return f"<ImageDescription {self.src!r}>"
 
+    @staticmethod
+    def hash_src(src: str) -> str:
+        """Returns the `src_hash` of an image source URL."""
+        return hashlib.sha256(src.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def query_srcs(cls, srcs: Iterable[str]) -> BaseQuery:
+        """Queries image descriptions by image source URLs."""
+        srcs = set(srcs)
+        return cls.query.filter(
+            cls.src_hash.in_({cls.hash_src(src) for src in srcs}), cls.src.in_(srcs)
+        )
+
     @classmethod
     def get(cls, src: str) -> Optional["ImageDescription"]:
         """Gets image description object by image source URL."""
-        return cls.query.filter_by(src=src).first()
+        return cls.query_srcs((src,)).first()
 
     @classmethod
     def get_alt(cls, src: str) -> Optional[str]:
         """Gets image description string by image source URL."""
-        desc = cls.query.filter_by(src=src).first()
+        desc = cls.get(src)
         if desc:
             return desc.alt
 
+    @classmethod
+    def get_alts(cls, srcs: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Gets image description strings for many image source URLs at once.
+
+        :return: Description by URL, with None for URLs that have no description
+        """
+        alts = dict.fromkeys(srcs)
+        if alts:
+            for description in cls.query_srcs(alts):
+                alts[description.src] = description.alt
+        return alts
+
     @classmethod
     def set(cls, src: str, alt: str) -> "ImageDescription":
         """Creates image description by image source URL."""
-        desc = cls.query.filter_by(src=src).first()
+        desc = cls.get(src)
         if desc:
             desc.alt = alt
             db.session.commit()
@@ -2360,9 +3589,16 @@ class ImageDescription(db.Model):
             desc = cls(src=src, alt=alt)
             db.session.add(desc)
             db.session.commit()
+        utils.cache_alt_text(src, alt)
         return desc
 
 
+@event.listens_for(ImageDescription.src, "set")
+def hash_image_description_src(description, src, old_src, initiator):
+    """Keeps an image description's `src_hash` in sync with its URL."""
+    description.src_hash = ImageDescription.hash_src(src) if src is not None else None
+
+
 class ReferralCode(db.Model):
     """A code that tracks user referrals."""
 
@@ -0,0 +1,246 @@
+"""Queue between `Crab.notify` and the notification table.
+
+Requests only enqueue lightweight events. They are delivered in batches by
+`Notification.deliver`, which does the block, duplicate and spam checks for a whole
+batch in a few set-based queries and inserts the notifications together.
+
+`LocalQueue` keeps events in memory and delivers them from a background thread in
+the same process, so it needs no extra setup. `DatabaseQueue` stores them in the
+`notification_event` table, where every worker process shares them, and
+`scripts/deliver_notifications.py` delivers them. `config.NOTIFICATION_QUEUE`
+picks one.
+"""
+import atexit
+import collections
+import config
+import datetime
+from extensions import db
+from flask import current_app
+import logging
+import threading
+import time
+from typing import Deque, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+notification_event_table = db.Table(
+    "notification_event",
+    db.Column("id", db.Integer, primary_key=True),
+    db.Column("recipient_id", db.Integer, nullable=False),
+    db.Column("sender_id", db.Integer, nullable=True),
+    db.Column("type", db.String(32), nullable=False),
+    db.Column("molt_id", db.Integer, nullable=True),
+    db.Column("content", db.String(140), nullable=True),
+    db.Column("link", db.String(140), nullable=True),
+    db.Column("timestamp", db.DateTime, nullable=False),
+)
+
+
+class Event(NamedTuple):
+    """A notification waiting to be delivered."""
+
+    recipient_id: int
+    sender_id: Optional[int]
+    type: str
+    timestamp: datetime.datetime
+    molt_id: Optional[int] = None
+    content: Optional[str] = None
+    link: Optional[str] = None
+
+
+class LocalQueue:
+    """In-memory queue delivered by a background thread in this process.
+
+    Whatever is still queued when the process exits is delivered first.
+    """
+
+    def __init__(self):
+        self._events: Deque[Event] = collections.deque()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._app = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._events)
+
+    def put(self, event: Event):
+        """Queues an event and wakes the delivery thread."""
+        self.put_all([event])
+
+    def put_all(self, events: List[Event]):
+        """Queues several events and wakes the delivery thread."""
+        self._events.extend(events)
+        # Only the first call takes the lock, which `drain` holds while delivering
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._app = current_app._get_current_object()
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+                    atexit.register(self.drain)
+        self._wake.set()
+
+    def take(self, limit: int) -> List[Event]:
+        """Removes and returns up to `limit` of the oldest events."""
+        events = list()
+        while self._events and len(events) < limit:
+            events.append(self._events.popleft())
+        return events
+
+    def requeue(self, events: List[Event]):
+        """Puts events returned by `take` back at the front of the queue."""
+        self._events.extendleft(reversed(events))
+
+    def drain(self):
+        """Delivers everything queued so far in an app context of its own.
+
+        The delivery thread and the exit handler never drain at the same time.
+        """
+        if self._app is not None:
+            with self._lock, self._app.app_context():
+                while deliver_pending(self):
+                    pass
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception:
+                logger.exception("Failed to deliver notifications")
+                # Retry what was put back without waiting for new events
+                time.sleep(config.NOTIFICATION_POLL_INTERVAL)
+                self._wake.set()
+
+
+class DatabaseQueue:
+    """Queue stored in the `notification_event` table.
+
+    Only one process should take events at a time, i.e. a single
+    `scripts/deliver_notifications.py`.
+    """
+
+    def __len__(self):
+        return db.session.query(db.func.count(notification_event_table.c.id)).scalar()
+
+    def put(self, event: Event):
+        """Stores an event."""
+        self.put_all([event])
+
+    def put_all(self, events: List[Event]):
+        """Stores several events in one statement."""
+        if events:
+            db.session.execute(
+                notification_event_table.insert(), [event._asdict() for event in events]
+            )
+            db.session.commit()
+
+    def take(self, limit: int) -> List[Event]:
+        """Removes and returns up to `limit` of the oldest events."""
+        rows = (
+            db.session.query(notification_event_table)
+            .order_by(notification_event_table.c.id)
+            .limit(limit)
+            .all()
+        )
+        if rows:
+            db.session.execute(
+                notification_event_table.delete().where(
+                    notification_event_table.c.id.in_([row.id for row in rows])
+                )
+            )
+        return [Event(**{field: row[field] for field in Event._fields}) for row in rows]
+
+    def requeue(self, events: List[Event]):
+        """Does nothing: rolling back the session already restores taken events."""
+
+
+def make_queue(kind: str):
+    """Returns a new queue of the kind named by `config.NOTIFICATION_QUEUE`."""
+    if kind == "database":
+        return DatabaseQueue()
+    if kind == "local":
+        return LocalQueue()
+    raise ValueError(f"Unknown notification queue: '{kind}'")
+
+
+queue = make_queue(config.NOTIFICATION_QUEUE)
+
+
+def set_queue(new_queue):
+    """Replaces the queue notifications are sent through."""
+    global queue
+    queue = new_queue
+
+
+def put(event: Event):
+    """Queues a notification for delivery."""
+    queue.put(event)
+
+
+def put_all(events: List[Event]):
+    """Queues several notifications for delivery at once."""
+    queue.put_all(events)
+
+
+# Failed attempts at delivering events on their own, by event
+failed_attempts: Dict[Event, int] = dict()
+
+
+def deliver_pending(from_queue=None, limit: int = config.NOTIFICATION_BATCH_SIZE):
+    """Delivers one batch of queued events. Returns how many events it took.
+
+    Must be run in an app context. If the batch fails, its events are put back and
+    delivered one at a time, so that one bad event can't hold up the rest. An event
+    that fails on its own is retried on the next call, and dropped once it has
+    failed `config.NOTIFICATION_MAX_ATTEMPTS` times. Raises if an event is kept.
+    """
+    from models import Notification
+
+    from_queue = from_queue if from_queue is not None else queue
+    events = from_queue.take(limit)
+    if not events:
+        db.session.commit()
+        return 0
+    try:
+        Notification.deliver(events)
+    except Exception:
+        db.session.rollback()
+        from_queue.requeue(events)
+        logger.exception(
+            f"Failed to deliver {len(events)} notification(s), retrying one at a time"
+        )
+        for _ in events:
+            deliver_alone(from_queue)
+    else:
+        if failed_attempts:
+            for event in events:
+                failed_attempts.pop(event, None)
+    return len(events)
+
+
+def deliver_alone(from_queue):
+    """Delivers the oldest queued event on its own. See `deliver_pending`."""
+    from models import Notification
+
+    events = from_queue.take(1)
+    if not events:
+        return
+    try:
+        Notification.deliver(events)
+    except Exception:
+        db.session.rollback()
+        from_queue.requeue(events)
+        event = events[0]
+        attempts = failed_attempts.pop(event, 0) + 1
+        if attempts < config.NOTIFICATION_MAX_ATTEMPTS:
+            failed_attempts[event] = attempts
+            raise
+        logger.exception(f"Dropping notification {event} after {attempts} attempts")
+        # Take it again, this time for good
+        from_queue.take(1)
+        db.session.commit()
+    else:
+        failed_attempts.pop(events[0], None)
@@ -0,0 +1,230 @@
+"""Keyset (cursor) pagination for feeds ordered by (timestamp, id) descending.
+
+Unlike `BaseQuery.paginate`, this never counts the whole result set and never scans
+past earlier pages: each page is fetched with a `WHERE (timestamp, id) < cursor`
+range and one extra row to tell whether another page follows. Page numbers are
+still accepted as a fallback so old `?p=` links keep working.
+
+Pages with a post-filter (e.g. muted words) point their cursors at the last row
+scanned rather than the last row kept, so the next page never scans the same rows
+again.
+"""
+import base64
+import binascii
+import config
+import datetime
+import functools
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import and_, or_
+from typing import Any, Callable, List, Optional, Tuple
+
+Key = Tuple[datetime.datetime, int]
+
+# Most queries one page may take when topping up rows removed by a post-filter
+MAX_FETCHES = 5
+
+
+class KeysetPagination:
+    """A page of results with opaque cursors pointing at its neighbours."""
+
+    def __init__(
+        self,
+        items: List[Any],
+        page: int,
+        has_prev: bool,
+        has_next: bool,
+        key: Callable[[Any], Key],
+        prev_key: Optional[Key] = None,
+        next_key: Optional[Key] = None,
+    ):
+        """Create a page.
+
+        :param prev_key: Where the previous page starts, if not the first item
+        :param next_key: Where the next page starts, if not the last item
+        """
+        self.items = items
+        # Page numbers are only tracked for display and for `?p=` fallback links
+        self.page = page
+        if items:
+            prev_key = prev_key or key(items[0])
+            next_key = next_key or key(items[-1])
+        self.has_prev = has_prev
+        self.has_next = has_next and next_key is not None
+        self.prev_num = max(page - 1, 1)
+        self.next_num = page + 1
+        # An empty cursor loads the first page
+        self.prev_cursor = (
+            encode_cursor("prev", prev_key) if has_prev and prev_key else ""
+        )
+        self.next_cursor = encode_cursor("next", next_key) if self.has_next else ""
+
+
+def default_key(item: Any) -> Key:
+    """Returns the (timestamp, id) sort key of a molt-like row."""
+    return item.timestamp, item.id
+
+
+def encode_cursor(direction: str, key: Key) -> str:
+    """Encodes a page direction and sort key as a URL-safe cursor."""
+    timestamp, id = key
+    raw = f"{direction}|{timestamp.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, Key]]:
+    """Decodes a cursor made by `encode_cursor`. Returns None if it's invalid."""
+    if cursor:
+        try:
+            padding = "=" * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(cursor + padding).decode()
+            direction, timestamp, id = raw.split("|")
+            if direction in ("prev", "next"):
+                return direction, (datetime.datetime.fromisoformat(timestamp), int(id))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            pass
+    return None
+
+
+def beyond(sort_columns: Tuple[Any, Any], direction: str, key: Key):
+    """Returns a filter for rows after `key` when walking in `direction`."""
+    timestamp_column, id_column = sort_columns
+    timestamp, id = key
+    if direction == "prev":
+        return or_(
+            timestamp_column > timestamp,
+            and_(timestamp_column == timestamp, id_column > id),
+        )
+    return or_(
+        timestamp_column < timestamp,
+        and_(timestamp_column == timestamp, id_column < id),
+    )
+
+
+def fetch_rows(
+    query: BaseQuery,
+    sort_columns: Tuple[Any, Any],
+    direction: str,
+    limit: int,
+    key: Callable[[Any], Key],
+    after: Optional[Key] = None,
+    offset: int = 0,
+    post_filter: Optional[Callable[[List[Any]], List[Any]]] = None,
+) -> Tuple[List[Any], Optional[Key], bool]:
+    """Fetches up to `limit` rows of `query` walking in `direction`.
+
+    Rows removed by `post_filter` are topped up with further keyset batches, each
+    twice the size of the last (at most `MAX_FETCHES` queries), so that filtered
+    pages still come back full.
+
+    :return: The rows, the key of the last row scanned (kept or not) and whether
+     more rows may follow it, which is also the case when topping up gave up early
+    """
+    timestamp_column, id_column = sort_columns
+    if direction == "prev":
+        order = (timestamp_column.asc(), id_column.asc())
+    else:
+        order = (timestamp_column.desc(), id_column.desc())
+    query = query.order_by(None).order_by(*order)
+
+    batch_query = query
+    if after:
+        batch_query = batch_query.filter(beyond(sort_columns, direction, after))
+    if offset:
+        batch_query = batch_query.offset(offset)
+
+    rows, last, size = list(), after, limit
+    for _ in range(MAX_FETCHES):
+        batch = batch_query.limit(size).all()
+        kept = {id(row) for row in (post_filter(batch) if post_filter else batch)}
+        for row in batch:
+            if id(row) in kept:
+                rows.append(row)
+            last = key(row)
+            if len(rows) == limit:
+                return rows, last, True
+        if len(batch) < size:
+            return rows, last, False
+        batch_query = query.filter(beyond(sort_columns, direction, last))
+        # Heavily filtered feeds need bigger top-ups to fill a page
+        size *= 2
+    return rows, last, True
+
+
+def paginate(
+    query: BaseQuery,
+    sort_columns: Tuple[Any, Any],
+    cursor: Optional[str] = None,
+    page: int = 1,
+    per_page: int = config.MOLTS_PER_PAGE,
+    key: Callable[[Any], Key] = default_key,
+    post_filter: Optional[Callable[[List[Any]], List[Any]]] = None,
+) -> KeysetPagination:
+    """Fetches one page of `query` ordered by `sort_columns` descending.
+
+    :param sort_columns: (timestamp, id) columns that uniquely order the query
+    :param cursor: Cursor from a previous page's `prev_cursor`/`next_cursor`
+    :param page: Page number, only used for offset paging when no valid cursor is
+     given and otherwise passed through for display
+    :param key: Returns an item's values for `sort_columns`
+    :param post_filter: Removes unwanted items from a fetched list (e.g. muted molts)
+    """
+    decoded = decode_cursor(cursor)
+    fetch = functools.partial(
+        fetch_rows,
+        query,
+        sort_columns,
+        limit=per_page + 1,
+        key=key,
+        post_filter=post_filter,
+    )
+
+    def next_key(rows: List[Any], last: Optional[Key]) -> Optional[Key]:
+        # A full page continues after its last item, a short one after its last scan
+        return key(rows[per_page - 1]) if len(rows) > per_page else last
+
+    if decoded and decoded[0] == "prev":
+        # Walk backwards from the cursor, then restore descending order
+        rows, last, more = fetch("prev", after=decoded[1])
+        if more:
+            items = rows[:per_page][::-1]
+            return KeysetPagination(
+                items,
+                max(page, 2),
+                True,
+                True,
+                key,
+                prev_key=next_key(rows, last),
+                # With nothing kept, walk forward over the skipped rows again
+                next_key=None if items else last,
+            )
+        # Reached the start of the feed, so serve a full first page instead
+        decoded = None
+        page = 1
+
+    if decoded:
+        rows, last, more = fetch("next", after=decoded[1])
+        page = max(page, 2)
+        has_prev = True
+    elif page > 1 and post_filter:
+        # Filtered pages can't be found by offset, so walk to this one
+        rows, last, more = fetch("next")
+        for _ in range(page - 2):
+            if not more:
+                break
+            rows, last, more = fetch("next", after=next_key(rows, last))
+        if more:
+            rows, last, more = fetch("next", after=next_key(rows, last))
+        else:
+            rows = list()
+        has_prev = True
+    elif page > 1:
+        rows, last, more = fetch("next", offset=(page - 1) * per_page)
+        has_prev = True
+    else:
+        rows, last, more = fetch("next")
+        page = 1
+        has_prev = False
+
+    return KeysetPagination(
+        rows[:per_page], page, has_prev, more, key, next_key=next_key(rows, last)
+    )
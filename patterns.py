@@ -27,12 +27,15 @@ ext_link = re.compile(
 # fmt: on
 ext_md_link = re.compile(rf"\[([^\]\(\)]+)\]\(({link_basic})\)")
 timezone = re.compile(r"^-?(1[0-2]|0[0-9]).\d{2}$")
-pretty_url = re.compile(r"(?:https?://)?(?:www\.)?((?:(?:[\w_-]+\.?)+/?)+)")
+# Host and path of a URL: runs of word characters joined by ".", "/" or "./".
+# Runs can't be split between repetitions, so nothing backtracks on failure.
+url_path = r"[\w-]+(?:(?:\./?|/)[\w-]+)*(?:\./?|/)?"
+pretty_url = re.compile(rf"(?:https?://)?(?:www\.)?({url_path})")
 # Captures root of url (e.g. reddit.com or crabber.net)
 url_root = re.compile(r"(?:https?://)?([^\s/]+)(?:\S*)")
 # Captures essential part of URL (e.g. reddit.com/u/jaik_ or
 # crabber.net/timeline)
-url_essence = re.compile(r"(?:https?://)?(?:www\.)?((?:(?:[\w_-]+\.?)+/?)+)")
+url_essence = re.compile(rf"(?:https?://)?(?:www\.)?({url_path})")
 
 # Social links
 social_discord = re.compile(r"^[^@#:`\"]{2,32}#\d{4}$")
@@ -0,0 +1,239 @@
+"""Tokenizer and HTML renderers for molt content.
+
+Content is rendered in stages (spoilers, embeds, links, mentions, crabtags), each of
+which splits its input into a stream of `Token`s in one left-to-right scan and joins
+the rendered tokens once. Later stages run over the HTML of earlier ones, exactly
+as the old recursive `label_*` helpers did, so rendered molts are unchanged.
+"""
+import patterns
+import re
+from typing import Callable, Iterator, List, Match, NamedTuple, Optional, Pattern, Tuple
+
+# Rendered markup, with the spacing molts have always been rendered with
+LINK_HTML = (
+    '<a href="{url}" class="no-onclick mention zindex-front"'
+    + " " * 13
+    + 'target="_blank">{text}</a>'
+)
+MD_LINK_HTML = (
+    '<a href="{url}" class="no-onclick mention'
+    + " " * 13
+    + 'zindex-front" target="_blank">{text}</a>'
+)
+MENTION_HTML = (
+    '<a href="{base_url}/user/{username}"'
+    + " " * 17
+    + 'target="_blank" class="no-onclick mention zindex-front">'
+    + " " * 17
+    + "{text}</a>"
+)
+CRABTAG_HTML = (
+    '<a href="{base_url}/crabtag/{tag}"'
+    + " " * 13
+    + 'target="_blank" class="no-onclick crabtag zindex-front">'
+    + " " * 13
+    + "{text}</a>"
+)
+SPOILER_HTML = (
+    '<span class="molt-content-spoiler" onclick="revealSpoiler(event);">{text}</span>'
+)
+
+# Each stage used to search the rest of the content as a new string after every
+# match, where `^` matches again and lookbehinds can't see the previous match.
+# These patterns reproduce how a match starting right at the cut behaved then.
+START_PATTERNS = {
+    patterns.ext_link: re.compile(r"(\s|>|)(?=\w)(" + patterns.link_basic + r")"),
+    patterns.mention: re.compile(r"@([\w]{1,32})(?!\w)"),
+    patterns.tag: re.compile(r"%([\w]{1,})(?!\w)"),
+}
+
+
+class Token(NamedTuple):
+    """A run of content: plain text or one match of a stage's pattern."""
+
+    # "text", "spoiler", "md-link", "link", "mention", "crabtag" or "embed"
+    kind: str
+    text: str
+    match: Optional[Match] = None
+
+
+def prepend_http(url: str) -> str:
+    """Prepends https:// if url has no protocol identifier."""
+    if not patterns.protocol_identifier.match(url):
+        return "https://" + url
+    return url
+
+
+def search_rest(pattern: Pattern, content: str, pos: int) -> Optional[Match]:
+    """Searches `content[pos:]` for `pattern` as if it were a string of its own."""
+    if pos:
+        start_pattern = START_PATTERNS.get(pattern)
+        if start_pattern:
+            match = start_pattern.match(content, pos)
+            if match:
+                return match
+    return pattern.search(content, pos)
+
+
+def tokenize(content: str, kind: str, pattern: Pattern) -> Iterator[Token]:
+    """Splits content into text tokens and `kind` tokens matching `pattern`."""
+    pos = 0
+    while True:
+        match = search_rest(pattern, content, pos)
+        if match is None:
+            break
+        start, end = match.span()
+        if start > pos:
+            yield Token("text", content[pos:start])
+        yield Token(kind, content[start:end], match)
+        pos = end
+    if pos < len(content):
+        yield Token("text", content[pos:])
+
+
+def extract_embed(content: str, pattern: Pattern) -> Tuple[str, Optional[Match]]:
+    """Removes every embeddable link matching `pattern` from content.
+
+    :returns: (new_content, match of the first link or None)
+    """
+    tokens = list(tokenize(content, "embed", pattern))
+    first = next((token.match for token in tokens if token.kind == "embed"), None)
+    return "".join(token.text for token in tokens if token.kind == "text"), first
+
+
+def label_spoilers(content: str) -> str:
+    """Surround spoiler tags with proper HTML."""
+    return "".join(
+        SPOILER_HTML.format(text=token.match.group(1).strip())
+        if token.match
+        else token.text
+        for token in tokenize(content, "spoiler", patterns.spoiler_tag)
+    )
+
+
+def label_md_links(content: str) -> Tuple[str, List[str]]:
+    """Replace markdown links with HTML tags.
+
+    :param content: The text to parse.
+    :returns: (new_content, list of urls found)
+    """
+    output = list()
+    urls = list()
+    for token in tokenize(content, "md-link", patterns.ext_md_link):
+        if token.match:
+            url = prepend_http(token.match.group(2))
+            urls.append(url)
+            output.append(MD_LINK_HTML.format(url=url, text=token.match.group(1)))
+        else:
+            output.append(token.text)
+    return "".join(output), urls
+
+
+def label_links(
+    content: str, max_len: int = 35, include_markdown: bool = True
+) -> Tuple[str, List[str]]:
+    """Replace links with HTML tags.
+
+    :param content: The text to parse.
+    :param max_len: Maximum length of visible URLs in characters.
+    :param include_markdown: Whether to parse markdown-style links
+        before unformatted ones. If markdown links are present then
+        this is necessary to avoid garbled output.
+    :returns: (new_content, list of urls found)
+    """
+    urls = list()
+    if include_markdown:
+        content, urls = label_md_links(content)
+    # Content after each link has always had its markdown links parsed (again).
+    # That only changes anything if markdown is still present, e.g. in a URL.
+    reparse_markdown = bool(patterns.ext_md_link.search(content))
+
+    output = list()
+    pos = 0
+    displayed_len = max_len
+    while True:
+        match = search_rest(patterns.ext_link, content, pos)
+        if match is None:
+            break
+        url = match.group(2)
+        urls.append(url)
+        displayed_url = (
+            url if len(url) <= displayed_len else url[: displayed_len - 3] + "..."
+        )
+        start, end = match.span()
+        output.append(content[pos:start] + match.group(1))
+        output.append(LINK_HTML.format(url=prepend_http(url), text=displayed_url))
+        pos = end
+        # Links after the first are shown at the default length
+        displayed_len = 35
+
+        if reparse_markdown:
+            rest, more_urls = label_md_links(content[pos:])
+            urls.extend(more_urls)
+            content = content[:pos] + rest
+            reparse_markdown = bool(patterns.ext_md_link.search(content, pos))
+    output.append(content[pos:])
+
+    return "".join(output), urls
+
+
+def mention_username(token: Token) -> str:
+    """Returns the name a mention token refers to, as looked up when rendering."""
+    return token.text.replace("<br>", "").strip("@ \t\n")
+
+
+def mentioned_usernames(content: str) -> List[str]:
+    """Returns the names `label_mentions` would look up for content."""
+    return [
+        mention_username(token)
+        for token in tokenize(content, "mention", patterns.mention)
+        if token.match
+    ]
+
+
+def label_mentions(
+    content: str, is_username: Callable[[str], bool], base_url: str = ""
+) -> str:
+    """Replace mentions with HTML links to users.
+
+    :param is_username: Returns whether a mentioned name belongs to an active user
+    :param base_url: Prefix of the first mention's link. (Later mentions have always
+        linked relatively.)
+    """
+    output = list()
+    for token in tokenize(content, "mention", patterns.mention):
+        if token.match:
+            if is_username(mention_username(token)):
+                output.append(
+                    MENTION_HTML.format(
+                        base_url=base_url,
+                        username=token.match.group(1),
+                        text=token.text,
+                    )
+                )
+            else:
+                output.append(token.text)
+            base_url = ""
+        else:
+            output.append(token.text)
+    return "".join(output)
+
+
+def label_crabtags(content: str, base_url: str = "") -> str:
+    """Replace crabtags with HTML links to crabtag exploration page.
+
+    :param base_url: Prefix of the first crabtag's link. (Later crabtags have always
+        linked relatively.)
+    """
+    output = list()
+    for token in tokenize(content, "crabtag", patterns.tag):
+        if token.match:
+            output.append(
+                CRABTAG_HTML.format(
+                    base_url=base_url, tag=token.match.group(1), text=token.text
+                )
+            )
+            base_url = ""
+        else:
+            output.append(token.text)
+    return "".join(output)
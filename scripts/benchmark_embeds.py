@@ -0,0 +1,58 @@
+""" Compares the per-molt cost of rendering media embeds two ways.
+
+Usage: python3 scripts/benchmark_embeds.py [iterations]
+
+"before" builds a template string around each embed and renders it with
+`render_template_string`, as molt rendering used to; "after" uses
+`utils.render_embed`, which reuses Jinja's compiled templates and skips context
+processors.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from crabber import app
+from flask import Markup, render_template_string
+import timeit
+import utils
+
+app.test_request_context().push()
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+# Template name -> (variable name, sample value)
+embeds = {
+    "youtube.html": ("video", "dQw4w9WgXcQ"),
+    "giphy.html": ("giphy_id", "l1Ku8UGWpTlyHuD0A"),
+    "external_img.html": ("link", "https://cdn.crabber.net/img/avatar.jpg"),
+}
+
+
+def before(template_name, name, value):
+    return render_template_string(
+        f'{{% with {name}="{value}" %}}'
+        f'   {{% include "{template_name}" %}}'
+        "{% endwith %}",
+        full_size_media=False,
+        nsfw=False,
+    )
+
+
+def after(template_name, name, value):
+    return utils.render_embed(
+        template_name, full_size_media=False, nsfw=False, **{name: Markup(value)}
+    )
+
+
+print(f"Microseconds per render ({iterations} iterations):")
+print(f"  {'template':<20}{'before':>10}{'after':>10}")
+for template_name, (name, value) in embeds.items():
+    timings = [
+        timeit.timeit(lambda: render(template_name, name, value), number=iterations)
+        / iterations
+        * 1e6
+        for render in (before, after)
+    ]
+    print(f"  {template_name:<20}{timings[0]:>10.1f}{timings[1]:>10.1f}")
@@ -0,0 +1,187 @@
+""" Measures how long the main feeds take to render against a synthetic database.
+
+Usage: python3 scripts/benchmark_feeds.py [--crabs N] [--molts N] [--iterations N]
+                                          [--output FILE] [--baseline FILE]
+
+Seeds a separate SQLite database (benchmark.db by default, kept between runs unless
+--reseed is given) using `scripts/generate_dataset.py`. Then requests each feed as
+a logged-in crab, the way the browser loads it, and reports p50/p95 latency, SQL
+queries and bytes per page. Results are written as JSON so runs on different commits can be
+compared with --baseline.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import argparse
+
+parser = argparse.ArgumentParser(description="Benchmark feed rendering.")
+parser.add_argument("--database", default="benchmark.db", help="SQLite file to use")
+parser.add_argument("--reseed", action="store_true", help="Rebuild the database")
+parser.add_argument("--crabs", type=int, default=500)
+parser.add_argument("--molts", type=int, default=20000)
+parser.add_argument("--seed", type=int, default=0, help="Random seed for seeding")
+parser.add_argument("--iterations", type=int, default=20)
+parser.add_argument("--warmup", type=int, default=2, help="Untimed runs per page")
+parser.add_argument("--output", default="benchmark-results.json")
+parser.add_argument("--baseline", help="Earlier results to compare against")
+args = parser.parse_args()
+
+# Must be set before the app reads its config
+database_path = os.path.abspath(args.database)
+os.environ["CRABBER_DATABASE"] = f"sqlite:///{database_path}"
+
+import config
+import datetime
+from crabber import app, limiter
+from extensions import db
+from generate_dataset import generate
+import json
+from models import Crab, Crabtag, Molt, crabtag_table, following_table
+from sqlalchemy import event, func
+import subprocess
+import time
+
+app.test_request_context().push()
+# Every request comes from the same address
+limiter.enabled = False
+
+
+def percentile(values, percent: float) -> float:
+    """Returns the nearest-rank percentile of `values`."""
+    values = sorted(values)
+    return values[max(0, round(percent / 100 * len(values)) - 1)]
+
+
+def current_commit():
+    """Returns the checked out git commit, if there is one."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=parentdir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if args.reseed or not os.path.exists(database_path):
+    print(f"Seeding {database_path} ({args.crabs} crabs, {args.molts} molts)...")
+    generate(args.crabs, args.molts, seed=args.seed)
+
+# Benchmark as the crab following the most people, looking at the busiest profile,
+# crabtag and thread
+viewer = (
+    Crab.query.join(following_table, following_table.c.follower_id == Crab.id)
+    .group_by(Crab.id)
+    .order_by(func.count().desc())
+    .first()
+)
+author = (
+    Crab.query.join(Molt, Molt.author_id == Crab.id)
+    .group_by(Crab.id)
+    .order_by(func.count().desc())
+    .first()
+)
+tag = (
+    Crabtag.query.join(crabtag_table)
+    .group_by(Crabtag.id)
+    .order_by(func.count().desc())
+    .first()
+)
+thread = Molt.query.order_by(Molt.reply_count.desc()).first()
+# Home timelines are built ahead of time, never while they're read
+if (
+    not viewer.timeline_built
+    and viewer.raw_following_count <= config.TIMELINE_MAX_FOLLOWING
+):
+    viewer.rebuild_timeline()
+
+pages = {
+    "home": "/?ajax_content=1",
+    "wild": "/wild/?ajax_content=1",
+    "profile molts": f"/user/{author.username}/?ajax_section=molts&hex_ID=bench",
+    "profile replies": f"/user/{author.username}/?ajax_section=replies&hex_ID=bench",
+    "profile likes": f"/user/{author.username}/?ajax_section=likes&hex_ID=bench",
+    "crabtag": f"/crabtag/{tag.name}/?ajax_content=1",
+    "notifications": "/notifications/?ajax_json=1",
+    "molt page": f"/user/{thread.author.username}/status/{thread.id}/",
+}
+
+query_count = 0
+
+
+@event.listens_for(db.engine, "before_cursor_execute")
+def count_query(*_):
+    global query_count
+    query_count += 1
+
+
+client = app.test_client()
+with client.session_transaction() as session:
+    session["current_user"] = viewer.id
+    session["current_user_ts"] = viewer.register_timestamp
+
+results = dict()
+print(f"Rendering as @{viewer.username} ({args.iterations} iterations per page):")
+print(f"  {'page':<18}{'p50 ms':>9}{'p95 ms':>9}{'queries':>9}{'bytes':>9}")
+for name, url in pages.items():
+    timings, queries = list(), list()
+    for iteration in range(args.warmup + args.iterations):
+        query_count = 0
+        started = time.perf_counter()
+        response = client.get(url)
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            sys.exit(f"{url} returned {response.status_code}")
+        if iteration >= args.warmup:
+            timings.append(elapsed * 1000)
+            queries.append(query_count)
+    results[name] = dict(
+        url=url,
+        p50_ms=round(percentile(timings, 50), 3),
+        p95_ms=round(percentile(timings, 95), 3),
+        queries=percentile(queries, 50),
+        bytes=len(response.data),
+    )
+    print(
+        f"  {name:<18}{results[name]['p50_ms']:>9.1f}{results[name]['p95_ms']:>9.1f}"
+        f"{results[name]['queries']:>9}{results[name]['bytes']:>9}"
+    )
+
+with open(args.output, "w") as f:
+    json.dump(
+        dict(
+            commit=current_commit(),
+            created=datetime.datetime.utcnow().isoformat(),
+            database=dict(
+                crabs=Crab.query.count(), molts=Molt.query.count(), seed=args.seed
+            ),
+            iterations=args.iterations,
+            pages=results,
+        ),
+        f,
+        indent=4,
+    )
+print(f"Saved results to {args.output}")
+
+if args.baseline:
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    print(f"Change since {args.baseline} (commit {baseline.get('commit')}):")
+    print(f"  {'page':<18}{'p50':>9}{'p95':>9}{'queries':>9}{'bytes':>9}")
+    for name, result in results.items():
+        before = baseline["pages"].get(name)
+        if before is None:
+            continue
+        changes = [
+            f"{(result[key] - before[key]) / before[key]:>+9.0%}"
+            if before[key]
+            else f"{'n/a':>9}"
+            for key in ("p50_ms", "p95_ms", "queries", "bytes")
+        ]
+        print(f"  {name:<18}{''.join(changes)}")
@@ -0,0 +1,124 @@
+""" Times the regular expressions that run on user content against crafted input.
+
+Usage: python3 scripts/benchmark_patterns.py [samples]
+
+Every pattern is run the way the site runs it, on pathological molts (prefixes of
+what the pattern looks for, repeated without ever completing) and on random molts
+built from the characters patterns care about. Each is timed at the molt length
+limit and at ten times that, so the growth column shows how a pattern scales:
+about 10 is linear, about 100 quadratic, and anything exponential never finishes.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import config
+import patterns
+import random
+import rich_content
+import timeit
+
+samples = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+# Repeated to fill a molt, e.g. URLs that never reach a valid ending
+PATHOLOGICAL = (
+    "a",
+    "a.",
+    "a/",
+    "a-.",
+    "a./",
+    "http://",
+    "https://a",
+    "www.",
+    "www.aaa.",
+    "https://a.png?",
+    "https://a.png?a=a&",
+    "https://giphy.com/a-",
+    "youtube.com/watch?a&",
+    "[a](",
+    "[a](https://",
+    "&gt;!",
+    "&gt;!a\n",
+    "@",
+    "@a",
+    " @a",
+    "%a",
+    "<br>",
+    "&nbsp;",
+    "\\@a",
+)
+# Characters and fragments random molts are built from
+FUZZ_ALPHABET = list("aZ_-./:?&=#@%()[]!<> \n\\") + [
+    "http://",
+    "https://",
+    "www.",
+    ".com",
+    ".png",
+    "giphy.com/",
+    "youtu.be/",
+    "&gt;!",
+    "&lt;",
+    "<br>",
+    "&nbsp;",
+]
+
+# Name -> how the site runs it on a string
+RUNNERS = {
+    "mention": patterns.mention.search,
+    "tag": patterns.tag.search,
+    "spoiler_tag": patterns.spoiler_tag.search,
+    "youtube": patterns.youtube.search,
+    "giphy": patterns.giphy.search,
+    "ext_img": patterns.ext_img.search,
+    "ext_link": patterns.ext_link.search,
+    "ext_md_link": patterns.ext_md_link.search,
+    "pretty_url": patterns.pretty_url.match,
+    "url_root": patterns.url_root.match,
+    "url_essence": patterns.url_essence.match,
+    "url_essence (full)": patterns.url_essence.fullmatch,
+    "label_spoilers": rich_content.label_spoilers,
+    "label_links": rich_content.label_links,
+    "label_mentions": lambda content: rich_content.label_mentions(
+        content, lambda username: True
+    ),
+    "label_crabtags": rich_content.label_crabtags,
+}
+
+
+def fill(fragment: str, length: int) -> str:
+    """Repeats `fragment` to `length` characters."""
+    return (fragment * (length // len(fragment) + 1))[:length]
+
+
+def fuzz(length: int) -> str:
+    """Returns a random molt of roughly `length` characters."""
+    content = ""
+    while len(content) < length:
+        content += random.choice(FUZZ_ALPHABET)
+    return content[:length]
+
+
+def worst_time(run, contents) -> float:
+    """Returns the slowest run over `contents` in seconds (best of 5 for each)."""
+    return max(
+        min(timeit.repeat(lambda: run(content), number=1, repeat=5))
+        for content in contents
+    )
+
+
+random.seed(0)
+lengths = (config.MOLT_CHAR_LIMIT, config.MOLT_CHAR_LIMIT * 10)
+inputs = {
+    length: [fill(fragment, length) for fragment in PATHOLOGICAL]
+    + [fill(fragment, length - 1) + "!" for fragment in PATHOLOGICAL]
+    + [fuzz(length) for _ in range(samples)]
+    for length in lengths
+}
+
+print(f"Worst time in microseconds ({len(inputs[lengths[0]])} molts per length):")
+print(f"  {'pattern':<20}{lengths[0]:>10}{lengths[1]:>10}{'growth':>10}")
+for name, run in RUNNERS.items():
+    short, long = (worst_time(run, inputs[length]) * 1e6 for length in lengths)
+    print(f"  {name:<20}{short:>10.1f}{long:>10.1f}{long / short:>10.1f}")
@@ -0,0 +1,40 @@
+""" Delivers queued notifications.
+
+Usage: python3 scripts/deliver_notifications.py [--once]
+
+Needed when NOTIFICATION_QUEUE is "database": requests store notifications in the
+notification_event table and this worker delivers them in batches, polling every
+NOTIFICATION_POLL_INTERVAL seconds while the queue is empty or delivery fails. Run
+exactly one. With --once it delivers whatever is queued and exits.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import config
+from crabber import app
+import logging
+import notification_queue
+import time
+
+app.app_context().push()
+logging.basicConfig(level=logging.INFO)
+
+once = "--once" in sys.argv[1:]
+delivered = 0
+while True:
+    try:
+        batch = notification_queue.deliver_pending()
+    except Exception:
+        # Already logged; events that failed are retried until they're dropped
+        time.sleep(config.NOTIFICATION_POLL_INTERVAL)
+        continue
+    delivered += batch
+    if not batch:
+        if once:
+            break
+        time.sleep(config.NOTIFICATION_POLL_INTERVAL)
+
+print(f"Delivered {delivered} notification event(s).")
@@ -0,0 +1,121 @@
+""" Checks that the feed queries are served by the indexes declared in `models`.
+
+Usage: python3 scripts/explain_feeds.py [username]
+
+Runs EXPLAIN (EXPLAIN QUERY PLAN on SQLite) on each feed query as seen by
+`username` (or the first active crab) and reports which indexes the database
+chose. The crabtag feed is checked for the most used crabtag. Exits with status 1
+if any feed doesn't use one of its expected indexes, e.g. because
+`scripts/migrate.py` hasn't been run yet.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from crabber import app
+from extensions import db
+from models import Crab, Crabtag, Molt, Notification, crabtag_table
+import re
+from typing import Set, Tuple
+
+app.app_context().push()
+
+
+def explain(query) -> Tuple[str, Set[str]]:
+    """Returns the database's query plan for `query` and the indexes it uses."""
+    compiled = query.statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    prefix = "EXPLAIN QUERY PLAN" if db.engine.dialect.name == "sqlite" else "EXPLAIN"
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"{prefix} {compiled}", params).fetchall()
+    plan = "\n".join(" ".join(str(value) for value in row) for row in rows).lower()
+    if db.engine.dialect.name == "sqlite":
+        indexes = set(re.findall(r"using (?:covering )?index (\w+)", plan))
+    else:
+        indexes = {row._mapping["key"].lower() for row in rows if row._mapping["key"]}
+    return plan, indexes
+
+
+if len(sys.argv) > 1:
+    crab = Crab.get_by_username(sys.argv[1])
+else:
+    crab = Crab.query_all().first()
+if crab is None:
+    sys.exit("No crab to explain feeds for.")
+tag = (
+    db.session.query(Crabtag.name)
+    .join(crabtag_table, crabtag_table.c.tag_id == Crabtag.id)
+    .group_by(Crabtag.id)
+    .order_by(db.func.count().desc())
+    .first()
+)
+tag_name = tag.name if tag else "crabber"
+
+# Feed name -> (query, indexes any of which the plan should use)
+feeds = {
+    # Checked whether or not this crab's timeline is built yet
+    "timeline": (
+        crab.query_materialized_timeline(),
+        {"ix_timeline_crab_timestamp"},
+    ),
+    "live timeline": (
+        crab.query_live_timeline(),
+        {"ix_following_follower_following", "ix_molt_author_reply_timestamp"},
+    ),
+    "wild west": (
+        crab.query_wild(),
+        {"ix_molt_timestamp", "ix_molt_wild"},
+    ),
+    "profile molts": (
+        crab.query_profile_molts(crab),
+        {"ix_molt_author_reply_timestamp"},
+    ),
+    "profile replies": (
+        crab.query_profile_replies(crab),
+        {"ix_molt_author_reply_timestamp"},
+    ),
+    "crabtag": (
+        Molt.query_fast_with_tag(tag_name),
+        {"ix_crabtag_name", "ix_crabtag_links_tag_molt"},
+    ),
+    # Likes are found by the (crab_id, molt_id) unique constraint, which MySQL
+    # names after its first column
+    "likes": (
+        crab.query_likes(),
+        {"sqlite_autoindex_like_1", "crab_id"},
+    ),
+    "bookmarks": (
+        crab.query_bookmarks(),
+        {"ix_bookmark_crab_timestamp"},
+    ),
+    "notifications": (
+        Notification.query.filter_by(recipient=crab, read=False).order_by(
+            Notification.timestamp.desc()
+        ),
+        {"ix_notification_recipient_read_timestamp"},
+    ),
+}
+
+print(f"Explaining feeds for @{crab.username} on {db.engine.dialect.name}:")
+print(f"  (crabtag feed: %{tag_name})")
+failures = 0
+for name, (query, expected) in feeds.items():
+    plan, indexes = explain(query)
+    used = sorted(expected & indexes)
+    if used:
+        print(f"  OK    {name}: {', '.join(used)}")
+    else:
+        failures += 1
+        print(f"  MISS  {name}: expected one of {', '.join(sorted(expected))}")
+        print("        " + plan.replace("\n", "\n        "))
+
+if failures:
+    sys.exit(f"{failures} feed(s) missed their indexes.")
+print("All feeds use their indexes.")
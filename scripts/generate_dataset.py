@@ -0,0 +1,401 @@
+""" Fills a database with a synthetic, production-shaped dataset.
+
+Usage: python3 scripts/generate_dataset.py DATABASE [--crabs N] [--molts N]
+                                           [--seed N] [--now TIME] [--no-render]
+                                           [--force]
+
+DATABASE is a SQLite file, which is replaced if --force is given. Crabs follow each
+other along a power-law graph (a few accounts are followed by most crabs), post in
+proportion to a power-law activity level, and reply, quote, remolt, mention, tag,
+link, like, bookmark and block at roughly the site's ratios. Notifications are
+created for everything that would send one. Rows are written with batched Core
+inserts and engagement counters are set directly, so a million molts takes a few
+minutes; rendering their rich content (skippable with --no-render) takes longer.
+
+The same seed and --now (an ISO 8601 UTC time the data leads up to, `DEFAULT_NOW`
+if omitted) always produce the same database. Benchmarks use `generate` to seed
+their own databases.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from array import array
+import bisect
+from crabber import app
+import datetime
+from extensions import db
+import itertools
+import json
+from models import (
+    Bookmark,
+    Crab,
+    Crabtag,
+    Like,
+    Molt,
+    Notification,
+    NotificationGroup,
+    Trophy,
+    blocking_table,
+    crabtag_table,
+    following_table,
+)
+import random
+from sqlalchemy import bindparam
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+WORDS = (
+    "crab lobster shell claw sand tide ocean reef molt sideways scuttle pinch "
+    "seaweed beach wave current coral bubble hermit kelp brine shore rock pool "
+    "barnacle plankton dune gull drift salt the a of and to in is it that on"
+).split()
+LINK_DOMAINS = ("example.com", "crabber.net", "en.wikipedia.org", "github.com")
+TAG_COUNT = 500
+
+# Chance that a molt is each kind of reply to an earlier molt
+REMOLT_RATIO = 0.08
+REPLY_RATIO = 0.2
+QUOTE_RATIO = 0.03
+# Chance that a molt with content mentions someone, uses a crabtag or has a link
+MENTION_RATIO = 0.15
+TAG_RATIO = 0.1
+LINK_RATIO = 0.08
+# Average follows per crab, and how strongly follows favor popular crabs
+MEAN_FOLLOWING = 40
+POPULARITY_EXPONENT = 1.1
+# Shape of the like count distribution (Pareto, mean of about 2 per molt)
+LIKE_SHAPE = 1.5
+BOOKMARK_RATIO = 0.05
+BLOCKING_RATIO = 0.02
+READ_RATIO = 0.8
+# When the generated activity ends, fixed so that runs are reproducible
+DEFAULT_NOW = datetime.datetime(2022, 1, 1)
+# `Crab.hash_pass("crabber")` with a fixed salt, since a random one differs per run
+PASSWORD_HASH = (
+    "$5$rounds=535000$crabber0$BZJXMcQElAftQsiqrX6pQATiMZ1PtZ6pL6Ytaa4deeA"
+)
+
+
+class BatchWriter:
+    """Queues rows per table and inserts them `batch_size` at a time."""
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.rows: Dict[object, List[dict]] = dict()
+        self.counts: Dict[str, int] = dict()
+
+    def add(self, table, **row):
+        """Queues a row for `table`, inserting the queue once it is full."""
+        rows = self.rows.setdefault(table, list())
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        """Inserts the queued rows of `table`, or of every table if None."""
+        for table in [table] if table is not None else list(self.rows):
+            rows = self.rows.pop(table, None)
+            if rows:
+                db.session.execute(table.insert(), rows)
+                self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+
+
+def power_law_weights(count: int, exponent: float) -> List[float]:
+    """Returns cumulative Zipf weights for `count` items, the first most likely."""
+    return list(
+        itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1))
+    )
+
+
+def choose(rng: random.Random, cum_weights: Sequence[float]) -> int:
+    """Returns a 1-based index drawn according to `cum_weights`."""
+    return bisect.bisect(cum_weights, rng.random() * cum_weights[-1]) + 1
+
+
+def generate(
+    crab_count: int,
+    molt_count: int,
+    seed: int = 0,
+    now: datetime.datetime = DEFAULT_NOW,
+    batch_size: int = 10000,
+    render: bool = True,
+    log: Callable[[str], None] = print,
+) -> Dict[str, int]:
+    """Replaces the app's database with a synthetic dataset.
+
+    Must be run in a request context if `render` is set, since rendering uses
+    templates. Crab n is named "crabn" and has the password "crabber".
+
+    :param crab_count: Number of crabs to create
+    :param molt_count: Number of molts to create, including remolts
+    :param seed: Seed for the random generator
+    :param now: UTC time the generated activity leads up to
+    :param batch_size: Number of rows inserted at a time
+    :param render: Whether to store the molts' rendered rich content
+    :param log: Called with progress messages
+    :return: Number of rows created per table
+    """
+    rng = random.Random(seed)
+    now = now.replace(microsecond=0)
+    started = time.perf_counter()
+
+    def progress(message: str):
+        log(f"  [{time.perf_counter() - started:7.1f}s] {message}")
+
+    db.drop_all()
+    db.create_all()
+    if db.engine.dialect.name == "sqlite":
+        # Durability doesn't matter for a database that can be regenerated
+        db.session.execute("PRAGMA synchronous = OFF")
+        db.session.execute("PRAGMA journal_mode = MEMORY")
+    writer = BatchWriter(batch_size)
+
+    with open(os.path.join(parentdir, "trophies.json"), "r") as f:
+        for trophy in json.load(f):
+            db.session.add(Trophy(**trophy))
+
+    # Crabs, with IDs shuffled across popularity and activity ranks so the busiest
+    # accounts aren't all the oldest ones
+    crab_ids = range(1, crab_count + 1)
+    popularity = power_law_weights(crab_count, POPULARITY_EXPONENT)
+    popular_ids = rng.sample(crab_ids, crab_count)
+    active_ids = rng.sample(crab_ids, crab_count)
+    password = PASSWORD_HASH
+    register_times = array("d")
+    for crab_id in crab_ids:
+        register_time = now - datetime.timedelta(
+            days=365 + rng.randrange(3 * 365), seconds=rng.randrange(86400)
+        )
+        register_times.append(register_time.timestamp())
+        writer.add(
+            Crab.__table__,
+            id=crab_id,
+            username=f"crab{crab_id}",
+            email=f"crab{crab_id}@example.com",
+            display_name=f"Crab {crab_id}",
+            password=password,
+            register_time=register_time,
+            timezone=rng.choice(("-06.00", "-05.00", "+00.00", "+01.00", "+09.00")),
+        )
+    writer.flush()
+    progress(f"Created {crab_count} crabs")
+
+    def random_time(crab_id: int) -> datetime.datetime:
+        """Returns a random time after `crab_id` registered."""
+        since = register_times[crab_id - 1]
+        return datetime.datetime.fromtimestamp(
+            since + rng.random() * (now.timestamp() - since)
+        ).replace(microsecond=0)
+
+    def notify(
+        recipient_id: int,
+        sender_id: int,
+        type: str,
+        timestamp: datetime.datetime,
+        molt_id: Optional[int] = None,
+    ):
+        """Queues the notification `Crab.notify` would have sent."""
+        if recipient_id != sender_id:
+            writer.add(
+                Notification.__table__,
+                recipient_id=recipient_id,
+                sender_id=sender_id,
+                type=type,
+                timestamp=timestamp,
+                read=rng.random() < READ_RATIO,
+                molt_id=molt_id,
+            )
+
+    # Follows, favoring popular crabs
+    for follower_id in crab_ids:
+        wanted = min(crab_count - 1, int(rng.expovariate(1 / MEAN_FOLLOWING)) + 1)
+        following_ids = set()
+        for _ in range(wanted * 2):
+            following_id = popular_ids[choose(rng, popularity) - 1]
+            if following_id != follower_id:
+                following_ids.add(following_id)
+                if len(following_ids) >= wanted:
+                    break
+        for following_id in sorted(following_ids):
+            writer.add(
+                following_table, follower_id=follower_id, following_id=following_id
+            )
+            notify(following_id, follower_id, "follow", random_time(follower_id))
+        if rng.random() < BLOCKING_RATIO:
+            for blocked_id in rng.sample(crab_ids, min(crab_count, 5)):
+                if blocked_id != follower_id and blocked_id not in following_ids:
+                    writer.add(
+                        blocking_table, blocker_id=follower_id, blocked_id=blocked_id
+                    )
+    writer.flush()
+    progress(f"Created {writer.counts.get('following', 0)} follows")
+
+    tag_weights = power_law_weights(TAG_COUNT, 1.0)
+    for tag_id in range(1, TAG_COUNT + 1):
+        writer.add(Crabtag.__table__, id=tag_id, name=f"{rng.choice(WORDS)}{tag_id}")
+    writer.flush()
+    tag_names = {
+        row.id: row.name for row in db.session.query(Crabtag.id, Crabtag.name)
+    }
+
+    # Molts, spread evenly over the last year. Children are counted as they're
+    # created and stored on their parents once every molt exists.
+    activity = power_law_weights(crab_count, POPULARITY_EXPONENT)
+    authors = array("i")
+    originals = array("i")
+    child_counts: Dict[int, List[int]] = dict()
+    start = now - datetime.timedelta(days=365)
+    for molt_id in range(1, molt_count + 1):
+        author_id = active_ids[choose(rng, activity) - 1]
+        timestamp = start + datetime.timedelta(days=365) * (molt_id / molt_count)
+        timestamp = timestamp.replace(microsecond=0)
+        row = dict(
+            id=molt_id,
+            author_id=author_id,
+            timestamp=timestamp,
+            is_remolt=False,
+            is_reply=False,
+            is_quote=False,
+            original_molt_id=None,
+            like_count=0,
+            raw_mentions="",
+            raw_tags="",
+        )
+        authors.append(author_id)
+        originals.append(0)
+
+        kind = rng.random() if molt_id > 1 else 1
+        if kind < REMOLT_RATIO + REPLY_RATIO + QUOTE_RATIO:
+            # Mostly respond to recent molts
+            original_id = max(1, molt_id - 1 - int(rng.expovariate(1 / 200)))
+            original_id = originals[original_id - 1] or original_id
+            if kind < REMOLT_RATIO:
+                row.update(is_remolt=True, original_molt_id=original_id)
+                originals[-1] = original_id
+                notification_type, count_index = "remolt", 1
+            elif kind < REMOLT_RATIO + REPLY_RATIO:
+                row.update(is_reply=True, original_molt_id=original_id)
+                notification_type, count_index = "reply", 0
+            else:
+                row.update(is_quote=True, original_molt_id=original_id)
+                notification_type, count_index = "quote", 2
+            child_counts.setdefault(original_id, [0, 0, 0])[count_index] += 1
+            notify(
+                authors[original_id - 1],
+                author_id,
+                notification_type,
+                timestamp,
+                molt_id=molt_id,
+            )
+
+        if row["is_remolt"]:
+            row["content"] = ""
+        else:
+            words = rng.choices(WORDS, k=rng.randint(2, 40))
+            if rng.random() < MENTION_RATIO:
+                mentioned_id = popular_ids[choose(rng, popularity) - 1]
+                words.insert(rng.randrange(len(words)), f"@crab{mentioned_id}")
+                row["raw_mentions"] = f"crab{mentioned_id}\n"
+                notify(mentioned_id, author_id, "mention", timestamp, molt_id=molt_id)
+            if rng.random() < TAG_RATIO:
+                tag_id = choose(rng, tag_weights)
+                words.append(f"%{tag_names[tag_id]}")
+                row["raw_tags"] = f"{tag_names[tag_id]}\n"
+                writer.add(crabtag_table, molt_id=molt_id, tag_id=tag_id)
+            if rng.random() < LINK_RATIO:
+                domain = rng.choice(LINK_DOMAINS)
+                words.append(f"https://{domain}/{rng.choice(WORDS)}/{molt_id}")
+            row["content"] = " ".join(words)
+
+            # Likes go to the molts people see, not to remolt shells
+            like_count = min(crab_count, int(rng.paretovariate(LIKE_SHAPE)) - 1)
+            row["like_count"] = like_count
+            for crab_id in rng.sample(crab_ids, like_count):
+                liked_at = timestamp + datetime.timedelta(
+                    minutes=int(rng.expovariate(1 / 120))
+                )
+                writer.add(Like.__table__, crab_id=crab_id, molt_id=molt_id)
+                notify(author_id, crab_id, "like", liked_at, molt_id=molt_id)
+                if rng.random() < BOOKMARK_RATIO:
+                    writer.add(
+                        Bookmark.__table__,
+                        crab_id=crab_id,
+                        molt_id=molt_id,
+                        timestamp=liked_at,
+                    )
+        writer.add(Molt.__table__, **row)
+        if molt_id % (batch_size * 10) == 0 and molt_id < molt_count:
+            progress(f"Created {molt_id} molts")
+    writer.flush()
+    progress(f"Created {molt_count} molts")
+
+    molt_table = Molt.__table__
+    set_counts = (
+        molt_table.update()
+        .where(molt_table.c.id == bindparam("molt_id"))
+        .values(
+            reply_count=bindparam("replies"),
+            remolt_count=bindparam("remolts"),
+            quote_count=bindparam("quotes"),
+        )
+    )
+    counts = [
+        dict(molt_id=molt_id, replies=replies, remolts=remolts, quotes=quotes)
+        for molt_id, (replies, remolts, quotes) in sorted(child_counts.items())
+    ]
+    for batch_start in range(0, len(counts), batch_size):
+        db.session.execute(set_counts, counts[batch_start:batch_start + batch_size])
+    db.session.commit()
+    progress(f"Counted replies, remolts and quotes of {len(counts)} molts")
+
+    progress(f"Built {NotificationGroup.rebuild()} notification groups")
+    Crab.recount_unread_notifications(batch_size=batch_size)
+    progress("Counted unread notifications")
+
+    if render:
+        progress(f"Rendered {Molt.rerender(batch_size=batch_size)} molts")
+
+    return writer.counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset.")
+    parser.add_argument("database", help="SQLite file to create")
+    parser.add_argument("--crabs", type=int, default=10000)
+    parser.add_argument("--molts", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--now",
+        type=datetime.datetime.fromisoformat,
+        default=DEFAULT_NOW,
+        help="UTC time the activity leads up to (default: %(default)s)",
+    )
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--no-render", action="store_true", help="Skip rendering")
+    parser.add_argument("--force", action="store_true", help="Replace DATABASE")
+    args = parser.parse_args()
+
+    database_path = os.path.abspath(args.database)
+    if os.path.exists(database_path) and not args.force:
+        sys.exit(f"{database_path} already exists (use --force to replace it).")
+
+    # Set before the first query creates the engine
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{database_path}"
+    app.test_request_context().push()
+
+    print(f"Generating {database_path} (seed {args.seed})...")
+    counts = generate(
+        args.crabs,
+        args.molts,
+        seed=args.seed,
+        now=args.now,
+        batch_size=args.batch_size,
+        render=not args.no_render,
+    )
+    for table, count in sorted(counts.items()):
+        print(f"  {table:<16}{count:>12}")
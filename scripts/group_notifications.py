@@ -0,0 +1,30 @@
+""" Rebuilds the grouped notifications shown on the notifications page.
+
+Usage: python3 scripts/group_notifications.py [username ...]
+
+Rebuilds the given crabs' notification groups from their notifications, or every
+crab's when no usernames are given. Groups are kept up to date as notifications are
+sent, so this is only needed to backfill them or to correct drift.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from crabber import app
+from models import Crab, NotificationGroup
+
+app.app_context().push()
+
+usernames = sys.argv[1:]
+if usernames:
+    crabs = [Crab.get_by_username(username) for username in usernames]
+    missing = [name for name, crab in zip(usernames, crabs) if crab is None]
+    if missing:
+        print(f"No crab found with username(s): {', '.join(missing)}")
+    built = NotificationGroup.rebuild(crab.id for crab in crabs if crab)
+else:
+    built = NotificationGroup.rebuild()
+
+print(f"Built {built} notification group(s).")
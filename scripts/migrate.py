@@ -0,0 +1,188 @@
+""" Applies pending schema migrations (new columns/indexes on existing tables).
+
+New tables are created by `db.create_all()`, but existing tables have to be
+altered. Each migration runs once and is recorded in the `schema_version` table.
+Migrations are idempotent so databases created from scratch by
+`initialize_database.py` can be brought up to date safely.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import datetime
+from crabber import app
+from extensions import db
+import models
+from sqlalchemy import func, inspect as inspect_db
+from sqlalchemy.schema import CreateColumn
+
+app.app_context().push()
+
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String(256), nullable=False),
+    db.Column("applied", db.DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Registers a migration function under `version`."""
+
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+
+    return decorator
+
+
+def add_column(column):
+    """Adds a model column to its table if it doesn't exist yet."""
+    table = column.table.name
+    existing = [col["name"] for col in inspect_db(db.engine).get_columns(table)]
+    if column.name not in existing:
+        ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+        print(f"  Adding column {table}.{column.name}")
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+
+
+def get_index(table, name):
+    """Returns the index of `table` named `name`."""
+    return next(index for index in table.indexes if index.name == name)
+
+
+def add_index(index):
+    """Creates a model index if it doesn't exist yet."""
+    table = index.table.name
+    existing = [idx["name"] for idx in inspect_db(db.engine).get_indexes(table)]
+    if index.name not in existing:
+        print(f"  Creating index {index.name} on {table}")
+        index.create(bind=db.engine)
+
+
+@migration(1, "Materialized home timelines")
+def timeline_state():
+    add_column(models.Crab.__table__.c.timeline_built)
+
+
+@migration(2, "Stored engagement counters on molts")
+def engagement_counters():
+    add_column(models.Molt.__table__.c.like_count)
+    add_column(models.Molt.__table__.c.reply_count)
+    add_column(models.Molt.__table__.c.remolt_count)
+    add_column(models.Molt.__table__.c.quote_count)
+    print(f"  Recounted {models.Molt.recount()} molt(s)")
+
+
+@migration(3, "Composite indexes for feed queries")
+def feed_indexes():
+    for table, name in (
+        (models.Molt.__table__, "ix_molt_timestamp"),
+        (models.Molt.__table__, "ix_molt_wild"),
+        (models.Molt.__table__, "ix_molt_author_reply_timestamp"),
+        (models.Molt.__table__, "ix_molt_original_author"),
+        (models.following_table, "ix_following_follower_following"),
+        (models.following_table, "ix_following_following_follower"),
+        (models.blocking_table, "ix_blocking_blocker_blocked"),
+        (models.blocking_table, "ix_blocking_blocked_blocker"),
+        (models.crabtag_table, "ix_crabtag_links_tag_molt"),
+        (models.crabtag_table, "ix_crabtag_links_molt"),
+        (models.Like.__table__, "ix_like_molt_crab"),
+        (models.Bookmark.__table__, "ix_bookmark_crab_timestamp"),
+        (models.Notification.__table__, "ix_notification_recipient_read_timestamp"),
+        (models.Notification.__table__, "ix_notification_recipient_timestamp"),
+        (models.DeveloperKey.__table__, "ix_developer_keys_key"),
+        (models.AccessToken.__table__, "ix_access_tokens_key"),
+        (models.Crabtag.__table__, "ix_crabtag_name"),
+        (models.Card.__table__, "ix_card_url"),
+    ):
+        add_index(get_index(table, name))
+
+
+@migration(4, "Timeline watermarks for the new molts poll")
+def timeline_watermarks():
+    add_column(models.Crab.__table__.c.timeline_watermark)
+    # Treat everything already posted as seen
+    latest_id = db.session.query(func.max(models.Molt.id)).scalar() or 0
+    models.Crab.query.update(
+        {models.Crab.timeline_watermark: latest_id}, synchronize_session=False
+    )
+
+
+@migration(5, "Stored rendered molt content")
+def rendered_content():
+    add_column(models.Molt.__table__.c.rendered_content)
+    add_column(models.Molt.__table__.c.rendered_version)
+    print("  Run scripts/render_molts.py to render existing molts")
+
+
+@migration(6, "Lowercase username index for mention lookups")
+def username_lower_index():
+    add_index(get_index(models.Crab.__table__, "ix_crab_username_lower"))
+
+
+@migration(7, "Hashed image description URLs for alt text lookups")
+def image_description_src_hash():
+    add_column(models.ImageDescription.__table__.c.src_hash)
+    for description in models.ImageDescription.query.filter(
+        models.ImageDescription.src_hash.is_(None),
+        models.ImageDescription.src.isnot(None),
+    ):
+        description.src_hash = models.ImageDescription.hash_src(description.src)
+    db.session.commit()
+    # Needs the column above, so migration 3 must not create it
+    add_index(
+        get_index(models.ImageDescription.__table__, "ix_image_description_src_hash")
+    )
+    # Superseded prefix index, left by earlier versions of migration 3
+    existing = inspect_db(db.engine).get_indexes("image_description")
+    if "ix_image_description_src" in [index["name"] for index in existing]:
+        print("  Dropping index ix_image_description_src")
+        on_table = " ON image_description" if db.engine.dialect.name == "mysql" else ""
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(f"DROP INDEX ix_image_description_src{on_table}")
+
+
+@migration(8, "Grouped notifications maintained on write")
+def notification_groups():
+    # The table itself is created by `db.create_all()`
+    print(f"  Built {models.NotificationGroup.rebuild()} notification group(s)")
+
+
+@migration(9, "Stored unread notification counts on crabs")
+def unread_notification_counts():
+    add_column(models.Crab.__table__.c.unread_notification_count)
+    print(f"  Recounted {models.Crab.recount_unread_notifications()} crab(s)")
+
+
+@migration(10, "Index trophy cases by owner")
+def trophy_case_owner_index():
+    add_index(get_index(models.TrophyCase.__table__, "ix_trophy_case_owner_trophy"))
+
+
+@migration(11, "Index crabs by registration time")
+def crab_register_time_index():
+    add_index(get_index(models.Crab.__table__, "ix_crab_register_time"))
+
+
+if __name__ == "__main__":
+    db.create_all()
+    applied = {row.version for row in db.session.query(schema_version.c.version)}
+    for version, description, apply in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version not in applied:
+            print(f"Applying migration {version}: {description}")
+            apply()
+            db.session.execute(
+                schema_version.insert().values(
+                    version=version,
+                    description=description,
+                    applied=datetime.datetime.utcnow(),
+                )
+            )
+            db.session.commit()
+    print("Database is up to date.")
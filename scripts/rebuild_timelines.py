@@ -0,0 +1,42 @@
+""" Rebuilds materialized home timelines.
+
+Usage: python3 scripts/rebuild_timelines.py [username ...]
+
+Rebuilds the given crabs' timelines, or every active crab's when no usernames
+are given. Crabs following more than TIMELINE_MAX_FOLLOWING accounts are
+skipped since their timelines are queried live. Timelines are never built while
+they're read or followed through, so crabs that predate them or unfollow their way
+back under the limit are queried live until this is run.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import config
+from crabber import app
+from models import Crab
+
+app.app_context().push()
+
+usernames = sys.argv[1:]
+if usernames:
+    crabs = [Crab.get_by_username(username) for username in usernames]
+    missing = [name for name, crab in zip(usernames, crabs) if crab is None]
+    if missing:
+        print(f"No crab found with username(s): {', '.join(missing)}")
+    crabs = [crab for crab in crabs if crab]
+else:
+    crabs = Crab.query_all().order_by(Crab.id).all()
+
+rebuilt = 0
+for crab in crabs:
+    if crab.raw_following_count > config.TIMELINE_MAX_FOLLOWING:
+        if crab.timeline_built:
+            crab.clear_timeline()
+        continue
+    crab.rebuild_timeline()
+    rebuilt += 1
+
+print(f"Rebuilt {rebuilt} timeline(s).")
@@ -0,0 +1,22 @@
+""" Reconciles the stored like/reply/remolt/quote counters on molts.
+
+Usage: python3 scripts/recount_engagement.py [molt_id ...]
+
+Recomputes the given molts' counters, or every molt's when no IDs are given,
+and reports how many had drifted from the like and molt tables.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from crabber import app
+from models import Molt
+
+app.app_context().push()
+
+molt_ids = [int(molt_id) for molt_id in sys.argv[1:]] or None
+fixed = Molt.recount(molt_ids)
+
+print(f"Corrected counters on {fixed} molt(s).")
@@ -0,0 +1,31 @@
+""" Reconciles the stored unread notification counts on crabs.
+
+Usage: python3 scripts/recount_unread_notifications.py [username ...]
+
+Recomputes the given crabs' unread notification counts, or every crab's when no
+usernames are given, and reports how many had drifted from the notification table.
+Counts are kept up to date as notifications are sent and read, so this only needs
+to run periodically (e.g. nightly from cron) to correct drift.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from crabber import app
+from models import Crab
+
+app.app_context().push()
+
+usernames = sys.argv[1:]
+if usernames:
+    crabs = [Crab.get_by_username(username) for username in usernames]
+    missing = [name for name, crab in zip(usernames, crabs) if crab is None]
+    if missing:
+        print(f"No crab found with username(s): {', '.join(missing)}")
+    fixed = Crab.recount_unread_notifications(crab.id for crab in crabs if crab)
+else:
+    fixed = Crab.recount_unread_notifications()
+
+print(f"Corrected unread notification counts on {fixed} crab(s).")
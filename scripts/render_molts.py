@@ -0,0 +1,26 @@
+""" Re-renders the stored rich content of molts.
+
+Usage: python3 scripts/render_molts.py [--all] [molt_id ...]
+
+Renders the given molts, or every molt rendered with outdated rules (see
+`config.RENDER_VERSION`) or whose mentions went stale when no IDs are given. Pass --all to re-render molts that
+are already up to date as well.
+"""
+import os, sys, inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from crabber import app
+from models import Molt
+
+# Rendering uses templates, which need a request context
+app.test_request_context().push()
+
+args = sys.argv[1:]
+render_all = "--all" in args
+molt_ids = [int(molt_id) for molt_id in args if molt_id != "--all"] or None
+rendered = Molt.rerender(molt_ids, stale_only=not (render_all or molt_ids))
+
+print(f"Rendered {rendered} molt(s).")
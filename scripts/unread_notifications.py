@@ -19,7 +19,7 @@ crab = Crab.get_by_username(username)
 if crab:
     for notification in crab.notifications[:amount]:
         notification.read = False
+    db.session.commit()
+    Crab.recount_unread_notifications([crab.id])
 else:
     print("No crab found with that username.")
-
-db.session.commit()
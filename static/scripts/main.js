@@ -27,6 +27,10 @@ function GetData(request_type, data, callback, error_callback=null) {
     if (request_data.timestamp == -1) {
         request_data.timestamp = $("meta[name='last-refresh']").attr("content");
     }
+    // Timeline watermark asking for substitution
+    if (request_data.since == -1) {
+        request_data.since = $("meta[name='timeline-watermark']").attr("content") || 0;
+    }
 
     $.ajax({
         url: "/ajax_request/" + request_type + "/",
@@ -175,6 +179,15 @@ function updateNewMoltIndicator(molt_count) {
     }
 }
 
+// Request parameters for a feed page, preferring its cursor over the page number
+function pageParams(page, cursor=null, prefix='') {
+    let params = {};
+    params[`${prefix}p`] = page;
+    if (cursor) {
+        params[`${prefix}c`] = cursor;
+    }
+    return params;
+}
 
 function updateImgPreview(imgInput) {
     var imgPreview = $(imgInput.form).find(".img-preview");
@@ -1,6 +1,7 @@
 from collections.abc import Sequence
 from flask import escape
 import patterns
+import rich_content
 
 
 def check_pattern(pattern, sample, exact=False, strip=False):
@@ -298,3 +299,175 @@ def test_protocol_identifier():
     ]
 
     assert_negative(patterns.protocol_identifier, negative_samples)
+
+
+def test_url_essence():
+    samples = {
+        "https://www.reddit.com/u/jaik_": "reddit.com/u/jaik_",
+        "http://crabber.net/timeline/?p=2": "crabber.net/timeline/",
+        "crabber.net": "crabber.net",
+        "my-site.example./a./b": "my-site.example./a./b",
+        "https://a..b": "a.",
+        "https://a//b": "a/",
+        "https://www.": "www.",
+        "https://": "https",
+    }
+
+    for url, essence in samples.items():
+        assert patterns.url_essence.match(url).group(1) == essence
+        assert patterns.pretty_url.match(url).group(1) == essence
+
+    assert patterns.url_essence.match("/crabber.net") is None
+
+
+def test_url_patterns_linear():
+    # Used to backtrack exponentially whenever the rest of the pattern failed
+    for fragment in ("a", "a.", "a/", "a./", "a-."):
+        content = fragment * 5000 + "!"
+
+        assert patterns.url_essence.fullmatch(content) is None
+        assert patterns.pretty_url.search(content).end() == len(content) - 1
+
+
+# Content rendering. Expected markup is spelled out in full because rendered molts
+# must not change byte for byte.
+
+
+def link_html(url, text):
+    return (
+        f'<a href="{url}" class="no-onclick mention zindex-front"'
+        + " " * 13
+        + f'target="_blank">{text}</a>'
+    )
+
+
+def md_link_html(url, text):
+    return (
+        f'<a href="{url}" class="no-onclick mention'
+        + " " * 13
+        + f'zindex-front" target="_blank">{text}</a>'
+    )
+
+
+def mention_html(username, text, base_url=""):
+    return (
+        f'<a href="{base_url}/user/{username}"'
+        + " " * 17
+        + 'target="_blank" class="no-onclick mention zindex-front">'
+        + " " * 17
+        + f"{text}</a>"
+    )
+
+
+def crabtag_html(tag, text, base_url=""):
+    return (
+        f'<a href="{base_url}/crabtag/{tag}"'
+        + " " * 13
+        + 'target="_blank" class="no-onclick crabtag zindex-front">'
+        + " " * 13
+        + f"{text}</a>"
+    )
+
+
+def is_username(username):
+    return username.lower() in ("jake", "a")
+
+
+def test_label_spoilers():
+    content = str(escape("a >!boo!< b >! two !< c"))
+    spoiler = '<span class="molt-content-spoiler" onclick="revealSpoiler(event);">'
+
+    assert rich_content.label_spoilers(content) == (
+        f"a {spoiler}boo!</span> b {spoiler}two !</span> c"
+    )
+
+
+def test_label_links():
+    content = str(
+        escape(
+            "[my site](crabber.net) check google.com and "
+            "https://crabber.net/moderation/?molt_id=1&viewing=molt"
+        )
+    )
+
+    assert rich_content.label_links(content) == (
+        md_link_html("https://crabber.net", "my site")
+        + " check "
+        + link_html("https://google.com", "google.com")
+        + " and "
+        + link_html(
+            "https://crabber.net/moderation/?molt_id=1&amp;viewing=molt",
+            "https://crabber.net/moderation/?...",
+        ),
+        [
+            "https://crabber.net",
+            "google.com",
+            "https://crabber.net/moderation/?molt_id=1&amp;viewing=molt",
+        ],
+    )
+
+    # Each link used to be searched for in the rest of the content on its own
+    assert rich_content.label_links("crabber.netgoogle.com")[0] == (
+        link_html("https://crabber.net", "crabber.net")
+        + link_html("https://google.com", "google.com")
+    )
+
+
+def test_label_mentions():
+    assert rich_content.label_mentions("hello @jake and @nobody", is_username) == (
+        "hello" + mention_html("jake", " @jake") + " and @nobody"
+    )
+    assert rich_content.label_mentions("@jake@a", is_username) == (
+        mention_html("jake", "@jake") + mention_html("a", "@a")
+    )
+    assert rich_content.label_mentions("not \\@jake", is_username) == "not \\@jake"
+
+    # Only the first mention has ever been given the base URL
+    assert rich_content.label_mentions(
+        "@jake @a", is_username, base_url="https://crabber.net"
+    ) == (
+        mention_html("jake", "@jake", base_url="https://crabber.net")
+        + mention_html("a", " @a")
+    )
+
+
+def test_label_crabtags():
+    assert rich_content.label_crabtags("%crabs and %crabber_2<br>") == (
+        crabtag_html("crabs", "%crabs")
+        + " and"
+        + crabtag_html("crabber_2", " %crabber_2")
+        + "<br>"
+    )
+    assert rich_content.label_crabtags("%crabs%more", "https://crabber.net") == (
+        crabtag_html("crabs", "%crabs", base_url="https://crabber.net")
+        + crabtag_html("more", "%more")
+    )
+
+
+def test_label_many_matches():
+    # Used to recurse once per match
+    content = " @jake" * 5000
+
+    assert rich_content.label_mentions(content, is_username) == (
+        mention_html("jake", " @jake") * 5000
+    )
+
+
+def test_extract_embed():
+    content = "a https://x.com/p.png b https://y.org/q.gif c"
+
+    new_content, match = rich_content.extract_embed(content, patterns.ext_img)
+
+    assert new_content == patterns.ext_img.sub("", content)
+    assert match.group(1) == "https://x.com/p.png"
+
+
+def test_mentioned_usernames():
+    content = "@jake hi @a<br>@nobody \\@escaped &nbsp;@spaced"
+
+    assert rich_content.mentioned_usernames(content) == [
+        "jake",
+        "a",
+        "nobody",
+        "&nbsp;@spaced",
+    ]
@@ -0,0 +1,48 @@
+from crabber import app
+from extensions import db
+import json
+from models import Crab, Trophy
+import os
+import pytest
+
+
+@pytest.fixture
+def client(tmp_path):
+    """Yields a test client backed by a database holding only the trophies."""
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'rss.db'}"
+    with app.app_context():
+        db.create_all()
+        trophies = os.path.join(os.path.dirname(__file__), "..", "trophies.json")
+        with open(trophies, "r") as f:
+            for trophy in json.load(f):
+                db.session.add(Trophy(**trophy))
+        db.session.commit()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def make_crab(username):
+    """Creates a Crab with placeholder details."""
+    return Crab.create_new(
+        username=username,
+        email=f"{username}@example.com",
+        password="crabber",
+        display_name=username.title(),
+        avatar="https://cdn.crabber.net/img/avatar.jpg",
+    )
+
+
+def test_rss_timeline_muted_words(client):
+    viewer, author = make_crab("viewer"), make_crab("author")
+    viewer.follow(author)
+    viewer._muted_words = "clams"
+    db.session.commit()
+    first = author.molt("scuttling sideways")
+    author.molt("I love clams")
+
+    response = client.get("/rss/timeline/viewer/")
+    assert response.status_code == 200
+    assert b"scuttling sideways" in response.data
+    assert b"clams" not in response.data
+    assert viewer.count_new_timeline_molts(first.id - 1) == 1
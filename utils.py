@@ -5,7 +5,16 @@ import datetime
 from dateutil.relativedelta import relativedelta
 from dateutil.parser import isoparse
 import extensions
-from flask import escape, redirect, render_template, render_template_string, request
+import functools
+from flask import (
+    current_app,
+    escape,
+    g,
+    has_app_context,
+    Markup,
+    redirect,
+    request,
+)
 import geoip2.database
 from geoip2.errors import AddressNotFoundError
 import json
@@ -13,8 +22,13 @@ import models
 import os
 import patterns
 import random
+import re
+import rich_content
+from sqlalchemy import func
+from sqlalchemy.sql.expression import false
+import time
 import turtle_images
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Pattern, Set, Tuple
 import uuid
 import user_agents
 from werkzeug.wrappers import Response
@@ -90,10 +104,99 @@ def show_message(
 
 
 def get_current_user():
-    """Retrieves the object of the currently logged-in user by ID."""
-    return models.Crab.query.filter_by(
-        id=crabber.session.get("current_user"), deleted=False
-    ).first()
+    """Retrieves the object of the currently logged-in user by ID.
+
+    The user is loaded once per request. It is reloaded if the session logs in or
+    out, or if the account is deleted, in the meantime.
+    """
+    crab_id = crabber.session.get("current_user")
+    cached = g.get("current_user")
+    if cached is None or cached[0] != crab_id or (cached[1] and cached[1].deleted):
+        crab = models.Crab.query.filter_by(id=crab_id, deleted=False).first()
+        g.current_user = cached = (crab_id, crab)
+    return cached[1]
+
+
+def get_viewer_state() -> models.ViewerState:
+    """Retrieves the current user's interaction state for this request's molts."""
+    if "viewer_state" not in g:
+        g.viewer_state = models.ViewerState(get_current_user())
+    return g.viewer_state
+
+
+def get_fast_molt_cache() -> models.FastMoltCache:
+    """Retrieves the current user's fast-molt cache for this request."""
+    if "fast_molt_cache" not in g:
+        g.fast_molt_cache = models.FastMoltCache(get_current_user())
+    return g.fast_molt_cache
+
+
+def prefetch_fast_molts(molts: List):
+    """Loads what a page of fast-molts needs to render in a constant number of queries.
+
+    This covers the Molts they remolt, reply to or quote, and the current user's
+    interactions with all of them.
+    """
+    originals = get_fast_molt_cache().load_originals(molts)
+    get_viewer_state().load([*molts, *originals])
+    prefetch_mentions([*molts, *originals])
+    prefetch_alt_text(molt.image for molt in [*molts, *originals])
+
+
+def prefetch_mentions(molts: List):
+    """Resolves the mentions of every molt that will be rendered live in one query."""
+    resolve_mentions(
+        username
+        for molt in molts
+        if molt.rendered_version != config.RENDER_VERSION or not molt.rendered_content
+        for username in patterns.mention.findall(molt.content)
+    )
+
+
+def get_alt_text_cache() -> Dict[str, Optional[str]]:
+    """Retrieves this request's image descriptions by image URL."""
+    if "alt_text_cache" not in g:
+        g.alt_text_cache = dict()
+    return g.alt_text_cache
+
+
+def prefetch_alt_text(urls: Iterable[Optional[str]]):
+    """Loads the descriptions of every image that will be rendered in one query."""
+    cache = get_alt_text_cache()
+    urls = {url for url in urls if url and url not in cache}
+    if urls:
+        cache.update(models.ImageDescription.get_alts(urls))
+
+
+def get_alt_text(url: str) -> Optional[str]:
+    """Returns an image's description, querying only if it wasn't prefetched."""
+    prefetch_alt_text((url,))
+    return get_alt_text_cache().get(url)
+
+
+def cache_alt_text(url: str, alt: Optional[str]):
+    """Updates this request's cached description of an image after it changes."""
+    if has_app_context():
+        get_alt_text_cache()[url] = alt
+
+
+@functools.lru_cache(maxsize=64)
+def timezone_offset(timezone: str) -> datetime.timedelta:
+    """Parses a `Crab.timezone` string (hours, e.g. "-06.00") into an offset."""
+    return datetime.timedelta(hours=float(timezone))
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_muted_words(raw_muted_words: str) -> Optional[Pattern]:
+    """Compiles a comma-separated muted word list into one case-insensitive regex.
+
+    Compiled patterns are cached, so each distinct list is only compiled once per
+    process. Returns None if no words are muted.
+    """
+    words = sorted(set(filter(None, raw_muted_words.split(","))), key=len, reverse=True)
+    if words:
+        return re.compile("|".join(map(re.escape, words)), re.IGNORECASE)
+    return None
 
 
 def validate_username(username: str) -> (bool, Optional[str]):
@@ -784,10 +887,15 @@ def common_molt_actions() -> Response:
     return redirect(request.url)
 
 
-def get_pretty_age(dt: datetime.datetime, relative_only=False) -> str:
+def get_pretty_age(
+    dt: datetime.datetime,
+    relative_only=False,
+    offset: Optional[datetime.timedelta] = None,
+) -> str:
     """Converts datetime to pretty twitter-esque age string.
 
     :param dt:
+    :param offset: Timezone offset for dates, see `localize`
     :return: Age string
     """
     now: datetime.datetime = datetime.datetime.utcnow()
@@ -806,26 +914,31 @@ def get_pretty_age(dt: datetime.datetime, relative_only=False) -> str:
         return f"{delta.days} day{'s' if delta.days != 1 else ''}"
     elif dt.year == now.year:  # Same year as now
         # Return day and month
-        return localize(dt).strftime("%b %e")
+        return localize(dt, offset).strftime("%b %e")
     else:
         # Return day month, year
-        return localize(dt).strftime("%b %e, %Y")
+        return localize(dt, offset).strftime("%b %e, %Y")
 
 
-def localize(dt: datetime.datetime) -> datetime.datetime:
+def localize(
+    dt: datetime.datetime, offset: Optional[datetime.timedelta] = None
+) -> datetime.datetime:
     """Localizes datetime to user's timezone.
 
     https://www.youtube.com/watch?v=-5wpm-gesOY
 
     :param dt: datetime to localize
+    :param offset: Timezone offset to use instead of the current user's
     :return: Localized datetime
     """
-    current_user = get_current_user()
-    if current_user:
-        new_dt = dt + current_user.timedelta
-    else:
-        # Defaults to Chicago time
-        new_dt = dt + datetime.timedelta(hours=-6)
+    if offset is None:
+        current_user = get_current_user()
+        if current_user:
+            offset = current_user.timedelta
+        else:
+            # Defaults to Chicago time
+            offset = datetime.timedelta(hours=-6)
+    new_dt = dt + offset
 
     # Daylight Saving
     if new_dt.month in range(4, 11) or (new_dt.month == 3 and new_dt.day >= 8):
@@ -913,16 +1026,16 @@ def parse_semantic_content(content, image=None, quoted_molt=None) -> str:
     """
     # Escape/sanitize user submitted content
     new_content = str(escape(content))
-    new_content, _ = label_links(new_content)
+    new_content, _ = rich_content.label_links(new_content)
 
     # Preserve newlines
     new_content = new_content.strip().replace("\n", "<br>")
 
     # Convert mentions into anchor tags
-    new_content = label_mentions(new_content, absolute_url=True)
+    new_content = label_mentions(new_content, base_url=config.BASE_URL)
 
     # Convert crabtags into anchor tags
-    new_content = label_crabtags(new_content, absolute_url=True)
+    new_content = rich_content.label_crabtags(new_content, base_url=config.BASE_URL)
 
     # Add <img/>
     if image:
@@ -951,55 +1064,55 @@ def parse_rich_content(
     # Escape/sanitize user submitted content
     new_content = str(escape(content))
 
-    new_content = label_spoilers(new_content)
+    new_content = rich_content.label_spoilers(new_content)
 
     if include_media:
         # Render youtube link to embedded iframe
-        if patterns.youtube.search(new_content):
-            youtube_id = patterns.youtube.search(new_content).group(1)
-            youtube_embed = render_template_string(
-                f'{{% with video="{youtube_id}" %}}'
-                '   {% include "youtube.html" %}'
-                "{% endwith %}"
-            )
-            new_content = patterns.youtube.sub("", new_content)
+        new_content, youtube_match = rich_content.extract_embed(
+            new_content, patterns.youtube
+        )
+        if youtube_match:
+            youtube_id = youtube_match.group(1)
+            youtube_embed = render_embed("youtube.html", video=Markup(youtube_id))
         else:
             youtube_embed = "<!-- no valid youtube links found -->"
 
         # Render giphy link to embedded iframe
-        if patterns.giphy.search(new_content):
-            giphy_id = patterns.giphy.search(new_content).group(1)
-            giphy_embed = render_template_string(
-                f'{{% with giphy_id="{giphy_id}" %}}'
-                '   {% include "giphy.html" %}'
-                "{% endwith %}",
+        new_content, giphy_match = rich_content.extract_embed(
+            new_content, patterns.giphy
+        )
+        if giphy_match:
+            giphy_id = giphy_match.group(1)
+            giphy_embed = render_embed(
+                "giphy.html",
+                giphy_id=Markup(giphy_id),
                 full_size_media=full_size_media,
                 nsfw=nsfw,
             )
-            new_content = patterns.giphy.sub("", new_content)
         else:
             giphy_embed = "<!-- no valid giphy links found -->"
 
         # Render external image link to external_img macro
-        if patterns.ext_img.search(new_content):
-            image_link = patterns.ext_img.search(new_content).group(1)
-            ext_img_embed = render_template_string(
-                f'{{% with link="{image_link}" %}}'
-                '  {% include "external_img.html" %}'
-                "{% endwith %}",
+        new_content, ext_img_match = rich_content.extract_embed(
+            new_content, patterns.ext_img
+        )
+        if ext_img_match:
+            image_link = ext_img_match.group(1)
+            ext_img_embed = render_embed(
+                "external_img.html",
+                link=Markup(image_link),
                 full_size_media=full_size_media,
                 nsfw=nsfw,
             )
-            new_content = patterns.ext_img.sub("", new_content)
         else:
             ext_img_embed = "<!-- no valid external image links found -->"
 
         link_card = "<!-- no cards created -->"
         if card:
             if card.ready:
-                link_card = render_template("link-card.html", card=card, nsfw=nsfw)
+                link_card = render_embed("link-card.html", card=card, nsfw=nsfw)
 
-    new_content, _ = label_links(new_content)
+    new_content, _ = rich_content.label_links(new_content)
 
     if preserve_whitespace:
         # Preserve newlines
@@ -1010,7 +1123,7 @@ def parse_rich_content(
     # Convert mentions into anchor tags
     new_content = label_mentions(new_content)
     # Convert crabtags into anchor tags
-    new_content = label_crabtags(new_content)
+    new_content = rich_content.label_crabtags(new_content)
 
     if include_media:
         return new_content + giphy_embed + ext_img_embed + youtube_embed + link_card
@@ -1018,142 +1131,83 @@ def parse_rich_content(
         return new_content
 
 
-def label_links(
-    content: str, max_len: int = 35, include_markdown: bool = True
-) -> Tuple[str, List[str]]:
-    """Replace links with HTML tags.
+def render_embed(template_name: str, **context) -> str:
+    """Renders a media embed or link card template for molt content.
 
-    :param content: The text to parse.
-    :param max_len: Maximum length of visible URLs in characters.
-    :param include_markdown: Whether to parse markdown-style links
-        before unformatted ones. If markdown links are present then
-        this is necessary to avoid garbled output.
-    :returns: (new_content, list of urls found)
+    Unlike `render_template`, this skips the context processors (which query the
+    current user) and reuses Jinja's cached compiled template. Embed links come from
+    already escaped content, so pass them as `Markup`.
     """
-    output = content[:]
-    urls = list()
-    if include_markdown:
-        output, new_urls = label_md_links(output)
-        urls.extend(new_urls)
-    match = patterns.ext_link.search(output)
-    if match:
-        start, end = match.span()
-        url = match.group(2)
-        urls.append(url)
-        displayed_url = url if len(url) <= max_len else url[: max_len - 3] + "..."
-        url = prepend_http(url)
-
-        # Parse recursively before building output
-        recursive_content, recursive_urls = label_links(output[end:])
-        urls.extend(recursive_urls)
-
-        output = (
-            output[:start] + match.group(1),
-            f'<a href="{url}" class="no-onclick mention zindex-front" \
-            target="_blank">{displayed_url}</a>',
-            recursive_content,
-        )
-        output = "".join(output)
+    template = current_app.jinja_env.get_template(template_name)
+    return template.render(
+        sprite_url=config.SPRITE_URL, server_start=config.SERVER_START, **context
+    )
 
-    return output, urls
 
+def stored_rich_content(molt) -> str:
+    """Returns a molt's rich content, rendering it only if the stored copy is stale.
 
-def label_spoilers(content: str) -> str:
-    """Surround spoiler tags with proper HTML."""
-    output = content[:]
-    match = patterns.spoiler_tag.search(output)
-    if match:
-        start, end = match.span()
-        spoiler_text = match.group(1).strip()
-
-        # Parse recursively before building output
-        recursive_content = label_spoilers(output[end:])
-
-        output = (
-            output[:start],
-            '<span class="molt-content-spoiler" onclick="revealSpoiler(event);">'
-            + spoiler_text
-            + "</span>",
-            recursive_content,
-        )
-        output = "".join(output)
+    :param molt: `Molt` or fast-molt row
+    """
+    if molt.rendered_version == config.RENDER_VERSION and molt.rendered_content:
+        return molt.rendered_content
+    return parse_rich_content(molt.content, nsfw=molt.nsfw, card=molt.card)
 
-    return output
 
+# Lowercase username -> (whether it belongs to an active user, expiry time)
+mention_cache: Dict[str, Tuple[bool, float]] = dict()
 
-def label_md_links(content) -> Tuple[str, List[str]]:
-    """Replace markdown links with HTML tags.
 
-    :param content: The text to parse.
-    :returns: (new_content, list of urls found)
+def resolve_mentions(usernames: Iterable[str]) -> Set[str]:
+    """Returns which of `usernames` belong to active users, lowercased.
+
+    Answers are cached for `config.MENTION_CACHE_SECONDS`, and all usernames that
+    aren't cached are looked up with one query.
     """
-    output = content[:]
-    urls = list()
-    match = patterns.ext_md_link.search(output)
-    if match:
-        start, end = match.span()
-        url = prepend_http(match.group(2))
-        urls.append(url)
-        url_name = match.group(1)
-
-        # Parse recursively before building output
-        recursive_content, recursive_urls = label_md_links(output[end:])
-        urls.extend(recursive_urls)
-
-        output = [
-            output[:start],
-            f'<a href="{url}" class="no-onclick mention \
-            zindex-front" target="_blank">{url_name}</a>',
-            recursive_content,
-        ]
-        output = "".join(output)
-
-    return output, urls
-
-
-def label_mentions(content, absolute_url=False):
-    """Replace mentions with HTML links to users."""
-    output = content
-    match = patterns.mention.search(output)
-    base_url = config.BASE_URL if absolute_url else ""
-    if match:
-        start, end = match.span()
-        username_str = output[start:end].replace("<br>", "").strip("@ \t\n")
-        username = (
-            models.Crab.query.filter_by(deleted=False, banned=False)
-            .filter(models.Crab.username.ilike(username_str))
-            .first()
-        )
-        if username:
-            output = [
-                output[:start],
-                f'<a href="{base_url}/user/{match.group(1)}" \
-                target="_blank" class="no-onclick mention zindex-front"> \
-                {output[start:end]}</a>',
-                label_mentions(output[end:]),
-            ]
-            output = "".join(output)
+    now = time.monotonic()
+    usernames = {username.lower() for username in usernames}
+    mentionable = set()
+    missing = set()
+    for username in usernames:
+        cached = mention_cache.get(username)
+        if cached and cached[1] > now:
+            if cached[0]:
+                mentionable.add(username)
         else:
-            output = output[:end] + label_mentions(output[end:])
-    return output
-
-
-def label_crabtags(content, absolute_url=False):
-    """Replace crabtags with HTML links to crabtag exploration page."""
-    output = content
-    match = patterns.tag.search(output)
-    base_url = config.BASE_URL if absolute_url else ""
-    if match:
-        start, end = match.span()
-        output = [
-            output[:start],
-            f'<a href="{base_url}/crabtag/{match.group(1)}" \
-            target="_blank" class="no-onclick crabtag zindex-front"> \
-            {output[start:end]}</a>',
-            label_crabtags(output[end:]),
-        ]
-        output = "".join(output)
-    return output
+            missing.add(username)
+
+    if missing:
+        lowercase_username = func.lower(models.Crab.username)
+        found = {
+            row.username
+            for row in db.session.query(lowercase_username.label("username")).filter(
+                lowercase_username.in_(missing),
+                models.Crab.deleted == false(),
+                models.Crab.banned == false(),
+            )
+        }
+        if len(mention_cache) + len(missing) > config.MENTION_CACHE_SIZE:
+            mention_cache.clear()
+        expires = now + config.MENTION_CACHE_SECONDS
+        for username in missing:
+            mention_cache[username] = (username in found, expires)
+        mentionable |= found
+    return mentionable
+
+
+def forget_mentions(*usernames: Optional[str]):
+    """Drops cached `resolve_mentions` answers, e.g. when a user is renamed."""
+    for username in usernames:
+        if isinstance(username, str):
+            mention_cache.pop(username.lower(), None)
+
+
+def label_mentions(content: str, base_url: str = "") -> str:
+    """Links the mentions of active users in content, resolving them all at once."""
+    mentionable = resolve_mentions(rich_content.mentioned_usernames(content))
+    return rich_content.label_mentions(
+        content, lambda username: username.lower() in mentionable, base_url
+    )
 
 
 def trim_strip(value, length):
@@ -1223,10 +1277,3 @@ def pretty_url(url, length=35):
     if len(url) > length:
         url = f"{url[:length - 3]}..."
     return url
-
-
-def prepend_http(url: str) -> str:
-    """Prepends https:// if url has no protocol identifier."""
-    if not patterns.protocol_identifier.match(url):
-        return "https://" + url
-    return url